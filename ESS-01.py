@@ -16,6 +16,8 @@ Craft file >>> "ESS-01.craft"
 import krpc
 from time import sleep
 from toolkit.misc import findVessel
+from toolkit.streams import closeConnection
+from toolkit.telemetry import Telemetry
 from toolkit.vessel import deployFairing, getPartsByName, getPartsByTag,\
     twrRegulation, vesselChangeName, vesselDeorbit, vesselChangeType
 from toolkit.maneuvers import manCircularize, manInclination, manPeriapsis
@@ -27,23 +29,27 @@ def ascentGuidance():
     ap.target_roll = 90.0
     ap.engage()
 
-    while srfSpeed() < 75.0:
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax=2.5)
-    srfSpeed.remove()
+    frame = telemetry.next()
+    while frame.srfSpeed < 75.0:
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax=2.5)
+        frame = telemetry.next()
+    telemetry.remove('srfSpeed')
     ap.target_pitch = 75.0
 
-    while ssa() < 0.1:
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax=2.5)
-    ssa.remove()
+    frame = telemetry.next()
+    while frame.ssa < 0.1:
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax=2.5)
+        frame = telemetry.next()
+    telemetry.remove('ssa')
     ap.disengage()
     vessel.control.sas = True
     sleep(0.1)
     vessel.control.sas_mode = sc.SASMode.prograde
 
     mainTank = getPartsByName(vessel, "Kerbodyne S3-3600 Tank")[0]
-    liquidFuel = conn.add_stream(mainTank.resources.amount, 'LiquidFuel')
+    telemetry.add('liquidFuel', mainTank.resources.amount, 'LiquidFuel')
     firstStageSeparated = False
     fairingDeployed = False
     reached95 = False
@@ -51,49 +57,50 @@ def ascentGuidance():
     secEngine = getPartsByTag(vessel, 'Second Engine')[0]
     activeEngine = mainEngine
 
-    while apoapsisAlt() < tgtobt:
+    frame = telemetry.next()
+    while frame.apoapsisAlt < tgtobt:
 
-        if (meanAltitude() < 70000.0) and (apoapsisAlt() < 0.95 * tgtobt):
+        if (frame.meanAltitude < 70000.0) and \
+                (frame.apoapsisAlt < 0.95 * tgtobt):
             twrMax = 2.5
-        elif (meanAltitude() > 70000.0) and (apoapsisAlt() < 0.95 * tgtobt):
+        elif (frame.meanAltitude > 70000.0) and \
+                (frame.apoapsisAlt < 0.95 * tgtobt):
             twrMax = 1.5
-        elif apoapsisAlt() < tgtobt:
+        elif frame.apoapsisAlt < tgtobt:
             twrMax = 0.2
-        elif meanAltitude() < 70000.0:
+        elif frame.meanAltitude < 70000.0:
             twrMax = 0.0
         else:
             vessel.control.throttle = 0.0
             break
 
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax)
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax)
 
         if firstStageSeparated is False:
-            if liquidFuel() < 0.1:
-                liquidFuel.remove()
+            if frame.liquidFuel < 0.1:
+                telemetry.remove('liquidFuel')
                 vessel.control.throttle = 0.0
                 vessel.control.activate_next_stage()
                 firstStageSeparated = True
                 activeEngine = secEngine
 
-        if (meanAltitude() > 60000.0) and (fairingDeployed is False):
+        if (frame.meanAltitude > 60000.0) and (fairingDeployed is False):
             deployFairing(vessel)
             fairingDeployed = True
 
         if reached95 is False:
-            if apoapsisAlt() > (0.95 * tgtobt):
+            if frame.apoapsisAlt > (0.95 * tgtobt):
                 activeEngine.engine.thrust_limit = 0.05
                 reached95 = True
 
+        frame = telemetry.next()
+
     if fairingDeployed is False:
         deployFairing(vessel)
         fairingDeployed = True
 
-    thrust.remove()
-    throttle.remove()
-    vesselMass.remove()
-    apoapsisAlt.remove()
-    meanAltitude.remove()
+    telemetry.remove()
 
     if firstStageSeparated is False:
         vessel.control.activate_next_stage()
@@ -150,17 +157,18 @@ srf_rf = conn.space_center.ReferenceFrame.create_hybrid(
     position=vessel.orbit.body.reference_frame,
     rotation=vessel.surface_reference_frame)
 
-ssa = conn.add_stream(getattr, vessel.flight(K_rf), 'sideslip_angle')
-thrust = conn.add_stream(getattr, vessel, 'thrust')
-throttle = conn.add_stream(getattr, vessel.control, 'throttle')
-srfSpeed = conn.add_stream(getattr, vessel.flight(srf_rf), 'speed')
-vesselMass = conn.add_stream(getattr, vessel, 'mass')
-apoapsisAlt = conn.add_stream(getattr, vessel.orbit, 'apoapsis_altitude')
-meanAltitude = conn.add_stream(getattr, vessel.flight(), 'mean_altitude')
+telemetry = Telemetry(conn)
+telemetry.add('ssa', getattr, vessel.flight(K_rf), 'sideslip_angle')
+telemetry.add('thrust', getattr, vessel, 'thrust')
+telemetry.add('throttle', getattr, vessel.control, 'throttle')
+telemetry.add('srfSpeed', getattr, vessel.flight(srf_rf), 'speed')
+telemetry.add('vesselMass', getattr, vessel, 'mass')
+telemetry.add('apoapsisAlt', getattr, vessel.orbit, 'apoapsis_altitude')
+telemetry.add('meanAltitude', getattr, vessel.flight(), 'mean_altitude')
 
 tgtobt = 500000.0
 
 launch()
 
-conn.close()
+closeConnection(conn)
 sleep(1.0)
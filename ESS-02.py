@@ -15,12 +15,14 @@ Craft file >>> "ESS-02.craft"
 
 import krpc
 from time import sleep
-from toolkit.blackmagic import vesselOnTargetPlane
-from toolkit.calculations import angle, getOrbitalPeriod, relativeError
+from toolkit.craft import getCraft
 from toolkit.docking import dockVesselWithTarget, moveXFromTarget
-from toolkit.maneuvers import executeNextNode, manApoapsis, manKillRelVel,\
-    manPeriapsis, manPlane
+from toolkit.launch import waitLaunchWindow
+from toolkit.maneuvers import manKillRelVel, manOrbit, manPlane
 from toolkit.misc import findVessel
+from toolkit.rendezvous import manTransfer
+from toolkit.streams import closeConnection
+from toolkit.telemetry import Telemetry
 from toolkit.vessel import deployFairing, getPartsByName, getPartsByTag,\
     twrRegulation, vesselChangeName, vesselChangeType, vesselDeorbit
 
@@ -34,24 +36,28 @@ def ascent_guidance(heading):
     ap.target_roll = 90.0
     ap.engage()
 
-    while srfSpeed() < 75.0:
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax=2.5)
-    srfSpeed.remove()
+    frame = telemetry.next()
+    while frame.srfSpeed < 75.0:
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax=2.5)
+        frame = telemetry.next()
+    telemetry.remove('srfSpeed')
     ap.target_pitch = 75.0
     sleep(0.5)
 
-    while ssa() < 0.1:
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax=2.5)
-    ssa.remove()
+    frame = telemetry.next()
+    while frame.ssa < 0.1:
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax=2.5)
+        frame = telemetry.next()
+    telemetry.remove('ssa')
     ap.disengage()
     vessel.control.sas = True
     sleep(0.1)
     vessel.control.sas_mode = sc.SASMode.prograde
 
     mainTank = getPartsByName(vessel, "Kerbodyne S3-3600 Tank")[0]
-    liquidFuel = conn.add_stream(mainTank.resources.amount, 'LiquidFuel')
+    telemetry.add('liquidFuel', mainTank.resources.amount, 'LiquidFuel')
     firstStageSeparated = False
     fairingDeployed = False
     reached95 = False
@@ -59,49 +65,51 @@ def ascent_guidance(heading):
     secEngine = getPartsByTag(vessel, 'Second Engine')[0]
     activeEngine = mainEngine
 
-    while (apoapsisAlt() < tgtObt) or (meanAltitude() < 70000.0):
+    frame = telemetry.next()
+    while (frame.apoapsisAlt < tgtObt) or \
+            (frame.meanAltitude < 70000.0):
 
-        if (meanAltitude() < 70000.0) and (apoapsisAlt() < 0.95 * tgtObt):
+        if (frame.meanAltitude < 70000.0) and \
+                (frame.apoapsisAlt < 0.95 * tgtObt):
             twrMax = 2.5
-        elif (meanAltitude() > 70000.0) and (apoapsisAlt() < 0.95 * tgtObt):
+        elif (frame.meanAltitude > 70000.0) and \
+                (frame.apoapsisAlt < 0.95 * tgtObt):
             twrMax = 1.5
-        elif apoapsisAlt() < tgtObt:
+        elif frame.apoapsisAlt < tgtObt:
             twrMax = 0.2
-        elif meanAltitude() < 70000.0:
+        elif frame.meanAltitude < 70000.0:
             twrMax = 0.0
         else:
             vessel.control.throttle = 0.0
             break
 
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax)
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax)
 
         if firstStageSeparated is False:
-            if liquidFuel() < 0.1:
-                liquidFuel.remove()
+            if frame.liquidFuel < 0.1:
+                telemetry.remove('liquidFuel')
                 vessel.control.throttle = 0.0
                 vessel.control.activate_next_stage()
                 firstStageSeparated = True
                 activeEngine = secEngine
 
-        if (meanAltitude() > 60000.0) and (fairingDeployed is False):
+        if (frame.meanAltitude > 60000.0) and (fairingDeployed is False):
             deployFairing(vessel)
             fairingDeployed = True
 
         if reached95 is False:
-            if apoapsisAlt() > (0.95 * tgtObt):
+            if frame.apoapsisAlt > (0.95 * tgtObt):
                 activeEngine.engine.thrust_limit = 0.05
                 reached95 = True
 
+        frame = telemetry.next()
+
     if fairingDeployed is False:
         deployFairing(vessel)
         fairingDeployed = True
 
-    thrust.remove()
-    throttle.remove()
-    vesselMass.remove()
-    apoapsisAlt.remove()
-    meanAltitude.remove()
+    telemetry.remove()
 
     if firstStageSeparated is False:
         vessel.control.activate_next_stage()
@@ -114,30 +122,12 @@ def ascent_guidance(heading):
 
 def reachOrbit():
     """Control the vessel to reach the correct orbit."""
-    manPeriapsis(conn, tgtObt, atApsis='apoapsis', tolerance=0.001)
+    # Circular orbit, the planner picks the burn sequence and makes at most
+    # one correction pass (eccentricity ~ 1e-4)
+    manOrbit(conn, kerbin.equatorial_radius + tgtObt, 0.0, precision=1e-4,
+             tolerance=0.001)
     manPlane(conn, tolerance=0.001)
 
-    obt = vessel.orbit
-    apoapsisAlt = conn.add_stream(getattr, obt, 'apoapsis_altitude')
-    periapsisAlt = conn.add_stream(getattr, obt, 'periapsis_altitude')
-    eccentricity = conn.add_stream(getattr, obt, 'eccentricity')
-
-    while eccentricity() > 0.0001:
-        # Trying to get a perfectly circular orbit
-        apoErr = abs(relativeError(apoapsisAlt(), tgtObt))
-        periErr = abs(relativeError(periapsisAlt(), tgtObt))
-
-        if max(apoErr, periErr) == apoErr:
-            if periapsisAlt() > tgtObt:
-                manPeriapsis(conn, tgtObt, 'periapsis', tolerance=0.001)
-            else:
-                manApoapsis(conn, tgtObt, 'periapsis', tolerance=0.001)
-        else:
-            if apoapsisAlt() > tgtObt:
-                manPeriapsis(conn, tgtObt, 'apoapsis', tolerance=0.001)
-            else:
-                manApoapsis(conn, tgtObt, 'apoapsis', tolerance=0.001)
-
 
 def transferOrbit():
     """Plan and execute a transfer maneuver to the space station.
@@ -145,49 +135,11 @@ def transferOrbit():
     NB : the more circular the orbits, the closer the approach.
 
     """
-    mu = kerbin.gravitational_parameter
-    sma = (vessel.orbit.semi_major_axis + ess.orbit.semi_major_axis) / 2
-    transferTime = getOrbitalPeriod(sma, mu) / 2
-    transferAngle = 180.0 - (transferTime / ess.orbit.period) * 360.0
-
-    vesselAnglePerSec = 360.0 / vessel.orbit.period
-    essAnglePerSec = 360.0 / ess.orbit.period
-    angleVslEss1 = angle(vesselPos(), essPos())
-    while (angleVslEss1 < 1.0) or (angleVslEss1 > 189.0):
-        angleVslEss1 = angle(vesselPos(), essPos())
-        sleep(1)
-    sleep(1)
-    angleVslEss2 = angle(vesselPos(), essPos())
-    if angleVslEss1 < angleVslEss2:
-        angleVslEss = 360.0 - angle(vesselPos(), essPos())
-    else:
-        angleVslEss = angle(vesselPos(), essPos())
-
-    angleVariationPerSec = vesselAnglePerSec - essAnglePerSec
-
-    deltaAngle = angleVslEss - transferAngle
-    if deltaAngle < 0.0:
-        deltaAngle += 360.0
-    deltaTime = (deltaAngle / angleVariationPerSec)
-    transferNodeUt = ut() + deltaTime
-
-    mj = conn.mech_jeb
-    planner = mj.maneuver_planner
-    mj_apo = planner.operation_apoapsis
-    mj_apo.new_apoapsis = ess.orbit.apoapsis_altitude
-    node = mj_apo.make_node()
-    node.ut = transferNodeUt
-
-    if node.ut > ut() + 180:
-        sc.warp_to(node.ut - 120.0)
-        node.remove()
-        transferOrbit()
-    else:
-        executeNextNode(conn, tolerance=0.001, leadTime=5)
-        if sc.target_vessel is None:
-            sc.target_vessel = ess
-            sleep(1.0)
-        manKillRelVel(conn, tolerance=0.01, leadTime=5)
+    manTransfer(conn, ess, revolutions=5, tolerance=0.001, leadTime=5)
+    if sc.target_vessel is None:
+        sc.target_vessel = ess
+        sleep(1.0)
+    manKillRelVel(conn, tolerance=0.01, leadTime=5)
 
 
 def releasePayload():
@@ -203,11 +155,8 @@ def launch():
     """Execute the mission, from launch to orbit."""
     global vessel
     sc.target_vessel = ess
-    dir = vesselOnTargetPlane(conn, vessel, ess)
-    if dir == "north":
-        heading = 30
-    elif dir == "south":
-        heading = 150
+    # Single warp to the passage of the site under the plane of the station
+    heading = waitLaunchWindow(conn, vessel, ess)['azimuth']
     sleep(2)
 
     vessel.control.throttle = 1.0
@@ -230,11 +179,15 @@ def launch():
     vesselChangeType(vessel, sc.VesselType.station)
     sc.active_vessel = vessel
 
-    for dp in vessel.parts.docking_ports:
-        if dp.part.tag != "":
-            tag = dp.part.tag
-            vesselDP = dp
-            break
+    if dpTag is not None:
+        vesselDP = getPartsByTag(vessel, dpTag)[0].docking_port
+        tag = dpTag
+    else:
+        for dp in vessel.parts.docking_ports:
+            if dp.part.tag != "":
+                tag = dp.part.tag
+                vesselDP = dp
+                break
 
     essDP = getPartsByTag(ess, tag)[0].docking_port
     dockVesselWithTarget(conn, vessel, ess, vesselDP, essDP)
@@ -261,21 +214,25 @@ srf_rf = conn.space_center.ReferenceFrame.create_hybrid(
 
 ess = findVessel(conn, "ESS")
 
-ut = conn.add_stream(getattr, sc, 'ut')
-ssa = conn.add_stream(getattr, vessel.flight(K_rf), 'sideslip_angle')
-thrust = conn.add_stream(getattr, vessel, 'thrust')
-throttle = conn.add_stream(getattr, vessel.control, 'throttle')
-srfSpeed = conn.add_stream(getattr, vessel.flight(srf_rf), 'speed')
-vesselMass = conn.add_stream(getattr, vessel, 'mass')
-apoapsisAlt = conn.add_stream(getattr, vessel.orbit, 'apoapsis_altitude')
-meanAltitude = conn.add_stream(getattr, vessel.flight(), 'mean_altitude')
-
-vesselPos = conn.add_stream(vessel.position, K_nrrf)
-essPos = conn.add_stream(ess.position, K_nrrf)
+# Tag of the docking port, from the craft file (None if not found)
+craft = getCraft(vesselName)
+dpTag = None
+if craft is not None:
+    dpTag = next((P.tag for P in craft.byModule('ModuleDockingNode')
+                  if P.tag), None)
+
+telemetry = Telemetry(conn)
+telemetry.add('ssa', getattr, vessel.flight(K_rf), 'sideslip_angle')
+telemetry.add('thrust', getattr, vessel, 'thrust')
+telemetry.add('throttle', getattr, vessel.control, 'throttle')
+telemetry.add('srfSpeed', getattr, vessel.flight(srf_rf), 'speed')
+telemetry.add('vesselMass', getattr, vessel, 'mass')
+telemetry.add('apoapsisAlt', getattr, vessel.orbit, 'apoapsis_altitude')
+telemetry.add('meanAltitude', getattr, vessel.flight(), 'mean_altitude')
 
 tgtObt = 250000.0
 
 launch()
 
-conn.close()
+closeConnection(conn)
 sleep(1.0)
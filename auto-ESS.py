@@ -2,7 +2,9 @@
 
 import krpc
 from time import sleep
+from toolkit.streams import addStream
 from toolkit.ui import Panel
+from toolkit.wait import waitUntil
 
 
 def setUpPanel(missionNumber):
@@ -33,9 +35,8 @@ def setUpPanel(missionNumber):
     # Wait for check button to be clicked
     button1 = MC.buttons["Button1"]
     button1.text.color = (0.8, 0, 0)
-    check1Status = conn.add_stream(getattr, button1, 'clicked')
-    while check1Status() is False:
-        pass
+    check1Status = addStream(conn, getattr, button1, 'clicked')
+    waitUntil(check1Status, lambda clicked: clicked is True)
     check1Status.remove()
     button1.text.color = (0, 0.8, 0)
 
@@ -47,9 +48,8 @@ def setUpPanel(missionNumber):
     # Wait for launch button to be clicked
     button2 = MC.buttons["Button2"]
     button2.text.color = (0.8, 0, 0)
-    check2Status = conn.add_stream(getattr, button2, 'clicked')
-    while check2Status() is False:
-        pass
+    check2Status = addStream(conn, getattr, button2, 'clicked')
+    waitUntil(check2Status, lambda clicked: clicked is True)
     check2Status.remove()
     button2.text.color = (0, 0.8, 0)
 
@@ -0,0 +1,85 @@
+"""Benchmark the vector math of toolkit/calculations.py.
+
+Compare the scalar functions (one 3-tuple at a time) with their batched
+NumPy counterparts, for N = 1, 1e3 and 1e6 vectors.
+
+Run from the root of the repository :
+    python benchmarks/bench_calculations.py
+
+"""
+
+import math
+import os
+import sys
+from timeit import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from toolkit.calculations import angle, angles, distance, distances  # noqa
+
+
+def legacyDotproduct(u, v):
+    """Dot product, as written before the NumPy port."""
+    dp = u[0]*v[0] + u[1]*v[1] + u[2]*v[2]
+    return dp
+
+
+def legacyLength(u):
+    """Length, as written before the NumPy port."""
+    return math.sqrt(legacyDotproduct(u, u))
+
+
+def legacyAngle(u, v):
+    """Angle, as written before the NumPy port."""
+    rad_angle = math.acos(legacyDotproduct(u, v) /
+                          (legacyLength(u) * legacyLength(v)))
+    return rad_angle * 180.0 / math.pi
+
+
+def legacyDistance(a, b):
+    """Distance, as written before the NumPy port."""
+    return math.sqrt((a[0] - b[0])**2 + (a[1] - b[1])**2 + (a[2] - b[2])**2)
+
+
+def bench(label, func, number):
+    """Return the mean time of func (in seconds) and print it."""
+    t = timeit(func, number=number) / number
+    print("  %-28s %12.3f us" % (label, t * 1e6))
+    return t
+
+
+def main():
+    """Run the benchmarks."""
+    rng = np.random.default_rng(0)
+
+    for N in (1, 1000, 1000000):
+        U = rng.normal(size=(N, 3)) * 1e6
+        V = rng.normal(size=(N, 3)) * 1e6
+        # kRPC returns tuples of Python floats
+        tuplesU = [tuple(u) for u in U.tolist()]
+        tuplesV = [tuple(v) for v in V.tolist()]
+        pairs = list(zip(tuplesU, tuplesV))
+        number = max(1, 100000 // N)
+        print("N = %d" % N)
+
+        tOld = bench("legacy angle loop", lambda: [legacyAngle(u, v)
+                                                   for u, v in pairs], number)
+        tNew = bench("angle loop", lambda: [angle(u, v)
+                                            for u, v in pairs], number)
+        tVec = bench("angles (batched)", lambda: angles(U, V), number)
+        print("  speedup : scalar x%.1f, batched x%.1f"
+              % (tOld / tNew, tOld / tVec))
+
+        tOld = bench("legacy distance loop", lambda: [legacyDistance(u, v)
+                                                      for u, v in pairs],
+                     number)
+        tNew = bench("distance loop", lambda: [distance(u, v)
+                                               for u, v in pairs], number)
+        tVec = bench("distances (batched)", lambda: distances(U, V), number)
+        print("  speedup : scalar x%.1f, batched x%.1f"
+              % (tOld / tNew, tOld / tVec))
+
+
+if __name__ == '__main__':
+    main()
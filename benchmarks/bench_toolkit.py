@@ -0,0 +1,228 @@
+"""Benchmark the toolkit entry points against a mock connection.
+
+Each entry point runs against benchmarks/mock_krpc.py with an injected
+latency per RPC (0, 1, 5 and 20 ms by default). For each one, the best
+wall time of a call, the mean number of RPCs and of streams created per
+call are reported, with the peak of the Python allocations. The RPC
+count is what dominates the loop latency in game, the allocations are
+measured in a separate run (tracemalloc slows the code down).
+
+The results can be saved as a baseline, later runs are compared to it :
+    python benchmarks/bench_toolkit.py --save
+    python benchmarks/bench_toolkit.py --latency 0 5
+
+Run from the root of the repository.
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.mock_krpc import MockConnection  # noqa
+from toolkit.blackmagic import vesselOnTargetPlane  # noqa
+from toolkit.calculations import findClosestVessel  # noqa
+from toolkit.control import ControlState  # noqa
+from toolkit.docking import xPosControl, yPosControl, zPosControl  # noqa
+from toolkit.impact import GetImpactInfos  # noqa
+from toolkit.maneuvers import executeNextNode  # noqa
+from toolkit.streams import addStream, getStreamPool  # noqa
+from toolkit.vessel import getPartsByTag, twrRegulation  # noqa
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baselines', 'toolkit.json')
+LATENCIES = (0.0, 1.0, 5.0, 20.0)  # ms
+
+# A regression is reported above these ratios to the baseline
+TIME_TOLERANCE = 1.5
+ALLOC_TOLERANCE = 1.25
+
+# ... and above these differences, under which it is noise
+TIME_MARGIN = 0.005  # s
+ALLOC_MARGIN = 16.0  # KB
+
+
+def caseImpact(conn):
+    """GetImpactInfos on a suborbital trajectory."""
+    sc = conn.space_center
+    obt = sc.active_vessel.orbit
+    return lambda: GetImpactInfos(conn, obt)
+
+
+def caseClosestVessel(conn):
+    """findClosestVessel in a fleet of 50 vessels."""
+    vessel = conn.space_center.active_vessel
+    return lambda: findClosestVessel(conn, vessel, sphere=50000)
+
+
+def casePartsByTag(conn):
+    """getPartsByTag on a 200 parts vessel."""
+    vessel = conn.space_center.active_vessel
+    return lambda: getPartsByTag(vessel, 'SDP')
+
+
+def caseTwrRegulation(conn):
+    """One tick of twrRegulation on streams."""
+    vessel = conn.space_center.active_vessel
+    meanAltitude = addStream(conn, getattr, vessel.flight(), 'mean_altitude')
+    thrust = addStream(conn, getattr, vessel, 'thrust')
+    vesselMass = addStream(conn, getattr, vessel, 'mass')
+    throttle = addStream(conn, getattr, vessel.control, 'throttle')
+    return lambda: twrRegulation(vessel, meanAltitude, thrust, vesselMass,
+                                 throttle, twrMax=1.5)
+
+
+def caseDockingAxes(conn):
+    """One tick of the three docking axis controllers, then the flush."""
+    control = ControlState(conn, conn.space_center.active_vessel)
+    states = [((-5.0, 60.0, 3.0), (0.2, -0.5, 0.0)),
+              ((-4.9, 59.5, 3.0), (0.5, -0.9, -0.1)),
+              ((0.05, 50.0, -0.02), (0.1, 0.0, 0.08))]
+    tick = [0]
+
+    def run():
+        pos, vlc = states[tick[0] % len(states)]
+        tick[0] += 1
+        xPosControl(control, 0.0, pos[0], vlc[0])
+        yPosControl(control, 50.0, pos[1], vlc[1])
+        zPosControl(control, 0.0, pos[2], vlc[2])
+        control.flush()
+    return run
+
+
+def caseOnTargetPlane(conn):
+    """vesselOnTargetPlane, plane over the site 3000 s after the call."""
+    sc = conn.space_center
+    vessel = sc.active_vessel
+    target = sc.target_vessel
+
+    def run():
+        conn.resetPlane()
+        return vesselOnTargetPlane(conn, vessel, target)
+    return run
+
+
+def caseExecuteNextNode(conn):
+    """executeNextNode on a 10 s burn."""
+    def run():
+        conn.addNode()
+        executeNextNode(conn, tolerance=0.01, leadTime=5)
+    return run
+
+
+CASES = (('GetImpactInfos', caseImpact, 20),
+         ('findClosestVessel', caseClosestVessel, 5),
+         ('getPartsByTag', casePartsByTag, 5),
+         ('twrRegulation', caseTwrRegulation, 50),
+         ('dockingAxes', caseDockingAxes, 50),
+         ('vesselOnTargetPlane', caseOnTargetPlane, 3),
+         ('executeNextNode', caseExecuteNextNode, 3))
+
+
+def measure(setup, number, latency):
+    """Return the best wall time, mean RPCs and streams, peak allocation."""
+    conn = MockConnection(latency=latency / 1000.0, burnTime=10.0)
+    run = setup(conn)
+    run()  # Warm up the caches of the toolkit (fleet, parts, ...)
+    rpcs, streams = conn.rpcs, conn.streams
+    pool = getStreamPool(conn)
+    pooled = pool.created
+
+    wall = float('inf')
+    for _ in range(number):
+        t0 = perf_counter()
+        run()
+        wall = min(wall, perf_counter() - t0)
+
+    result = {'wall': wall,
+              'rpcs': (conn.rpcs - rpcs) / number,
+              'streams': (conn.streams - streams) / number,
+              'pooled': (pool.created - pooled) / number}
+
+    tracemalloc.start()
+    conn.latency = 0.0
+    run()
+    result['peakKB'] = tracemalloc.get_traced_memory()[1] / 1024.0
+    tracemalloc.stop()
+    return result
+
+
+def compare(result, base):
+    """Return the list of the regressions of result over base."""
+    regressions = []
+    if result['rpcs'] > base['rpcs']:
+        regressions.append("rpcs %.1f > %.1f" % (result['rpcs'],
+                                                  base['rpcs']))
+    if result['streams'] > base['streams']:
+        regressions.append("streams %.1f > %.1f" % (result['streams'],
+                                                     base['streams']))
+    if result['wall'] > TIME_TOLERANCE * base['wall'] and \
+            result['wall'] - base['wall'] > TIME_MARGIN:
+        regressions.append("wall x%.2f" % (result['wall'] / base['wall']))
+    if result['peakKB'] > ALLOC_TOLERANCE * base['peakKB'] and \
+            result['peakKB'] - base['peakKB'] > ALLOC_MARGIN:
+        regressions.append("alloc x%.2f" % (result['peakKB']
+                                             / base['peakKB']))
+    return regressions
+
+
+def main():
+    """Run the benchmarks, compare them to the baseline, save it."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--latency', type=float, nargs='+',
+                        default=LATENCIES, help="RPC latencies (ms)")
+    parser.add_argument('--case', nargs='+', help="entry points to run")
+    parser.add_argument('--baseline', default=BASELINE,
+                        help="baseline file (default : %(default)s)")
+    parser.add_argument('--save', action='store_true',
+                        help="save the results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = 0
+    for latency in args.latency:
+        key = "%gms" % latency
+        results[key] = {}
+        print("Latency %s per RPC" % key)
+        print("  %-20s %12s %8s %8s %8s %10s" % ("", "wall (ms)", "rpcs",
+                                                "streams", "pooled",
+                                                "peak (KB)"))
+        for name, setup, number in CASES:
+            if args.case and name not in args.case:
+                continue
+            result = measure(setup, number, latency)
+            results[key][name] = result
+            line = "  %-20s %12.3f %8.1f %8.1f %8.1f %10.1f" % (
+                name, result['wall'] * 1000, result['rpcs'],
+                result['streams'], result['pooled'], result['peakKB'])
+
+            base = baseline.get(key, {}).get(name)
+            if base is not None:
+                found = compare(result, base)
+                if found:
+                    regressions += 1
+                    line += "  REGRESSION : " + ", ".join(found)
+            print(line)
+
+    if args.save:
+        for key, cases in results.items():
+            baseline.setdefault(key, {}).update(cases)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print("Baseline saved to " + args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,408 @@
+"""Mock kRPC connection with a simulated game and injected RPC latency.
+
+Every attribute read, attribute write or method call on a remote object
+counts as one RPC and sleeps for the configured latency; the calls sent
+together by toolkit.batch.batchCall count as a single one. Stream reads are
+free, as with kRPC, but each one advances the simulated UT by one physics
+frame (times the warp rate) so that polling loops make progress.
+
+The simulated game contains :
+-an active vessel on a suborbital trajectory around Kerbin, with parts
+-a fleet of other vessels around it
+-a target vessel whose orbital plane passes over the launch site (latitude
+ and longitude 0) some time after reset
+-a maneuver node whose burn lasts 'burnTime' seconds at full thrust, the
+ remaining delta-v decreases with the throttle at each physics frame
+
+"""
+
+import math
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+
+# Kerbin
+MU = 3.5316e12
+RADIUS = 600000.0
+ROTATIONAL_PERIOD = 21549.425
+ROTATIONAL_SPEED = 2 * math.pi / ROTATIONAL_PERIOD
+
+# Rate of each rails warp factor
+RAILS_RATES = (1, 5, 10, 50, 100, 1000, 10000, 100000)
+
+# Duration of a physics frame, in seconds
+FRAME = 0.02
+
+# Active vessel : mass (kg), thrust (N) and specific impulse (s)
+MASS = 10000.0
+THRUST = 200000.0
+ISP = 300.0
+G0 = 9.80665
+
+
+class Property:
+    """Remote property computed from the mock connection."""
+
+    def __init__(self, getter, setter=None):
+        self.getter = getter
+        self.setter = setter
+
+
+class Method:
+    """Remote method."""
+
+    def __init__(self, func):
+        self.func = func
+
+
+class MockEnum:
+    """Enumeration, its values are plain strings."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, value):
+        if value.startswith('_'):
+            raise AttributeError(value)
+        return self._name + '.' + value
+
+
+class MockObject:
+    """Remote object : every attribute access is an RPC."""
+
+    def __init__(self, conn, label, local=None, **attributes):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_name', label)
+        object.__setattr__(self, '_local', local or {})
+        object.__setattr__(self, '_attributes', attributes)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._local:
+            return self._local[name]
+        try:
+            value = self._attributes[name]
+        except KeyError:
+            raise AttributeError("%s has no attribute %s"
+                                 % (self._name, name)) from None
+
+        if isinstance(value, Method):
+            func = value.func
+            label = self._name + '.' + name
+
+            def method(*args, **kwargs):
+                self._conn.call(label)
+                return func(*args, **kwargs)
+            method.__qualname__ = label
+            return method
+
+        self._conn.call(self._name + '.' + name)
+        if isinstance(value, Property):
+            return value.getter()
+        return value
+
+    def __setattr__(self, name, value):
+        self._conn.call(self._name + '.set_' + name)
+        current = self._attributes.get(name)
+        if isinstance(current, Property) and current.setter is not None:
+            current.setter(value)
+        else:
+            self._attributes[name] = value
+
+    def __repr__(self):
+        return "<Mock " + self._name + ">"
+
+
+class MockStream:
+    """Stream of a call, read without RPC."""
+
+    def __init__(self, conn, func, args):
+        self._conn = conn
+        self._func = func
+        self._args = args
+        self._callbacks = []
+        self.rate = 0.0
+        self.started = True
+
+    def __call__(self):
+        self._conn.frame()
+        return self._conn.evaluate(self._func, self._args)
+
+    @property
+    def condition(self):
+        return self._conn.condition
+
+    def start(self, wait=True):
+        pass
+
+    def wait(self, timeout=None):
+        """Wait for the next update, i.e. the next physics frame."""
+        self._conn.frame()
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def remove(self):
+        self._conn.call('remove_stream')
+        self._conn.liveStreams -= 1
+
+
+class MockConnection:
+    """Mock of the object returned by krpc.connect()."""
+
+    def __init__(self, latency=0.0, fleetSize=50, partCount=200, seed=0,
+                 burnTime=60.0):
+        """Build the simulated game.
+
+        Args:
+        -latency : duration of each RPC, in seconds (default : 0.0)
+        -fleetSize : number of other vessels (default : 50)
+        -partCount : number of parts of the active vessel (default : 200)
+        -seed : seed of the random positions (default : 0)
+        -burnTime : duration of a maneuver burn, in seconds (default : 60)
+
+        """
+        self.latency = latency
+        self.burnTime = burnTime
+        self.rpcs = 0
+        self.calls = Counter()
+        self.streams = 0
+        self.liveStreams = 0
+        self.counting = True
+        self.condition = threading.Condition()
+
+        self.ut = 10000.0
+        self.warp = 0
+        self.planeCrossing = self.ut + 3000.0
+        self.throttle = 1.0
+        self.nodeUt = None
+        self.deltaV = 0.0
+        self.remaining = 0.0
+        rng = np.random.default_rng(seed)
+
+        # Suborbital trajectory : apoapsis 80 km, periapsis 200 km below sea
+        # level, apoapsis reached at t0
+        self.sma = RADIUS + (80000.0 - 200000.0) / 2
+        self.ecc = (RADIUS + 80000.0 - self.sma) / self.sma
+        self.t0 = self.ut
+
+        kerbin = self.object(
+            'body',
+            name='Kerbin',
+            reference_frame=self.object('krf'),
+            non_rotating_reference_frame=self.object('knrrf'),
+            gravitational_parameter=MU,
+            equatorial_radius=RADIUS,
+            rotational_speed=ROTATIONAL_SPEED,
+            rotational_period=ROTATIONAL_PERIOD,
+            rotation_angle=Property(lambda: (ROTATIONAL_SPEED * self.ut)
+                                    % (2 * math.pi)),
+            surface_height=Method(lambda lat, lon: 100.0))
+        self.kerbin = kerbin
+
+        orbit = self.object(
+            'orbit', body=kerbin,
+            position_at=Method(self.positionAt),
+            apoapsis_altitude=80000.0,
+            periapsis_altitude=-200000.0,
+            time_to_periapsis=Property(lambda: 600.0))
+
+        parts = []
+        for i in range(partCount):
+            modules = [self.object('module', name=name)
+                       for name in ('ModuleEngines', 'ModuleDockingNode',
+                                    'ModuleDeployableSolarPanel')
+                       if rng.random() < 0.2]
+            parts.append(self.object(
+                'part', tag='SDP' if i % 20 == 0 else '',
+                title='Part %d' % (i % 30), name='part%d' % i,
+                modules=modules))
+
+        self.nodes = []
+        self.node = self.object(
+            'node', ut=Property(lambda: self.nodeUt),
+            delta_v=Property(lambda: self.deltaV),
+            remaining_delta_v=Property(lambda: abs(self.remaining)),
+            reference_frame=self.object('nrf'),
+            remaining_burn_vector=Method(
+                lambda frame=None: (0.0, self.remaining, 0.0)),
+            remove=Method(self.removeNode))
+        control = self.object(
+            'control', throttle=Property(lambda: self.throttle,
+                                         self.setThrottle), up=0.0, forward=0.0, right=0.0,
+            pitch=0.0, yaw=0.0, roll=0.0, sas=False, rcs=False,
+            nodes=Property(self.currentNodes))
+
+        self.vessel = self.newVessel('Active', (0.0, 0.0, 0.0), orbit,
+                                     control, self.object('parts', all=parts))
+        # The launch site is under the plane of the target when its inertial
+        # longitude (the rotation angle) is the longitude of the AN
+        targetOrbit = self.object(
+            'orbit', body=kerbin, inclination=0.5, semi_major_axis=700000.0,
+            longitude_of_ascending_node=Property(
+                lambda: (ROTATIONAL_SPEED * self.planeCrossing)
+                % (2 * math.pi)))
+        fleet = [self.newVessel('Vessel %d' % i, tuple(pos),
+                                targetOrbit if i == 0 else None)
+                 for i, pos in enumerate(rng.normal(size=(fleetSize, 3))
+                                         * 20000.0)]
+        self.target = fleet[0]
+
+        self.space_center = self.object(
+            'space_center',
+            local={'ReferenceFrame': self.object(
+                       'ReferenceFrame',
+                       create_hybrid=Method(self.createHybrid)),
+                   'DockingPortState': MockEnum('DockingPortState'),
+                   'SASMode': MockEnum('SASMode'),
+                   'SpeedMode': MockEnum('SpeedMode'),
+                   'VesselType': MockEnum('VesselType')},
+            ut=Property(lambda: self.ut),
+            active_vessel=self.vessel,
+            target_vessel=self.target,
+            vessels=Property(lambda: [self.vessel] + fleet),
+            bodies={'Kerbin': kerbin},
+            rails_warp_factor=Property(lambda: self.warp, self.setWarp),
+            physics_warp_factor=0,
+            warp_to=Method(self.warpTo))
+
+    def object(self, label, local=None, **attributes):
+        """Return a new remote object."""
+        return MockObject(self, label, local, **attributes)
+
+    def newVessel(self, name, position, orbit=None, control=None,
+                  parts=None):
+        """Return a new remote vessel at a fixed position."""
+        vessel = self.object(
+            'vessel', name=name, type='VesselType.ship',
+            position=Method(lambda frame: position),
+            velocity=Method(lambda frame: (0.0, 0.0, 0.0)),
+            mass=MASS, thrust=THRUST, available_thrust=THRUST,
+            specific_impulse=ISP,
+            auto_pilot=self.object(
+                'auto_pilot', reference_frame=None, target_direction=None,
+                engage=Method(lambda: None), disengage=Method(lambda: None),
+                wait=Method(lambda: None)),
+            reference_frame=self.object('vrf'),
+            orbital_reference_frame=self.object('orf'),
+            orbit=orbit, control=control, parts=parts,
+            flight=Method(lambda frame=None: self.object(
+                'flight', mean_altitude=Property(lambda: 20000.0),
+                speed=Property(lambda: 500.0), latitude=0.0,
+                longitude=0.0)))
+        object.__setattr__(vessel, '_client', self)
+        object.__setattr__(vessel, '_object_id', id(vessel))
+        return vessel
+
+    # Accounting
+
+    def call(self, name):
+        """Account for one RPC."""
+        if not self.counting:
+            return
+        self.rpcs += 1
+        self.calls[name] += 1
+        if self.latency > 0.0:
+            # Sleep, then spin for the last ms (sleep overshoots)
+            deadline = time.perf_counter() + self.latency
+            if self.latency > 0.002:
+                time.sleep(self.latency - 0.002)
+            while time.perf_counter() < deadline:
+                pass
+
+    def evaluate(self, func, args):
+        """Evaluate a stream call without accounting for RPCs."""
+        counting, self.counting = self.counting, False
+        try:
+            return func(*args)
+        finally:
+            self.counting = counting
+
+    def batchCalls(self, calls, raiseErrors=True):
+        """Make the (func, *args) calls of a batch, as a single RPC."""
+        self.call('batch')
+        counting, self.counting = self.counting, False
+        try:
+            results = []
+            for call in calls:
+                try:
+                    results.append(call[0](*call[1:]))
+                except Exception as e:
+                    if raiseErrors:
+                        raise
+                    results.append(e)
+            return results
+        finally:
+            self.counting = counting
+
+    def add_stream(self, func, *args):
+        """Return a stream of func(*args)."""
+        self.call('add_stream')
+        self.streams += 1
+        self.liveStreams += 1
+        return MockStream(self, func, args)
+
+    def close(self):
+        pass
+
+    # Simulation
+
+    def frame(self):
+        """Advance the game by one physics frame."""
+        dt = FRAME * RAILS_RATES[self.warp]
+        self.ut += dt
+        if self.nodes and self.warp == 0:
+            self.remaining -= self.throttle * THRUST / MASS * dt
+
+    def setWarp(self, factor):
+        self.warp = factor
+
+    def setThrottle(self, value):
+        self.throttle = value
+
+    def warpTo(self, ut, max_rails_rate=100000.0, max_physics_rate=2.0):
+        self.warp = 0
+        self.ut = max(self.ut, ut)
+
+    def resetPlane(self, delay=3000.0):
+        """Put the orbital plane of the target 'delay' seconds ahead."""
+        self.warp = 0
+        self.planeCrossing = self.ut + delay
+
+    def addNode(self, delay=600.0):
+        """Add a maneuver node 'delay' seconds ahead (without RPC)."""
+        self.nodes = [self.node]
+        self.nodeUt = self.ut + delay
+        self.deltaV = ISP * G0 * math.log(
+            MASS / (MASS - THRUST * self.burnTime / (ISP * G0)))
+        self.remaining = self.deltaV
+
+    def currentNodes(self):
+        return list(self.nodes)
+
+    def removeNode(self):
+        self.nodes = []
+
+    def createHybrid(self, position, rotation=None, velocity=None,
+                     angular_velocity=None):
+        return self.object('hybrid')
+
+    def positionAt(self, ut, frame):
+        """Kepler position of the active vessel, in the body frame."""
+        n = math.sqrt(MU / self.sma**3)
+        M = math.pi + n * (ut - self.t0)  # Apoapsis at t0
+        E = M
+        for _ in range(30):
+            E -= (E - self.ecc*math.sin(E) - M) / (1 - self.ecc*math.cos(E))
+        x = self.sma * (math.cos(E) - self.ecc)
+        z = self.sma * math.sqrt(1 - self.ecc**2) * math.sin(E)
+        theta = ROTATIONAL_SPEED * (ut - self.t0)
+        return (x*math.cos(theta) + z*math.sin(theta), 0.0,
+                -x*math.sin(theta) + z*math.cos(theta))
@@ -21,8 +21,12 @@ from time import sleep
 from toolkit.calculations import findClosestVessel
 from toolkit.maneuvers import manApoapsis, manCircularize, manInclination
 from toolkit.misc import countdown, wait
+from toolkit.streams import addStream, closeConnection
+from toolkit.telemetry import Telemetry
 from toolkit.vessel import deployAntennas, deployFairing, deploySolarPanels,\
-    getPartsByTag, toggleLights, twrRegulation, vesselDeorbit
+    getPartsByTag, toggleLights, twrRegulation, vesselChangeName,\
+    vesselChangeType, vesselDeorbit
+from toolkit.wait import waitUntil
 
 
 def launch():
@@ -39,23 +43,27 @@ def ascentGuidance():
     ap.target_roll = 90.0
     ap.engage()
 
-    while srfSpeed() < 75.0:
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax=2.5)
-    srfSpeed.remove()
+    frame = telemetry.next()
+    while frame.srfSpeed < 75.0:
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax=2.5)
+        frame = telemetry.next()
+    telemetry.remove('srfSpeed')
     ap.target_pitch = 75.0
 
-    while ssa() < 0.1:
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax=2.5)
-    ssa.remove()
+    frame = telemetry.next()
+    while frame.ssa < 0.1:
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax=2.5)
+        frame = telemetry.next()
+    telemetry.remove('ssa')
     ap.disengage()
     vessel.control.sas = True
     sleep(0.1)
     vessel.control.sas_mode = sc.SASMode.prograde
 
     mainTank = getPartsByTag(vessel, "MAIN_TANK")[0]
-    liquidFuel = conn.add_stream(mainTank.resources.amount, 'LiquidFuel')
+    telemetry.add('liquidFuel', mainTank.resources.amount, 'LiquidFuel')
     firstStageSeparated = False
     fairingDeployed = False
     reached95 = False
@@ -64,51 +72,52 @@ def ascentGuidance():
     activeEngine = mainEngine
 
     tgtObt = targetPeriapsis
-    while apoapsisAlt() < tgtObt:
+    frame = telemetry.next()
+    while frame.apoapsisAlt < tgtObt:
 
-        if (meanAltitude() < 70000.0) and (apoapsisAlt() < 0.95 * tgtObt):
+        if (frame.meanAltitude < 70000.0) and \
+                (frame.apoapsisAlt < 0.95 * tgtObt):
             twrMax = 2.5
-        elif (meanAltitude() > 70000.0) and (apoapsisAlt() < 0.95 * tgtObt):
+        elif (frame.meanAltitude > 70000.0) and \
+                (frame.apoapsisAlt < 0.95 * tgtObt):
             twrMax = 1.5
-        elif apoapsisAlt() < tgtObt:
+        elif frame.apoapsisAlt < tgtObt:
             twrMax = 0.2
-        elif meanAltitude() < 70000.0:
+        elif frame.meanAltitude < 70000.0:
             twrMax = 0.0
         else:
             vessel.control.throttle = 0.0
             break
 
-        twrRegulation(vessel, meanAltitude, thrust,
-                      vesselMass, throttle, twrMax)
+        twrRegulation(vessel, frame.meanAltitude, frame.thrust,
+                      frame.vesselMass, frame.throttle, twrMax)
 
         if firstStageSeparated is False:
-            if liquidFuel() < 0.1:
-                liquidFuel.remove()
+            if frame.liquidFuel < 0.1:
+                telemetry.remove('liquidFuel')
                 vessel.control.throttle = 0.0
                 vessel.control.activate_next_stage()
                 firstStageSeparated = True
                 activeEngine = secEngine
 
-        if (meanAltitude() > 60000.0) and (fairingDeployed is False):
+        if (frame.meanAltitude > 60000.0) and (fairingDeployed is False):
             deployFairing(vessel)
             toggleLights(vessel)
             fairingDeployed = True
 
         if reached95 is False:
-            if apoapsisAlt() > (0.95 * tgtObt):
+            if frame.apoapsisAlt > (0.95 * tgtObt):
                 activeEngine.engine.thrust_limit = 0.05
                 reached95 = True
 
+        frame = telemetry.next()
+
     if fairingDeployed is False:
         deployFairing(vessel)
         toggleLights(vessel)
         fairingDeployed = True
 
-    thrust.remove()
-    throttle.remove()
-    vesselMass.remove()
-    apoapsisAlt.remove()
-    meanAltitude.remove()
+    telemetry.remove()
 
     if firstStageSeparated is False:
         vessel.control.activate_next_stage()
@@ -128,7 +137,7 @@ def reachResonantOrbit():
 
 def deploySatellites():
     """Deploy the satellites at periapsis, one per orbit."""
-    timeToPeri = conn.add_stream(getattr, vessel.orbit, 'time_to_periapsis')
+    timeToPeri = addStream(conn, getattr, vessel.orbit, 'time_to_periapsis')
     leadTime = 75.0
     vessel.control.sas = True
 
@@ -142,8 +151,9 @@ def deploySatellites():
         sc.active_vessel = sat
 
         satID = str(N+1)
-        sat.name = "COMSAT-" + sat.orbit.body.name[:3].upper() + "-" + satID
-        sat.type = sc.VesselType.relay
+        vesselChangeName(sat, "COMSAT-" + sat.orbit.body.name[:3].upper() +
+                         "-" + satID)
+        vesselChangeType(sat, sc.VesselType.relay)
         
         sat.control.toggle_action_group(2)  # Activate engine
         manCircularize(conn, atApsis='periapsis')
@@ -154,9 +164,10 @@ def deploySatellites():
 
         wait(conn, waitTime=10.0)
         sc.active_vessel = vessel
-        while timeToPeri() < leadTime:
-            sleep(1)
-        
+        waitUntil(timeToPeri, lambda t: t >= leadTime)
+    timeToPeri.remove()
+
+
 # Resonant orbit for 9 satellite injections
 satNumber = 9
 targetApoapsis = 3367359.8
@@ -177,13 +188,14 @@ srf_rf = conn.space_center.ReferenceFrame.create_hybrid(
     position=vessel.orbit.body.reference_frame,
     rotation=vessel.surface_reference_frame)
 
-ssa = conn.add_stream(getattr, vessel.flight(K_rf), 'sideslip_angle')
-thrust = conn.add_stream(getattr, vessel, 'thrust')
-throttle = conn.add_stream(getattr, vessel.control, 'throttle')
-srfSpeed = conn.add_stream(getattr, vessel.flight(srf_rf), 'speed')
-vesselMass = conn.add_stream(getattr, vessel, 'mass')
-apoapsisAlt = conn.add_stream(getattr, vessel.orbit, 'apoapsis_altitude')
-meanAltitude = conn.add_stream(getattr, vessel.flight(), 'mean_altitude')
+telemetry = Telemetry(conn)
+telemetry.add('ssa', getattr, vessel.flight(K_rf), 'sideslip_angle')
+telemetry.add('thrust', getattr, vessel, 'thrust')
+telemetry.add('throttle', getattr, vessel.control, 'throttle')
+telemetry.add('srfSpeed', getattr, vessel.flight(srf_rf), 'speed')
+telemetry.add('vesselMass', getattr, vessel, 'mass')
+telemetry.add('apoapsisAlt', getattr, vessel.orbit, 'apoapsis_altitude')
+telemetry.add('meanAltitude', getattr, vessel.flight(), 'mean_altitude')
 
 # Mission Execution
 launch()
@@ -192,4 +204,4 @@ reachResonantOrbit()
 deploySatellites()
 vesselDeorbit(conn, vessel, rcs=False)
 
-conn.close()
+closeConnection(conn)
@@ -7,8 +7,10 @@ Payload :
 
 import krpc
 from time import sleep
+from toolkit.control import ControlLoop
+from toolkit.impact import ImpactTracker
+from toolkit.streams import addStream
 from toolkit.vessel import getVesselPitch
-from toolkit.impact import GetImpactInfos
 
 
 def maintainVerticalSpeed(maxSpeed=None, minSpeed=None):
@@ -43,8 +45,15 @@ def boostback():
 
     vessel.control.throttle = 0.2
     landingLongitude = -74.5
-    while GetImpactInfos(sc, obt).impactLongitude > landingLongitude:
-        sleep(0.01)
+
+    def onTarget():
+        """Return True once the impact point reached the landing longitude."""
+        impact = impactTracker.update()
+        # No impact (orbit above the ground) : keep burning
+        return (impact is not None) and \
+            (impact.impactLongitude <= landingLongitude)
+
+    ControlLoop(100.0, onTarget).run()
     vessel.control.throttle = 0.0
     vessel.control.sas = False
     vessel.control.rcs = False
@@ -61,9 +70,15 @@ def liftOff():
         sleep(0.1)
 
     vessel.control.sas = False
-    while getVesselPitch(vesselDirection) > 85.0:
-        vessel.control.yaw = -0.1 + (getVesselPitch(vesselDirection) - 85) / 25
-        sleep(0.01)
+
+    def pitchOver():
+        """Yaw until the pitch is below 85 degrees."""
+        pitch = getVesselPitch(vesselDirection)
+        if pitch <= 85.0:
+            return True
+        vessel.control.yaw = -0.1 + (pitch - 85) / 25
+
+    ControlLoop(100.0, pitchOver).run()
 
     vessel.control.yaw = 0.0
     vessel.control.sas = True
@@ -93,13 +108,19 @@ def propulsiveLanding():
     finsDeployed = False
     legsDeployed = False
     sasDisengaged = False
+    impactAltitude = 0.0  # terrain altitude of the last known impact
 
     # Waiting to enter dense atmosphere
     while vesselAlt() > 30000.0:
         sleep(0.1)
 
     # Reducing vertical speed
-    while vSpeed() < -10.0:
+    def suicideBurn():
+        """Burn at full throttle only when needed to stop at ground level."""
+        nonlocal finsDeployed, legsDeployed, impactAltitude
+        if vSpeed() >= -10.0:
+            return True
+
         # Deploying grid fins at 15km
         if (vesselAlt() < 15000.0) and (finsDeployed is False):
             vessel.control.brakes = True
@@ -110,20 +131,29 @@ def propulsiveLanding():
             vessel.control.gear = True
             legsDeployed = False
 
+        impact = impactTracker.update()
+        if impact is not None:
+            impactAltitude = impact.impactAltitude
+
         accGravity = g0 * (R / (R+vesselAlt()))**2
         accEngine = vesselMaxThrust() / vesselMass()
         acc = accEngine - accGravity
         dist = vSpeed()**2/(2 * acc) + \
-            GetImpactInfos(sc, obt).impactAltitude + 30.0
+            impactAltitude + 30.0
 
         if (dist > vesselAlt()) and (throttle() != 1.0):
             vessel.control.throttle = 1.0
         elif (dist < vesselAlt()) and (throttle() != 0.0):
             vessel.control.throttle = 0.0
-        sleep(0.01)
+
+    ControlLoop(100.0, suicideBurn).run()
 
     # Landing softly
-    while vSpeed() < -0.1:
+    def softLanding():
+        """Keep a slow descent until touchdown."""
+        nonlocal sasDisengaged
+        if vSpeed() >= -0.1:
+            return True
         maintainVerticalSpeed(maxSpeed=-4)
 
         if (vesselPitch() > 89.9) and (sasDisengaged is False):
@@ -131,7 +161,7 @@ def propulsiveLanding():
             vessel.control.sas_mode = sc.SASMode.stability_assist
             sasDisengaged = True
 
-        sleep(0.05)
+    ControlLoop(20.0, softLanding).run()
 
     # Turning main engine off
     vessel.control.throttle = 0.0
@@ -152,17 +182,18 @@ vsrf = vessel.surface_reference_frame
 R = 600000.0
 g0 = 9.81
 
-ut = conn.add_stream(getattr, sc, 'ut')
-ssa = conn.add_stream(getattr, vessel.flight(krf), 'sideslip_angle')
-vSpeed = conn.add_stream(getattr, vessel.flight(vrf), 'vertical_speed')
-throttle = conn.add_stream(getattr, vessel.control, 'throttle')
-srfSpeed = conn.add_stream(getattr, vessel.flight(vrf), 'speed')
-vesselAlt = conn.add_stream(getattr, vessel.flight(), 'mean_altitude')
-vesselMass = conn.add_stream(getattr, vessel, 'mass')
-vesselPitch = conn.add_stream(getattr, vessel.flight(), 'pitch')
-apoapsisAlt = conn.add_stream(getattr, vessel.orbit, 'apoapsis_altitude')
-vesselDirection = conn.add_stream(vessel.direction, vsrf)
-vesselMaxThrust = conn.add_stream(getattr, vessel, 'available_thrust')
+ut = addStream(conn, getattr, sc, 'ut')
+ssa = addStream(conn, getattr, vessel.flight(krf), 'sideslip_angle')
+vSpeed = addStream(conn, getattr, vessel.flight(vrf), 'vertical_speed')
+throttle = addStream(conn, getattr, vessel.control, 'throttle')
+srfSpeed = addStream(conn, getattr, vessel.flight(vrf), 'speed')
+vesselAlt = addStream(conn, getattr, vessel.flight(), 'mean_altitude')
+vesselMass = addStream(conn, getattr, vessel, 'mass')
+vesselPitch = addStream(conn, getattr, vessel.flight(), 'pitch')
+apoapsisAlt = addStream(conn, getattr, vessel.orbit, 'apoapsis_altitude')
+vesselDirection = addStream(conn, vessel.direction, vsrf)
+vesselMaxThrust = addStream(conn, getattr, vessel, 'available_thrust')
+impactTracker = ImpactTracker(conn, vessel)
 
 ###############################################################################
 
@@ -0,0 +1,101 @@
+"""Check the compiled cache of the craft files against a fresh parse.
+
+Run from the root of the repository : python -m pytest tests
+"""
+
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from toolkit.craft import CACHE_MAGIC, CACHE_SUFFIX, HEADER_SIZE, \
+    findCraftFiles, loadCraft, readConfigNode, readCraft  # noqa
+
+
+CRAFTS = findCraftFiles()
+
+
+def _parts(craft):
+    """Return the fields of the parts of a craft, parents by id."""
+    return [tuple(getattr(P, name) for name in P.__slots__
+                  if name != 'parent') +
+            (None if P.parent is None else P.parent.id,)
+            for P in craft.parts]
+
+
+def _nodes(node):
+    """Return a ConfigNode tree as nested tuples."""
+    return (node.name, node.values, [_nodes(child) for child in node.nodes])
+
+
+def _copy(path, directory):
+    """Copy a craft file, without its cache."""
+    copy = os.path.join(str(directory), os.path.basename(path))
+    shutil.copyfile(path, copy)
+    return copy
+
+
+def _assertFresh(craft, path):
+    """Check a craft against the parse of its file."""
+    fresh = readCraft(path)
+    assert _parts(craft) == _parts(fresh)
+    assert craft.values == fresh.values
+    assert craft.ship == fresh.ship
+
+
+def test_craftFiles():
+    assert len(CRAFTS) == 9
+
+
+@pytest.mark.parametrize('path', CRAFTS, ids=os.path.basename)
+def test_cacheRoundTrip(path, tmp_path):
+    path = _copy(path, tmp_path)
+    compiled = loadCraft(path)  # Writes the cache
+    assert os.path.exists(path + CACHE_SUFFIX)
+    cached = loadCraft(path)  # Maps the cache
+    _assertFresh(compiled, path)
+    _assertFresh(cached, path)
+    assert _nodes(cached.tree()) == _nodes(readConfigNode(path))
+    assert cached.parts
+    assert np.array_equal(cached.table['istg'],
+                          [P.istg for P in cached.parts])
+
+
+def test_staleCache(tmp_path):
+    path = _copy(CRAFTS[0], tmp_path)
+    loadCraft(path)
+    with open(path + CACHE_SUFFIX, 'rb') as f:
+        cache = f.read()
+
+    # Tag a part : the cache of the old file is not used
+    with open(path, encoding='utf-8-sig') as f:
+        text = f.read()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text.replace('nameTag = ', 'nameTag = stale', 1))
+    craft = loadCraft(path)
+    _assertFresh(craft, path)
+    assert any(P.tag.startswith('stale') for P in craft.parts)
+    with open(path + CACHE_SUFFIX, 'rb') as f:
+        assert f.read() != cache
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda cache: cache[:HEADER_SIZE + 100],  # Truncated
+    lambda cache: b'KCRAFT00' + cache[len(CACHE_MAGIC):],  # Other version
+    lambda cache: cache[:HEADER_SIZE - 16] +  # Section out of the file
+    np.array([len(cache), 1], dtype='<i8').tobytes() + cache[HEADER_SIZE:],
+    lambda cache: b''])
+def test_corruptCache(corrupt, tmp_path):
+    path = _copy(CRAFTS[0], tmp_path)
+    loadCraft(path)
+    with open(path + CACHE_SUFFIX, 'rb') as f:
+        cache = f.read()
+    with open(path + CACHE_SUFFIX, 'wb') as f:
+        f.write(corrupt(cache))
+
+    _assertFresh(loadCraft(path), path)
+    with open(path + CACHE_SUFFIX, 'rb') as f:
+        assert f.read() == cache  # Written again
@@ -0,0 +1,111 @@
+"""Check the impact predictions against a Kepler propagation.
+
+Run from the root of the repository : python -m pytest tests
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from toolkit.impact import GetImpactInfos  # noqa
+from toolkit.rendezvous import stateAt  # noqa
+
+
+MU = 3.5316e12
+RADIUS = 600000.0
+
+
+class Body:
+    """Non rotating body, with a flat terrain."""
+
+    reference_frame = 'krf'
+    gravitational_parameter = MU
+    equatorial_radius = RADIUS
+    rotational_speed = 0.0
+
+    def surface_height(self, latitude, longitude):
+        return 0.0
+
+
+class Orbit:
+    """Keplerian orbit, whose elements can be changed (a burn)."""
+
+    def __init__(self, elements):
+        self.body = Body()
+        self.setElements(elements)
+
+    def setElements(self, elements):
+        self.elements = elements
+        self.apoapsis_altitude = elements['sma'] * (1 + elements['ecc']) \
+            - RADIUS
+        self.periapsis_altitude = elements['sma'] * (1 - elements['ecc']) \
+            - RADIUS
+
+    def position_at(self, ut, frame):
+        x, y, z = stateAt(self.elements, ut)[0]
+        return (x, z, y)  # z north -> y north
+
+
+class SpaceCenter:
+    ut = 0.0
+
+
+class Connection:
+    """Stand-in of the connection, the calls are made one by one."""
+
+    def __init__(self):
+        self.space_center = SpaceCenter()
+
+
+def _elements(ut, apoapsisAlt, periapsisAlt):
+    """Return the elements of an orbit that is at apoapsis at ut."""
+    rA, rP = RADIUS + apoapsisAlt, RADIUS + periapsisAlt
+    return {'ut': ut, 'mu': MU, 'sma': (rA + rP) / 2,
+            'ecc': (rA - rP) / (rA + rP), 'inc': 0.3, 'lan': 0.5,
+            'argPe': 1.2, 'meanAnomaly': math.pi}
+
+
+def _keplerImpact(elements, ut):
+    """Return the first ut after ut at which the orbit reaches sea level,
+    by bisection on the propagated positions."""
+    def altitude(t):
+        return np.linalg.norm(stateAt(elements, t)[0]) - RADIUS
+
+    step = 1.0
+    while altitude(ut + step) > 0.0:
+        ut += step
+    low, high = ut, ut + step
+    for _ in range(60):
+        middle = (low + high) / 2
+        if altitude(middle) > 0.0:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def test_impactMatchesKepler():
+    conn = Connection()
+    elements = _elements(1000.0, 30000.0, -300000.0)
+    obt = Orbit(elements)
+    conn.space_center.ut = 1000.0
+    infos = GetImpactInfos(conn, obt)
+    assert abs(infos.impactTime - _keplerImpact(elements, 1000.0)) < 0.01
+
+
+def test_impactAfterOrbitChange():
+    conn = Connection()
+    obt = Orbit(_elements(1000.0, 100000.0, 80000.0))
+    conn.space_center.ut = 1000.0
+    assert GetImpactInfos(conn, obt) is None  # Stable orbit
+
+    # Burn to a low suborbital arc : 100 s ago, this arc was underground
+    elements = _elements(1100.0, 20000.0, -500000.0)
+    obt.setElements(elements)
+    conn.space_center.ut = 1100.0
+    infos = GetImpactInfos(conn, obt)
+    assert infos.impactTime > 1100.0
+    assert abs(infos.impactTime - _keplerImpact(elements, 1100.0)) < 0.01
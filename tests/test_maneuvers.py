@@ -0,0 +1,324 @@
+"""Check the planned maneuvers by applying them to a Kepler propagation.
+
+Run from the root of the repository : python -m pytest tests
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from mock_krpc import MockConnection  # noqa
+import toolkit.maneuvers  # noqa
+from toolkit.maneuvers import MIN_THROTTLE, THROTTLE_STEP, NodeExecutor, \
+    getOrbitAxes, manOrbit, planApoapsis, planInclination, planOrbit, \
+    planPeriapsis, planPlane  # noqa
+from toolkit.rendezvous import stateAt  # noqa
+
+
+MU = 3.5316e12
+RADIUS = 600000.0
+SOI = 84159286.0
+
+
+def _elements(sma, ecc, inc=0.0, lan=0.0, argPe=0.0, meanAnomaly=0.0,
+              ut=1000.0):
+    """Return the elements of an orbit around Kerbin."""
+    return {'ut': ut, 'mu': MU, 'radius': RADIUS, 'soi': SOI, 'sma': sma,
+            'ecc': ecc, 'inc': inc, 'lan': lan, 'argPe': argPe,
+            'meanAnomaly': meanAnomaly}
+
+
+def _elementsFromState(r, v, ut):
+    """Return the elements of the orbit of the state vectors at ut."""
+    h = np.cross(r, v)
+    hHat = h / np.linalg.norm(h)
+    rad = np.linalg.norm(r)
+    eVec = ((np.dot(v, v) - MU / rad) * r - np.dot(r, v) * v) / MU
+    ecc = np.linalg.norm(eVec)
+    node = np.cross((0.0, 0.0, 1.0), h)
+    lan = math.atan2(node[1], node[0]) if np.linalg.norm(node) > 1e-9 \
+        else 0.0
+    nodeHat = np.array((math.cos(lan), math.sin(lan), 0.0))
+    P = eVec / ecc if ecc > 1e-12 else nodeHat
+    argPe = math.atan2(np.dot(P, np.cross(hHat, nodeHat)),
+                       np.dot(P, nodeHat))
+    nu = math.atan2(np.dot(r, np.cross(hHat, P)), np.dot(r, P))
+    E = math.atan2(math.sqrt(1 - ecc**2) * math.sin(nu), ecc + math.cos(nu))
+    return _elements(1.0 / (2.0 / rad - np.dot(v, v) / MU), ecc,
+                     math.acos(hHat[2]), lan, argPe, E - ecc * math.sin(E),
+                     ut)
+
+
+def _applyNodes(elements, nodes):
+    """Return the elements after the impulsive burns of the nodes
+    (ut, prograde, normal, radial), in order."""
+    for ut, prograde, normal, radial in nodes:
+        r, v = stateAt(elements, ut)
+        progradeHat = v / np.linalg.norm(v)
+        normalHat = np.cross(r, v)
+        normalHat /= np.linalg.norm(normalHat)
+        radialHat = np.cross(progradeHat, normalHat)
+        v = v + prograde * progradeHat + normal * normalHat + \
+            radial * radialHat
+        elements = _elementsFromState(r, v, ut)
+    return elements
+
+
+class Body:
+    gravitational_parameter = MU
+    equatorial_radius = RADIUS
+    sphere_of_influence = SOI
+
+
+class Orbit:
+    """Orbit of the vessel, read from its elements."""
+
+    body = Body()
+    names = {'semi_major_axis': 'sma', 'eccentricity': 'ecc',
+             'inclination': 'inc', 'longitude_of_ascending_node': 'lan',
+             'argument_of_periapsis': 'argPe', 'mean_anomaly': 'meanAnomaly'}
+
+    def __init__(self, elements):
+        self.elements = elements
+
+    def __getattr__(self, name):
+        if name in Orbit.names:
+            return self.elements[Orbit.names[name]]
+        raise AttributeError(name)
+
+
+class Control:
+    def __init__(self):
+        self.nodes = []
+
+    def add_node(self, ut, prograde=0.0, normal=0.0, radial=0.0):
+        self.nodes.append((ut, prograde, normal, radial))
+
+
+class Vessel:
+    def __init__(self, elements):
+        self.orbit = Orbit(elements)
+        self.control = Control()
+
+
+class SpaceCenter:
+    def __init__(self, elements):
+        self.active_vessel = Vessel(elements)
+
+    @property
+    def ut(self):
+        return self.active_vessel.orbit.elements['ut']
+
+
+class Connection:
+    """Stand-in of the connection, whose vessel follows the elements."""
+
+    def __init__(self, elements):
+        self.space_center = SpaceCenter(elements)
+        self.executed = []
+
+    def executeNextNode(self, conn, tolerance, leadTime):
+        """Burn the next node impulsively."""
+        vessel = self.space_center.active_vessel
+        node = vessel.control.nodes.pop(0)
+        vessel.orbit.elements = _applyNodes(vessel.orbit.elements, [node])
+        self.executed.append(node)
+
+
+def _apsides(elements):
+    return (elements['sma'] * (1 - elements['ecc']),
+            elements['sma'] * (1 + elements['ecc']))
+
+
+def _deltaV(nodes):
+    return sum(math.sqrt(p**2 + n**2 + r**2) for _, p, n, r in nodes)
+
+
+def test_planPeriapsis():
+    elements = _elements(900000.0, 0.1, inc=0.2, lan=0.4, argPe=0.7,
+                         meanAnomaly=1.0)
+    node = planPeriapsis(elements, 150000.0, 'apoapsis')
+    r = stateAt(elements, node[0])[0]
+    assert abs(np.linalg.norm(r) - _apsides(elements)[1]) < 1e-3
+    assert node[2] == node[3] == 0.0
+
+    final = _applyNodes(elements, [node])
+    assert np.allclose(_apsides(final),
+                       (RADIUS + 150000.0, _apsides(elements)[1]), rtol=1e-9)
+
+    # Above the burn : circularized
+    final = _applyNodes(elements, [planPeriapsis(elements, 1e6,
+                                                 'apoapsis')])
+    assert final['ecc'] < 1e-9
+
+
+def test_planApoapsis():
+    elements = _elements(900000.0, 0.1, inc=0.2, lan=0.4, argPe=0.7,
+                         meanAnomaly=4.0)
+    node = planApoapsis(elements, 2000000.0, 'periapsis')
+    r = stateAt(elements, node[0])[0]
+    assert abs(np.linalg.norm(r) - _apsides(elements)[0]) < 1e-3
+
+    final = _applyNodes(elements, [node])
+    assert np.allclose(_apsides(final),
+                       (_apsides(elements)[0], RADIUS + 2000000.0),
+                       rtol=1e-9)
+
+    # Below the burn : circularized
+    final = _applyNodes(elements, [planApoapsis(elements, 0.0,
+                                                'periapsis')])
+    assert final['ecc'] < 1e-9
+
+
+def test_planInclination():
+    # The ascending node (meanAnomaly 4.0) or the descending node first,
+    # neither of them at an apsis
+    for meanAnomaly in (4.0, 1.0):
+        elements = _elements(900000.0, 0.1, inc=0.2, lan=0.4, argPe=0.7,
+                             meanAnomaly=meanAnomaly)
+        for inc in (0.5, 0.05):
+            node = planInclination(elements, inc)
+            final = _applyNodes(elements, [node])
+            assert abs(final['inc'] - inc) < 1e-6
+            assert abs(final['lan'] - elements['lan']) < 1e-6
+            assert abs(final['argPe'] - elements['argPe']) < 1e-6
+            assert np.allclose(_apsides(final), _apsides(elements),
+                               rtol=1e-6)
+
+
+def test_planPlane():
+    elements = _elements(900000.0, 0.1, inc=0.2, lan=0.4, argPe=0.7,
+                         meanAnomaly=1.0)
+    for target in (_elements(1500000.0, 0.0, inc=0.5, lan=1.2),
+                   _elements(1500000.0, 0.0, inc=2.8, lan=-0.5)):
+        node = planPlane(elements, target)
+        assert node[0] > elements['ut']
+        final = _applyNodes(elements, [node])
+        assert np.allclose(getOrbitAxes(final)[2], getOrbitAxes(target)[2],
+                           atol=1e-6)
+        assert np.allclose(_apsides(final), _apsides(elements), rtol=1e-6)
+
+
+def test_suborbitalCircularization():
+    # Apoapsis at 80 km, periapsis underground, just after the periapsis
+    apoapsis, periapsis = RADIUS + 80000.0, RADIUS - 200000.0
+    elements = _elements((apoapsis + periapsis) / 2,
+                         (apoapsis - periapsis) / (apoapsis + periapsis),
+                         meanAnomaly=0.5)
+    nodes = planOrbit(elements, apoapsis)
+    assert len(nodes) == 1
+    assert nodes[0][0] > elements['ut']
+
+    final = _applyNodes(elements, nodes)
+    assert np.allclose(_apsides(final), (apoapsis, apoapsis), rtol=1e-9)
+
+
+def test_hohmannTransfer():
+    elements = _elements(700000.0, 0.0, meanAnomaly=1.0)
+    nodes = planOrbit(elements, 2000000.0)
+    assert len(nodes) == 2
+    assert nodes[0][0] < nodes[1][0]
+
+    final = _applyNodes(elements, nodes)
+    assert np.allclose(_apsides(final), (2000000.0, 2000000.0), rtol=1e-9)
+
+
+def test_biellipticTransfer():
+    # Radius ratio of 20 : a bi-elliptic transfer is cheaper
+    elements = _elements(700000.0, 0.0, meanAnomaly=1.0)
+    nodes = planOrbit(elements, 14000000.0)
+    assert len(nodes) == 3
+    assert nodes[0][0] < nodes[1][0] < nodes[2][0]
+
+    hohmann = planOrbit(dict(elements, soi=14000000.0), 14000000.0)
+    assert len(hohmann) == 2
+    assert _deltaV(nodes) < _deltaV(hohmann)
+
+    final = _applyNodes(elements, nodes)
+    assert np.allclose(_apsides(final), (14000000.0, 14000000.0),
+                       rtol=1e-9)
+
+
+def test_planeChangeOnFinalOrbit():
+    elements = _elements(700000.0, 0.0, inc=0.1, lan=0.4, argPe=0.7,
+                         meanAnomaly=2.0)
+    nodes = planOrbit(elements, 900000.0, 0.05, inc=0.3)
+    assert len(nodes) == 3
+    assert nodes[0][0] < nodes[1][0] < nodes[2][0]
+    assert nodes[0][2] == nodes[1][2] == 0.0  # In plane
+    assert nodes[2][2] != 0.0
+
+    final = _applyNodes(elements, nodes)
+    assert np.allclose(_apsides(final), (900000.0 * 0.95, 900000.0 * 1.05),
+                       rtol=1e-9)
+    assert abs(final['inc'] - 0.3) < 1e-9
+
+
+def test_manOrbit(monkeypatch):
+    conn = Connection(_elements(700000.0, 0.01, inc=0.1, argPe=0.7))
+    monkeypatch.setattr(toolkit.maneuvers, 'executeNextNode',
+                        conn.executeNextNode)
+    manOrbit(conn, 900000.0, newInclination=10.0)
+
+    # Three planned burns, no correction needed
+    assert len(conn.executed) == 3
+    assert conn.space_center.active_vessel.control.nodes == []
+    final = conn.space_center.active_vessel.orbit.elements
+    assert np.allclose(_apsides(final), (900000.0, 900000.0), rtol=1e-6)
+    assert abs(final['inc'] - math.radians(10.0)) < 1e-9
+
+
+class ThrottleConnection(MockConnection):
+    """Mock connection recording the throttle commands."""
+
+    def __init__(self, **kwargs):
+        self.commands = []
+        MockConnection.__init__(self, **kwargs)
+
+    def setThrottle(self, value):
+        self.commands.append(value)
+        MockConnection.setThrottle(self, value)
+
+
+def test_throttleStepDown():
+    conn = ThrottleConnection(burnTime=10.0)
+    conn.addNode()
+    left = NodeExecutor(conn, tolerance=0.01).run()
+
+    # Full thrust, then each command a step below the previous one
+    burn = conn.commands[1:-1]
+    assert conn.commands[0] == conn.commands[-1] == 0.0
+    assert burn[0] == 1.0
+    for previous, command in zip(burn, burn[1:]):
+        assert MIN_THROTTLE <= command < THROTTLE_STEP * previous
+    assert burn[-1] < MIN_THROTTLE / THROTTLE_STEP
+
+    assert left <= 0.01
+    assert abs(conn.remaining) < 0.1
+    assert conn.nodes == []
+    assert conn.liveStreams == 0
+
+
+class FailingConnection(MockConnection):
+    """Mock connection whose node can not be removed."""
+
+    def removeNode(self):
+        raise RuntimeError("Node not removed")
+
+
+def test_releaseOnError():
+    conn = FailingConnection(burnTime=10.0)
+    conn.addNode()
+    executor = NodeExecutor(conn)
+    completed = executor.start()
+    with pytest.raises(RuntimeError):
+        executor.wait(10.0)
+    assert completed.is_set()
+    assert conn.throttle == 0.0
+    assert conn.liveStreams == 0
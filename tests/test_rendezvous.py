@@ -0,0 +1,138 @@
+"""Check the Lambert transfers against a numerical propagation.
+
+Run from the root of the repository : python -m pytest tests
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from toolkit.calculations import lambert  # noqa
+from toolkit.rendezvous import planLambertTransfer, porkchop, \
+    stateAt  # noqa
+
+
+MU = 3.5316e12
+
+
+def _propagate(r, v, tof, steps=4000):
+    """Return the (position, velocity) after tof seconds of two body
+    motion, integrated with RK4 (vectorized over the first axis)."""
+    def derivative(state):
+        position = state[..., :3]
+        distance = np.linalg.norm(position, axis=-1)[..., None]
+        return np.concatenate((state[..., 3:], -MU * position / distance**3),
+                              axis=-1)
+
+    state = np.concatenate((r, v), axis=-1)
+    dt = np.asarray(tof, dtype=float)[..., None] / steps
+    for _ in range(steps):
+        k1 = derivative(state)
+        k2 = derivative(state + dt / 2 * k1)
+        k3 = derivative(state + dt / 2 * k2)
+        k4 = derivative(state + dt * k3)
+        state = state + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+    return state[..., :3], state[..., 3:]
+
+
+def _elements(sma, ecc, inc, lan, argPe, meanAnomaly, ut=1000.0):
+    """Return the elements of an orbit around Kerbin."""
+    return {'ut': ut, 'mu': MU, 'sma': sma, 'ecc': ecc, 'inc': inc,
+            'lan': lan, 'argPe': argPe, 'meanAnomaly': meanAnomaly}
+
+
+def test_lambertReachesTarget():
+    r1 = np.array((700000.0, 0.0, 0.0))
+    angles = np.radians((30.0, 100.0, 170.0, 250.0, 100.0))
+    r2 = 900000.0 * np.stack((np.cos(angles), np.sin(angles),
+                              (0.0, 0.0, 0.0, 0.0, 0.3)), axis=-1)
+    tof = np.array((600.0, 1500.0, 1800.0, 3000.0, 20.0))  # Last : hyperbola
+    v1, v2 = lambert(r1, r2, tof, MU)
+    assert not np.isnan(v1).any()
+
+    position, velocity = _propagate(np.broadcast_to(r1, r2.shape), v1, tof)
+    assert np.allclose(position, r2, rtol=0.0, atol=1e-6 * 900000.0)
+    assert np.allclose(velocity, v2, rtol=1e-6)
+
+    # Counterclockwise, the long way round for 250 degrees
+    assert (np.cross(r1, v1)[:, 2] > 0).all()
+
+
+def test_lambertRetrograde():
+    r1 = np.array((700000.0, 0.0, 0.0))
+    r2 = np.array((0.0, 900000.0, 0.0))
+    v1 = lambert(r1, r2, 3000.0, MU, normal=(0.0, 0.0, -1.0))[0]
+    assert np.cross(r1, v1)[2] < 0  # Clockwise : 270 degrees
+
+    position = _propagate(r1, v1, 3000.0)[0]
+    assert np.allclose(position, r2, rtol=0.0, atol=1.0)
+
+
+def test_lambertNoSolution():
+    r1 = np.array((700000.0, 0.0, 0.0))
+    r2 = np.array(((0.0, 900000.0, 0.0), (0.0, 900000.0, 0.0),
+                   (0.0, 900000.0, 0.0), (-900000.0, 0.0, 0.0)))
+    tof = np.array((0.0, -100.0, 1e-3, 1500.0))  # Last : half turn
+    v1, v2 = lambert(r1, r2, tof, MU)
+    assert np.isnan(v1).all() and np.isnan(v2).all()
+
+
+ORBIT = _elements(700000.0, 0.01, 0.1, 0.4, 0.7, 0.0)
+TARGET = _elements(1200000.0, 0.05, 0.2, 0.5, 1.5, 2.0)
+
+
+def test_porkchop():
+    departures = 1000.0 + np.linspace(0.0, 6000.0, 128)
+    flightTimes = np.linspace(0.0, 4000.0, 9)  # 0 : no solution
+    grid = porkchop(ORBIT, TARGET, departures, flightTimes, processes=1)
+    assert grid.shape == (128, 9)
+    assert np.isnan(grid[:, 0]).all()
+
+    # Departure and arrival burns of a cell
+    ut, tof = departures[40], flightTimes[5]
+    r1, v1 = stateAt(ORBIT, ut)
+    r2, v2 = stateAt(TARGET, ut + tof)
+    t1, t2 = lambert(r1, r2, tof, MU, np.cross(r1, v1))
+    assert grid[40, 5] == pytest.approx(np.linalg.norm(t1 - v1) +
+                                        np.linalg.norm(v2 - t2))
+
+    # Same grid with a process pool
+    pooled = porkchop(ORBIT, TARGET, departures, flightTimes, processes=2)
+    assert np.allclose(pooled, grid, equal_nan=True)
+
+
+def test_planLambertTransfer():
+    departures = 1000.0 + np.linspace(0.0, 6000.0, 60)
+    flightTimes = np.linspace(500.0, 4000.0, 30)
+    (ut, prograde, normal, radial), tof, deltaV = planLambertTransfer(
+        ORBIT, TARGET, departures, flightTimes, processes=1)
+    grid = porkchop(ORBIT, TARGET, departures, flightTimes, processes=1)
+    assert deltaV == np.nanmin(grid)
+
+    # The burn of the node, along the node axes, meets the target
+    r, v = stateAt(ORBIT, ut)
+    progradeHat = v / np.linalg.norm(v)
+    normalHat = np.cross(r, v)
+    normalHat /= np.linalg.norm(normalHat)
+    radialHat = np.cross(progradeHat, normalHat)
+    v = v + prograde * progradeHat + normal * normalHat + \
+        radial * radialHat
+    position = _propagate(r, v, tof)[0]
+    target = stateAt(TARGET, ut + tof)[0]
+    assert np.linalg.norm(position - target) < 1e-6 * np.linalg.norm(target)
+
+    # Arrival burn : the rest of the delta-v
+    arrival = _propagate(r, v, tof)[1]
+    assert math.hypot(prograde, normal, radial) + \
+        np.linalg.norm(stateAt(TARGET, ut + tof)[1] - arrival) == \
+        pytest.approx(deltaV, rel=1e-6)
+
+
+def test_planLambertTransferNoSolution():
+    with pytest.raises(ValueError):
+        planLambertTransfer(ORBIT, TARGET, [1000.0, 2000.0], [0.0],
+                            processes=1)
@@ -0,0 +1,123 @@
+"""Replay synthetic recordings : impact predictions, end of recording, waits.
+
+Run from the root of the repository : python -m pytest tests
+"""
+
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from toolkit.impact import GetImpactInfos  # noqa
+from toolkit.recorder import HEADER_FILE, PHASE_FILE  # noqa
+from toolkit.rendezvous import stateAt  # noqa
+from toolkit.replay import DEFAULT_BODY, ENDED, ReplayConnection  # noqa
+from toolkit.wait import waitUt  # noqa
+
+
+MU = DEFAULT_BODY['mu']
+RADIUS = DEFAULT_BODY['radius']
+OMEGA = DEFAULT_BODY['rotationalSpeed']
+RATE = 50.0
+
+
+def _rotate(vectors, theta):
+    """Return the vectors (N, 3) in the body frame rotated by theta (the
+    inertial to rotating frame transformation of toolkit.impact)."""
+    x, y, z = vectors[:, 0], vectors[:, 1], vectors[:, 2]
+    cosT, sinT = np.cos(theta), np.sin(theta)
+    return np.column_stack((x*cosT + z*sinT, y, -x*sinT + z*cosT))
+
+
+def _inertialStates(uts):
+    """Return the inertial (positions, velocities) of a suborbital flight,
+    in the axes of the body frame (y : north)."""
+    sma = RADIUS + (80000.0 - 200000.0) / 2
+    elements = {'ut': 1000.0, 'mu': MU, 'sma': sma,
+                'ecc': (RADIUS + 80000.0 - sma) / sma,
+                'inc': 0.4, 'lan': 1.0, 'argPe': 0.3,
+                'meanAnomaly': math.pi - 0.1}  # Just before apoapsis
+    r, v = stateAt(elements, uts)
+    return r[:, (0, 2, 1)], v[:, (0, 2, 1)]  # z north -> y north
+
+
+def _writeRecording(directory, uts):
+    """Write the positions of the flight, in the rotating body frame."""
+    r, v = _inertialStates(uts)
+    columns = {'ut': uts}
+    rotating = _rotate(r, OMEGA * uts)
+    for i, axis in enumerate('xyz'):
+        columns['position_' + axis] = rotating[:, i]
+    columns['apoapsisAlt'] = np.full(len(uts), 80000.0)
+    columns['periapsisAlt'] = np.full(len(uts), -200000.0)
+    for column, values in columns.items():
+        np.asarray(values, dtype=np.float64).tofile(
+            os.path.join(directory, column + '.f8'))
+    np.zeros(len(uts), dtype=np.int16).tofile(
+        os.path.join(directory, PHASE_FILE))
+    header = {'rate': RATE, 'columns': list(columns), 'phases': {'start': 0},
+              'constants': {}, 'rows': len(uts), 'dropped': 0}
+    with open(os.path.join(directory, HEADER_FILE), 'w') as f:
+        json.dump(header, f)
+
+
+def _keplerImpact(ut):
+    """Return the first ut after ut at which the flight reaches sea level,
+    by bisection on the Kepler propagation of the flight."""
+    def altitude(t):
+        return np.linalg.norm(_inertialStates(np.array([t]))[0][0]) - RADIUS
+
+    step = 1.0
+    while altitude(ut + step) > 0.0:
+        ut += step
+    low, high = ut, ut + step
+    for _ in range(60):
+        middle = (low + high) / 2
+        if altitude(middle) > 0.0:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def test_replayedImpact(tmp_path):
+    uts = 1000.0 + np.arange(0, 30 * RATE) / RATE
+    _writeRecording(str(tmp_path), uts)
+    conn = ReplayConnection(str(tmp_path), startUt=1010.0)
+    sc = conn.space_center
+    infos = GetImpactInfos(conn, sc.active_vessel.orbit)
+
+    # Impact of the propagated flight, in the rotating frame at that time
+    impactUt = _keplerImpact(conn.ut)
+    r = _inertialStates(np.array([impactUt]))[0]
+    x, y, z = _rotate(r, OMEGA * impactUt)[0]
+    latitude = math.degrees(math.asin(y / RADIUS))
+    longitude = math.degrees(math.atan2(z, x))
+
+    # Error bound of toolkit.impact : 1e-5 s and a few millimetres
+    assert abs(infos.impactTime - impactUt) < 1e-5
+    assert abs(infos.impactLatitude - latitude) < 1e-6
+    assert abs(infos.impactLongitude - longitude) < 1e-6
+
+
+def test_recordingEnd(tmp_path):
+    uts = 1000.0 + np.arange(0, 5 * RATE) / RATE
+    _writeRecording(str(tmp_path), uts)
+    conn = ReplayConnection(str(tmp_path), startUt=uts[-1] - 0.5)
+    orbit = conn.space_center.active_vessel.orbit
+
+    # The position 1 s ahead is not recorded
+    assert conn.run(GetImpactInfos, conn, orbit) is ENDED
+    assert conn.run(lambda: None) is None
+
+
+def test_waitUt(tmp_path):
+    uts = 1000.0 + np.arange(0, 5 * RATE) / RATE
+    _writeRecording(str(tmp_path), uts)
+    conn = ReplayConnection(str(tmp_path), startUt=1001.0)
+    assert waitUt(conn, 2.0)
+    assert conn.ut == 1003.0
+    assert conn.run(waitUt, conn, 10.0) is ENDED
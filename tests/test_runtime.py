@@ -0,0 +1,154 @@
+"""Check the asyncio helpers of toolkit.runtime.
+
+Run from the root of the repository : python -m pytest tests
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from mock_krpc import MockConnection  # noqa
+from toolkit.runtime import executeNextNodeAsync, waitUntilAsync, \
+    waitUtAsync  # noqa
+
+
+class Stream:
+    """Stream updated by a background thread."""
+
+    def __init__(self, value):
+        self.value = value
+        self.callbacks = []
+
+    def __call__(self):
+        return self.value
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def update(self, value):
+        self.value = value
+        for callback in list(self.callbacks):
+            callback(value)
+
+
+def test_waitUntilAsync():
+    stream = Stream(0)
+
+    async def main():
+        threading.Timer(0.05, stream.update, (5,)).start()
+        reached = await waitUntilAsync(stream, lambda value: value >= 5, 2.0)
+        late = await waitUntilAsync(stream, lambda value: value >= 10, 0.05)
+        return reached, late
+
+    assert asyncio.run(main()) == (True, False)
+    assert stream.callbacks == []
+
+
+class Connection:
+    """Stand-in of the connection, recording the threads of the RPCs."""
+
+    def __init__(self):
+        self.rpcThreads = set()
+        self.events = []
+        conn = self
+
+        class SpaceCenter:
+            @property
+            def ut(self):
+                conn.rpc()
+                return 100.0
+
+        class Expression:
+            @staticmethod
+            def call(call):
+                conn.rpc()
+                return call
+
+            @staticmethod
+            def constant_double(value):
+                conn.rpc()
+                return value
+
+            @staticmethod
+            def greater_than_or_equal(a, b):
+                conn.rpc()
+                return (a, b)
+
+        class Event:
+            def __init__(self, expression):
+                self.expression = expression
+                self.callbacks = []
+
+            def add_callback(self, callback):
+                self.callbacks.append(callback)
+
+            def start(self):
+                conn.rpc()
+                # Triggered by the server a bit later
+                threading.Timer(0.05, lambda: [callback() for callback
+                                               in self.callbacks]).start()
+
+            def remove(self):
+                conn.rpc()
+
+        class KRPC:
+            def add_event(self, expression):
+                conn.rpc()
+                event = Event(expression)
+                conn.events.append(event)
+                return event
+
+        self.space_center = SpaceCenter()
+        self.krpc = KRPC()
+        self.krpc.Expression = Expression
+
+    def rpc(self):
+        self.rpcThreads.add(threading.current_thread())
+
+    def get_call(self, func, *args):
+        return (func, args)
+
+
+def test_waitUtAsync():
+    conn = Connection()
+    assert asyncio.run(waitUtAsync(conn, 10.0, timeout=2.0))
+    assert conn.events[0].expression[1] == 110.0
+
+    # No RPC is made from the thread of the event loop
+    assert threading.current_thread() not in conn.rpcThreads
+
+
+class SlowConnection(MockConnection):
+    """Mock connection whose physics frames last 1 ms."""
+
+    def frame(self):
+        time.sleep(0.001)
+        MockConnection.frame(self)
+
+
+def test_cancelExecuteNextNode():
+    conn = SlowConnection(burnTime=100.0)
+    conn.addNode()
+
+    async def main():
+        task = asyncio.ensure_future(executeNextNodeAsync(conn, 0.01, 5))
+        while conn.remaining == conn.deltaV:  # Until the burn starts
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())  # Waits for the worker thread
+    assert conn.throttle == 0.0
+    assert conn.nodes == [conn.node]
+    assert conn.remaining > 1.0
@@ -0,0 +1,114 @@
+"""Send several RPCs to the server in a single request.
+
+The kRPC protocol accepts a list of procedure calls per request, but the
+python client sends them one by one. batchCall builds all the calls of a
+list and sends them together, so N reads or writes cost one round trip
+instead of N.
+
+If the connection does not expose the kRPC client internals (e.g. a stand
+in used for tests), the calls are simply made one after the other, by its
+batchCalls(calls, raiseErrors) method if it has one (the benchmark mock
+uses it to account for a single request).
+
+"""
+
+try:
+    import krpc.schema.KRPC_pb2 as KRPC
+    from krpc.decoder import Decoder
+    from krpc.encoder import Encoder
+except ModuleNotFoundError:
+    KRPC = None
+
+
+def _getCall(conn, call):
+    """Return the (ProcedureCall, return type) of a (func, *args) tuple."""
+    func, args = call[0], call[1:]
+    if func is setattr:
+        obj, name, value = args
+        getter = conn.get_call(getattr, obj, name)
+        typ = conn._get_return_type(getattr, obj, name)
+        if not isinstance(value, typ.python_type):
+            value = conn._types.coerce_to(value, typ)
+
+        procCall = KRPC.ProcedureCall()
+        procCall.CopyFrom(getter)
+        procCall.procedure = getter.procedure.replace('get_', 'set_', 1)
+        procCall.arguments.add(position=len(getter.arguments),
+                               value=Encoder.encode(value, typ))
+        return procCall, None
+    return conn.get_call(func, *args), conn._get_return_type(func, *args)
+
+
+def _decode(conn, value, typ):
+    """Decode a result (the Decoder signature changed in kRPC 0.5)."""
+    try:
+        return Decoder.decode(conn, value, typ)
+    except TypeError:
+        return Decoder.decode(value, typ)
+
+
+def _callOne(call):
+    """Make a single (func, *args) call the usual way."""
+    func, args = call[0], call[1:]
+    return func(*args)
+
+
+def canBatch(conn):
+    """Return True if the calls to conn can be sent in a single request."""
+    return (KRPC is not None) and hasattr(conn, '_rpc_connection')
+
+
+def batchCall(conn, calls, raiseErrors=True):
+    """Return the list of the results of several RPCs.
+
+    Args:
+    -conn : return value of the initial krpc.connect()
+    -calls : list of (func, *args) tuples, as given to conn.add_stream.
+    Property reads are (getattr, obj, 'name'), property writes are
+    (setattr, obj, 'name', value) and return None.
+    -raiseErrors : if False, a failed call returns its exception instead of
+    raising it (default : True)
+
+    """
+    if len(calls) == 0:
+        return []
+
+    if not canBatch(conn):
+        if hasattr(conn, 'batchCalls'):
+            return conn.batchCalls(calls, raiseErrors)
+        results = []
+        for call in calls:
+            try:
+                results.append(_callOne(call))
+            except Exception as e:
+                if raiseErrors:
+                    raise
+                results.append(e)
+        return results
+
+    request = KRPC.Request()
+    returnTypes = []
+    for call in calls:
+        procCall, typ = _getCall(conn, call)
+        request.calls.extend([procCall])
+        returnTypes.append(typ)
+
+    with conn._rpc_connection_lock:
+        conn._rpc_connection.send_message(request)
+        response = conn._rpc_connection.receive_message(KRPC.Response)
+
+    if response.HasField('error'):
+        raise conn._build_error(response.error)
+
+    results = []
+    for result, typ in zip(response.results, returnTypes):
+        if result.HasField('error'):
+            error = conn._build_error(result.error)
+            if raiseErrors:
+                raise error
+            results.append(error)
+        elif typ is None:
+            results.append(None)
+        else:
+            results.append(_decode(conn, result.value, typ))
+    return results
@@ -1,30 +1,74 @@
 """Regroup all the functions related to calculations."""
 
 import math
+import numpy as np
 from time import sleep
+from toolkit.fleet import getFleetIndex
 
 
 def dotproduct(u, v):
     """Return the dot product of two vectors."""
-    dp = u[0]*v[0] + u[1]*v[1] + u[2]*v[2]
-    return dp
+    ux, uy, uz = u
+    vx, vy, vz = v
+    return ux*vx + uy*vy + uz*vz
 
 
 def length(u):
     """Return the length of a vector."""
-    len = math.sqrt(dotproduct(u, u))
-    return len
+    ux, uy, uz = u
+    return math.sqrt(ux*ux + uy*uy + uz*uz)
 
 
 def angle(u, v):
     """Return the angle between two vectors."""
-    rad_angle = math.acos(dotproduct(u, v) / (length(u) * length(v)))
-    return rad_angle * 180.0 / math.pi
+    ux, uy, uz = u
+    vx, vy, vz = v
+    uu = ux*ux + uy*uy + uz*uz
+    vv = vx*vx + vy*vy + vz*vz
+    cosAngle = (ux*vx + uy*vy + uz*vz) / math.sqrt(uu * vv)
+    if cosAngle > 1.0:  # rounding errors on parallel vectors
+        cosAngle = 1.0
+    elif cosAngle < -1.0:
+        cosAngle = -1.0
+    return math.degrees(math.acos(cosAngle))
 
 
 def distance(a, b):
     """Return the distance between two points."""
-    return math.sqrt((a[0] - b[0])**2 + (a[1] - b[1])**2 + (a[2] - b[2])**2)
+    ax, ay, az = a
+    bx, by, bz = b
+    return math.sqrt((ax - bx)**2 + (ay - by)**2 + (az - bz)**2)
+
+
+def dotproducts(U, V):
+    """Return the N dot products of two (N,3) arrays of vectors.
+
+    Either array can also be a single vector, broadcast against the other.
+    """
+    U = np.asarray(U, dtype=float)
+    V = np.asarray(V, dtype=float)
+    return np.einsum('...i,...i->...', U, V)
+
+
+def lengths(U):
+    """Return the N lengths of an (N,3) array of vectors."""
+    U = np.asarray(U, dtype=float)
+    return np.sqrt(np.einsum('...i,...i->...', U, U))
+
+
+def angles(U, V):
+    """Return the N angles (degrees) between two (N,3) arrays of vectors."""
+    U = np.asarray(U, dtype=float)
+    V = np.asarray(V, dtype=float)
+    uu = np.einsum('...i,...i->...', U, U)
+    vv = np.einsum('...i,...i->...', V, V)
+    cosAngles = dotproducts(U, V) / np.sqrt(uu * vv)
+    return np.degrees(np.arccos(np.clip(cosAngles, -1.0, 1.0)))
+
+
+def distances(A, B):
+    """Return the N distances between two (N,3) arrays of points."""
+    return lengths(np.asarray(A, dtype=float) - np.asarray(B, dtype=float))
 
 
 def relativeError(realValue, targetValue):
@@ -64,6 +108,185 @@ def getSemiMajorAxis(period, mu):
     return sma
 
 
+def velocityFromPositions(r0, r1, dt, mu):
+    """Return the orbital velocity at r0, knowing r1 is reached dt later.
+
+    Uses the Lagrange f and g series up to dt**3, refined once with the
+    radial speed. For dt = 1s around Kerbin the error is below 1e-5 m/s.
+    Both positions must be expressed in the same non rotating axes.
+    """
+    r0 = np.asarray(r0, dtype=float)
+    r1 = np.asarray(r1, dtype=float)
+    rr = np.dot(r0, r0)
+    u = mu / rr**1.5
+    f = 1.0 - u * dt**2 / 2
+    g = dt - u * dt**3 / 6
+    v = (r1 - f * r0) / g
+
+    sigma = np.dot(r0, v) / rr
+    f += u * sigma * dt**3 / 2
+    g += u * sigma * dt**4 / 4
+    return (r1 - f * r0) / g
+
+
+def getOrbitShape(r, v, mu):
+    """Return (sma, ecc, semi latus rectum, true anomaly) from state vectors.
+
+    The true anomaly is in radians, between -pi and pi.
+    """
+    r = np.asarray(r, dtype=float)
+    v = np.asarray(v, dtype=float)
+    rad = math.sqrt(np.dot(r, r))
+    rv = np.dot(r, v)
+    vv = np.dot(v, v)
+
+    sma = 1.0 / (2.0 / rad - vv / mu)
+    p = (rad**2 * vv - rv**2) / mu
+    eVec = ((vv - mu / rad) * r - rv * v) / mu
+    ecc = math.sqrt(np.dot(eVec, eVec))
+
+    # cos(nu) = (p/r - 1)/e and sin(nu) = rv*sqrt(p/mu)/(r*e)
+    trueAnomaly = math.atan2(rv * math.sqrt(p / mu) / rad, p / rad - 1.0)
+    return sma, ecc, p, trueAnomaly
+
+
+def meanAnomalyAt(trueAnomaly, ecc):
+    """Return the mean anomaly for the given true anomaly (radians).
+
+    Works on floats or NumPy arrays, for elliptic and hyperbolic orbits.
+    """
+    nu = np.asarray(trueAnomaly, dtype=float)
+    if ecc < 1.0:
+        E = np.arctan2(math.sqrt(1 - ecc**2) * np.sin(nu), ecc + np.cos(nu))
+        return E - ecc * np.sin(E)
+    F = 2 * np.arctanh(math.sqrt((ecc - 1) / (ecc + 1)) * np.tan(nu / 2))
+    return ecc * np.sinh(F) - F
+
+
+def trueAnomalyAt(meanAnomaly, ecc, iterations=8):
+    """Return the true anomaly for the given mean anomaly (radians).
+
+    Works on floats or NumPy arrays, for elliptic orbits (Newton's method on
+    Kepler's equation, from E = M + e.sin(M)).
+    """
+    M = np.asarray(meanAnomaly, dtype=float)
+    E = M + ecc * np.sin(M)
+    for _ in range(iterations):
+        E = E - (E - ecc * np.sin(E) - M) / (1 - ecc * np.cos(E))
+    return 2 * np.arctan2(math.sqrt(1 + ecc) * np.sin(E / 2),
+                          math.sqrt(1 - ecc) * np.cos(E / 2))
+
+
+def _stumpff(z):
+    """Return the Stumpff functions (C(z), S(z)), on NumPy arrays."""
+    C = np.empty_like(z)
+    S = np.empty_like(z)
+    ell = z > 1e-6
+    hyp = z < -1e-6
+    par = ~(ell | hyp)
+    sz = np.sqrt(z[ell])
+    C[ell] = (1 - np.cos(sz)) / z[ell]
+    S[ell] = (sz - np.sin(sz)) / sz**3
+    sz = np.sqrt(-z[hyp])
+    C[hyp] = (np.cosh(sz) - 1) / -z[hyp]
+    S[hyp] = (np.sinh(sz) - sz) / sz**3
+    C[par] = 1 / 2 - z[par] / 24
+    S[par] = 1 / 6 - z[par] / 120
+    return C, S
+
+
+def lambert(r1, r2, tof, mu, normal=(0.0, 0.0, 1.0), iterations=40,
+            tolerance=1e-8):
+    """Solve Lambert's problem (single revolution), vectorized.
+
+    Return the velocities (v1, v2) of the orbits going from r1 to r2 in
+    tof seconds, turning in the direction of 'normal'. The universal
+    variable z is found by Newton's method, kept inside a bracket (the
+    time of flight increases with z). The cases that did not converge,
+    and the half turns, are NaN.
+
+    Args:
+    -r1, r2 : positions, arrays of shape (..., 3)
+    -tof : times of flight, in seconds, array broadcast with r1[..., 0]
+    -mu : gravitational parameter of the body
+    -normal : direction of the orbit normal (default : north)
+    -iterations : max number of iterations (default : 40)
+    -tolerance : relative error on the time of flight (default : 1e-8)
+
+    """
+    r1 = np.asarray(r1, dtype=float)
+    r2 = np.asarray(r2, dtype=float)
+    R1 = np.sqrt(np.einsum('...i,...i', r1, r1))
+    R2 = np.sqrt(np.einsum('...i,...i', r2, r2))
+    shape = np.broadcast(R1, R2, np.asarray(tof)).shape
+    R1 = np.broadcast_to(R1, shape).ravel()
+    R2 = np.broadcast_to(R2, shape).ravel()
+    tof = np.broadcast_to(np.asarray(tof, dtype=float), shape).ravel()
+
+    cosAngle = np.broadcast_to(np.einsum('...i,...i', r1, r2), shape).ravel() \
+        / (R1 * R2)
+    turn = np.einsum('...i,i', np.cross(r1, r2), np.asarray(normal, float))
+    sign = np.where(np.broadcast_to(turn, shape).ravel() >= 0, 1.0, -1.0)
+    A = sign * np.sqrt(R1 * R2 * (1 + cosAngle))
+
+    # Newton's method on the unsolved cases only, with a bisection when the
+    # step leaves the bracket or does not halve the previous one
+    sqrtMu = math.sqrt(mu)
+    y = np.full_like(tof, np.nan)
+    index = np.arange(tof.size)
+    a, r, t = A, R1 + R2, tof
+    z = np.zeros_like(tof)
+    low = np.full_like(tof, -100 * math.pi**2)
+    high = np.full_like(tof, 4 * math.pi**2)
+    lastStep = high - low
+    for _ in range(iterations):
+        C, S = _stumpff(z)
+        yz = r + a * (z * S - 1) / np.sqrt(C)
+        valid = yz > 0
+        yz = np.where(valid, yz, 1.0)
+        x = np.sqrt(yz / C)
+        error = np.where(valid, (x**3 * S + a * np.sqrt(yz)) / sqrtMu - t,
+                         -t)
+        done = valid & (np.abs(error) <= tolerance * t)
+        y[index[done]] = yz[done]
+        if done.all():
+            break
+
+        # dt/dz, from the universal variable formulation
+        small = np.abs(z) < 1e-6
+        zs = np.where(small, 1.0, z)
+        slope = np.where(
+            small,
+            math.sqrt(2) / 40 * yz**1.5 +
+            a / 8 * (np.sqrt(yz) + a * np.sqrt(1 / (2 * yz))),
+            x**3 * ((C - 1.5 * S / C) / (2 * zs) + 0.75 * S**2 / C) +
+            a / 8 * (3 * S / C * np.sqrt(yz) + a * np.sqrt(C / yz))) / sqrtMu
+        low = np.where(error < 0, z, low)
+        high = np.where(error > 0, z, high)
+        step = z - error / slope
+        newton = valid & (step > low) & (step < high) & \
+            (np.abs(step - z) < lastStep / 2)
+        step = np.where(newton, step, (low + high) / 2)
+        lastStep = np.abs(step - z)
+        z = step
+
+        keep = ~done
+        index, a, r, t = index[keep], a[keep], r[keep], t[keep]
+        z, low, high, lastStep = z[keep], low[keep], high[keep], \
+            lastStep[keep]
+
+    # The plane of a half turn transfer is undefined
+    y[np.abs(A) <= 1e-6 * np.sqrt(R1 * R2)] = np.nan
+    f = 1 - y / R1
+    g = A * np.sqrt(y / mu)
+    gDot = 1 - y / R2
+    r1 = np.broadcast_to(r1, shape + (3,)).reshape(-1, 3)
+    r2 = np.broadcast_to(r2, shape + (3,)).reshape(-1, 3)
+    v1 = (r2 - f[:, None] * r1) / g[:, None]
+    v2 = (gDot[:, None] * r2 - r1) / g[:, None]
+    return v1.reshape(shape + (3,)), v2.reshape(shape + (3,))
+
+
 def getTimeOfAscendingNode(conn):
     """Return the ut of the next ascending node."""
     mj = conn.mech_jeb
@@ -84,20 +307,12 @@ def findClosestVessel(conn, vessel=None, sphere=10000):
     If no origin vessel is given, the active vessel will be taken by default.
     Sphere radius in meters (default : 10000).
     If no vessel is found in the sphere, returns None.
+    The positions come from the fleet index shared by the toolkit, so the
+    vessels are not queried one by one.
     """
     if vessel is None:
         vessel = conn.space_center.active_vessel
 
-    vesselList = conn.add_stream(getattr, conn.space_center, 'vessels')
-    refFrame = vessel.reference_frame
-    minDist = sphere + 1000
-    closestVessel = None
-
-    for V in vesselList():
-        dist = length(V.position(refFrame))
-        if dist < sphere:
-            if V != vessel and dist < minDist:
-                closestVessel = V
-                minDist = dist
-
-    return closestVessel
+    fleet = getFleetIndex(conn)
+    fleet.update(vessel)
+    return fleet.closest(vessel, sphere)
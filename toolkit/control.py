@@ -0,0 +1,238 @@
+"""Regroup the tools used to run control loops at a known rate."""
+
+from time import perf_counter, sleep
+import numpy as np
+from toolkit.batch import batchCall
+from toolkit.wait import waitUntil
+
+
+# Upper edges of the histogram bins, in seconds (last bin : above 1s)
+HISTOGRAM_EDGES = np.array((0.0005, 0.001, 0.002, 0.005, 0.01, 0.02,
+                            0.05, 0.1, 0.2, 0.5, 1.0))
+
+
+class Histogram:
+    """Fixed bins histogram of durations (constant memory)."""
+
+    def __init__(self, edges=HISTOGRAM_EDGES):
+        """Initialize the histogram with the upper edges of its bins."""
+        self.edges = edges
+        self.counts = np.zeros(len(edges) + 1, dtype=int)
+        self.total = 0.0
+        self.maximum = 0.0
+        self.n = 0
+
+    def add(self, value):
+        """Record a duration (in seconds)."""
+        self.counts[np.searchsorted(self.edges, value)] += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+        self.n += 1
+
+    def mean(self):
+        """Return the mean of the recorded durations."""
+        return self.total / self.n if self.n > 0 else 0.0
+
+    def __repr__(self):
+        labels = ["<%gms" % (e * 1000) for e in self.edges] + [">1s"]
+        bins = ", ".join("%s:%d" % (label, c)
+                         for label, c in zip(labels, self.counts) if c > 0)
+        return ("<Histogram : n=%d mean=%.2fms max=%.2fms [%s]>"
+                % (self.n, self.mean() * 1000, self.maximum * 1000, bins))
+
+
+class ControlLoop:
+    """Call a control function at a fixed rate.
+
+    The loop ticks on the wall clock, or on the game UT if a UT stream is
+    given. When the body takes longer than a period (overrun), the late
+    ticks are either skipped to stay on the original schedule ('skip'),
+    or coalesced into a single tick and the schedule restarts from now
+    ('coalesce').
+
+    The period, the jitter (delay between the scheduled and the real start
+    of a tick) and the duration of the body are recorded in histograms.
+    """
+
+    def __init__(self, rate, body, ut=None, overrun='skip'):
+        """Initialize the loop.
+
+        Args:
+        -rate : frequency of the loop, in Hz
+        -body : function called on each tick, the loop stops when it
+        returns True
+        -ut : stream of the UT, to tick on game time (default : wall clock)
+        -overrun : 'skip' or 'coalesce' (default : 'skip')
+
+        """
+        if overrun not in ('skip', 'coalesce'):
+            raise ValueError("Invalid overrun policy : " + str(overrun))
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.body = body
+        self.ut = ut
+        self.overrun = overrun
+
+        self.periods = Histogram()
+        self.jitter = Histogram()
+        self.durations = Histogram()
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.stopped = False
+
+    def clock(self):
+        """Return the current time of the loop clock."""
+        return perf_counter() if self.ut is None else self.ut()
+
+    def waitFor(self, t):
+        """Block until the loop clock reaches t."""
+        if self.ut is None:
+            delay = t - perf_counter()
+            if delay > 0.0:
+                sleep(delay)
+        else:
+            waitUntil(self.ut, lambda now: now >= t)
+
+    def stop(self):
+        """Stop the loop after the current tick."""
+        self.stopped = True
+
+    def run(self, maxTicks=None, timeout=None):
+        """Run the loop until the body returns True (or stop() is called).
+
+        Args:
+        -maxTicks : max number of ticks (default : None)
+        -timeout : max duration of the loop, on its clock (default : None)
+
+        Return True if the body ended the loop, False otherwise.
+        """
+        self.stopped = False
+        start = self.clock()
+        nextTick = start
+        lastStart = None
+
+        while not self.stopped:
+            self.waitFor(nextTick)
+            tickStart = self.clock()
+            self.jitter.add(max(0.0, tickStart - nextTick))
+            if lastStart is not None:
+                self.periods.add(tickStart - lastStart)
+            lastStart = tickStart
+
+            done = self.body()
+            self.ticks += 1
+            tickEnd = self.clock()
+            self.durations.add(tickEnd - tickStart)
+            if done is True:
+                return True
+
+            nextTick += self.period
+            if tickEnd > nextTick:
+                self.overruns += 1
+                if self.overrun == 'skip':
+                    late = int((tickEnd - nextTick) // self.period) + 1
+                    self.skipped += late
+                    nextTick += late * self.period
+                else:
+                    nextTick = tickEnd
+
+            if (maxTicks is not None) and (self.ticks >= maxTicks):
+                break
+            if (timeout is not None) and (tickEnd - start >= timeout):
+                break
+        return False
+
+    def stats(self):
+        """Return a dictionary with the statistics of the loop."""
+        return {'rate': self.rate,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'meanPeriod': self.periods.mean(),
+                'meanJitter': self.jitter.mean(),
+                'maxJitter': self.jitter.maximum,
+                'meanDuration': self.durations.mean(),
+                'maxDuration': self.durations.maximum}
+
+    def __repr__(self):
+        return ("<ControlLoop : %gHz, %d ticks, %d overruns, %d skipped>"
+                % (self.rate, self.ticks, self.overruns, self.skipped))
+
+
+def _axisProperty(axis):
+    """Return a property reading/writing an axis of a ControlState."""
+    def getter(self):
+        return self.get(axis)
+
+    def setter(self, value):
+        self.set(axis, value)
+    return property(getter, setter, doc="Commanded %s value." % axis)
+
+
+class ControlState:
+    """Local copy of the commanded controls of a vessel.
+
+    Writes are cached and only real changes are sent. All the axes that
+    changed during a tick are sent together by flush(), in one request.
+    Reads return the last commanded value; only the first read of an axis
+    that was never commanded costs an RPC.
+
+    NB : changes made by something else (SAS, MechJeb, the player) are not
+    seen, call forget() after handing the controls over.
+    """
+
+    AXES = ('throttle', 'up', 'forward', 'right', 'pitch', 'yaw', 'roll',
+            'wheel_throttle', 'wheel_steering')
+
+    def __init__(self, conn, vessel, autoFlush=False):
+        """Initialize the state.
+
+        Args:
+        -conn : return value of the initial krpc.connect()
+        -vessel : the controlled vessel
+        -autoFlush : send each change immediately (default : False)
+
+        """
+        self.conn = conn
+        self.control = vessel.control
+        self.autoFlush = autoFlush
+        self.values = {}
+        self.dirty = {}
+        self.flushes = 0
+        self.writes = 0
+
+    def get(self, axis):
+        """Return the commanded value of an axis."""
+        if axis not in self.values:
+            self.values[axis] = getattr(self.control, axis)
+        return self.values[axis]
+
+    def set(self, axis, value):
+        """Command a new value for an axis (sent on next flush)."""
+        if self.values.get(axis) == value:
+            return
+        self.values[axis] = value
+        self.dirty[axis] = value
+        if self.autoFlush:
+            self.flush()
+
+    def flush(self):
+        """Send all the changed axes in a single request."""
+        if len(self.dirty) == 0:
+            return
+        calls = [(setattr, self.control, axis, value)
+                 for axis, value in self.dirty.items()]
+        self.dirty = {}
+        batchCall(self.conn, calls)
+        self.flushes += 1
+        self.writes += len(calls)
+
+    def forget(self):
+        """Forget the cached values, they will be read again if needed."""
+        self.flush()
+        self.values = {}
+
+
+for _axis in ControlState.AXES:
+    setattr(ControlState, _axis, _axisProperty(_axis))
@@ -0,0 +1,535 @@
+"""Read the KSP .craft files offline.
+
+A .craft file is a ConfigNode : 'key = value' lines and named nodes
+delimited by braces. readConfigNode builds the whole tree, readCraft
+streams the file and only keeps what the part index needs, part by part :
+tags, part names, stages (istg, dstg), links, positions, mass of the
+modules (modMass), modules and resources.
+
+NB : a craft file stores the internal name of a part (kRPC Part.name,
+e.g. 'probeStackLarge'), not its title, which comes from the part config.
+The tags are stored by the KOSNameTag module (kOS or NameTag mod).
+
+"""
+
+import hashlib
+import io
+import mmap
+import os
+import re
+
+import numpy as np
+
+
+CRAFT_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'craft-files')
+
+
+class ConfigNode:
+    """Node of a ConfigNode file : ordered values and child nodes."""
+
+    def __init__(self, name=''):
+        self.name = name
+        self.values = []
+        self.nodes = []
+
+    def get(self, key, default=None):
+        """Return the first value of key."""
+        for k, v in self.values:
+            if k == key:
+                return v
+        return default
+
+    def getAll(self, key):
+        """Return all the values of key."""
+        return [v for k, v in self.values if k == key]
+
+    def children(self, name):
+        """Return the child nodes with the given name."""
+        return [node for node in self.nodes if node.name == name]
+
+    def __repr__(self):
+        return "<ConfigNode %s : %d values, %d nodes>" % (
+            self.name, len(self.values), len(self.nodes))
+
+
+def _lines(source):
+    """Return the lines of a path or of an open file."""
+    if isinstance(source, str):
+        with open(source, encoding='utf-8-sig') as f:
+            return f.read().splitlines()
+    return source.read().splitlines()
+
+
+def readConfigNode(source):
+    """Return the root ConfigNode of a file (path or open file)."""
+    root = ConfigNode()
+    stack = [root]
+    pending = None  # Name of a node whose '{' is on the next line
+    for line in _lines(source):
+        line = line.strip()
+        if line == '' or line.startswith('//'):
+            continue
+        if line == '{':
+            node = ConfigNode(pending or '')
+            stack[-1].nodes.append(node)
+            stack.append(node)
+            pending = None
+        elif line == '}':
+            stack.pop()
+        elif '=' in line:
+            key, value = line.split('=', 1)
+            stack[-1].values.append((key.strip(), value.strip()))
+        else:
+            pending = line
+    return root
+
+
+def _vector(value):
+    """Return the tuple of floats of a 'x,y,z' value."""
+    return tuple(float(x) for x in value.split(','))
+
+
+class CraftPart:
+    """Part of a craft, as stored in the file."""
+
+    __slots__ = ('index', 'id', 'name', 'persistentId', 'tag', 'istg',
+                 'dstg', 'sidx', 'links', 'parent', 'position', 'modMass',
+                 'modules',
+                 'resources')
+
+    def __init__(self, index, partId):
+        """Initialize a part from its 'part' value (name_craftId)."""
+        self.index = index
+        self.id = partId
+        self.name = partId.rsplit('_', 1)[0]
+        self.persistentId = None
+        self.tag = ''
+        self.istg = -1
+        self.dstg = 0
+        self.sidx = -1
+        self.links = []
+        self.parent = None
+        self.position = (0.0, 0.0, 0.0)
+        self.modMass = 0.0  # Mass added to the part config by its modules
+        self.modules = []
+        self.resources = {}
+
+    def __repr__(self):
+        tag = " '%s'" % self.tag if self.tag else ""
+        return "<CraftPart %d %s%s>" % (self.index, self.name, tag)
+
+
+class Craft:
+    """Part index of a craft file."""
+
+    def __init__(self, path, ship, values, parts):
+        """Build the indexes (use readCraft)."""
+        self.path = path
+        self.ship = ship
+        self.values = values
+        self.parts = parts
+        self.table = None  # Part table of a compiled craft (see loadCraft)
+        self._tree = None
+
+        self.ids = {P.id: P for P in parts}
+        self.tags = {}
+        self.names = {}
+        self.modules = {}
+        for P in parts:
+            if P.tag:
+                self.tags.setdefault(P.tag, []).append(P)
+            self.names.setdefault(P.name, []).append(P)
+            for module in set(P.modules):
+                self.modules.setdefault(module, []).append(P)
+            for link in P.links:
+                child = self.ids.get(link)
+                if child is not None:
+                    child.parent = P
+
+    @property
+    def root(self):
+        """Root part of the craft (the one without parent)."""
+        return next((P for P in self.parts if P.parent is None), None)
+
+    def byTag(self, tag):
+        """Return the parts that have the given tag."""
+        return list(self.tags.get(tag, []))
+
+    def byName(self, name):
+        """Return the parts with the given internal name."""
+        return list(self.names.get(name, []))
+
+    def byModule(self, module):
+        """Return the parts that have the given module."""
+        return list(self.modules.get(module, []))
+
+    def children(self, part):
+        """Return the parts attached to the given one."""
+        return [self.ids[link] for link in part.links if link in self.ids]
+
+    def activatedInStage(self, stage):
+        """Return the parts activated in a stage (istg)."""
+        return [P for P in self.parts if P.istg == stage]
+
+    def decoupledInStage(self, stage):
+        """Return the parts dropped in a stage (dstg)."""
+        return [P for P in self.parts if P.dstg == stage]
+
+    def stages(self):
+        """Return the stage numbers, from the first one fired."""
+        return sorted({P.istg for P in self.parts if P.istg >= 0},
+                      reverse=True)
+
+    def tree(self):
+        """Return the ConfigNode tree of the craft file."""
+        if self._tree is None:
+            self._tree = readConfigNode(self.path)
+        elif callable(self._tree):
+            self._tree = self._tree()
+        return self._tree
+
+    def __repr__(self):
+        return "<Craft %s : %d parts>" % (self.ship, len(self.parts))
+
+
+# Lines of the part index in a file written by KSP (tab indented) : part
+# fields, names of the modules, name tags and resources
+_INDEX_LINES = re.compile(
+    r'\n(?:PART\n\{\n\tpart = (?P<part>.*)'
+    r'|\t(?:(?P<key>persistentId|pos|istg|dstg|sidx|modMass|link)'
+    r' = (?P<value>.*)'
+    r'|MODULE\n\t\{\n\t\tname = (?P<module>.*)'
+    r'|\tnameTag = (?P<tag>.*)'
+    r'|RESOURCE\n\t\{\n\t\tname = (?P<resource>.*)'
+    r'\n\t\tamount = (?P<amount>.*)\n\t\tmaxAmount = (?P<maxAmount>.*)))')
+
+
+def _setField(part, key, value):
+    """Set a part field from its value in the file."""
+    if key == 'pos':
+        part.position = _vector(value)
+    elif key == 'link':
+        part.links.append(value)
+    elif key == 'persistentId':
+        part.persistentId = int(value)
+    elif key == 'modMass':
+        part.modMass = float(value)
+    else:  # istg, dstg, sidx
+        setattr(part, key, int(value))
+
+
+def _indexParts(text):
+    """Return the parts of a file written by KSP, in one scan."""
+    parts = []
+    part = None
+    for match in _INDEX_LINES.finditer(text):
+        kind = match.lastgroup
+        if kind == 'part':
+            part = CraftPart(len(parts), match.group('part').strip())
+            parts.append(part)
+        elif part is None:
+            continue
+        elif kind == 'value':
+            _setField(part, match.group('key'), match.group('value').strip())
+        elif kind == 'module':
+            part.modules.append(match.group('module').strip())
+        elif kind == 'tag':
+            part.tag = match.group('tag').strip()
+        else:
+            part.resources[match.group('resource').strip()] = (
+                float(match.group('amount')),
+                float(match.group('maxAmount')))
+    return parts
+
+
+def _nodeParts(root):
+    """Return the parts of a ConfigNode tree."""
+    parts = []
+    for node in root.children('PART'):
+        part = CraftPart(len(parts), node.get('part', ''))
+        for key, value in node.values:
+            if key in ('persistentId', 'pos', 'istg', 'dstg', 'sidx',
+                       'modMass', 'link'):
+                _setField(part, key, value)
+        for module in node.children('MODULE'):
+            part.modules.append(module.get('name'))
+            if module.get('nameTag') is not None:
+                part.tag = module.get('nameTag')
+        for resource in node.children('RESOURCE'):
+            part.resources[resource.get('name')] = (
+                float(resource.get('amount', 0.0)),
+                float(resource.get('maxAmount', 0.0)))
+        parts.append(part)
+    return parts
+
+
+def readCraft(source):
+    """Return the Craft of a .craft file (path or open file).
+
+    A file written by KSP is indexed in a single scan, without building the
+    ConfigNode tree. Other layouts (e.g. edited by hand) go through
+    readConfigNode.
+    """
+    if isinstance(source, str):
+        path = source
+        with open(source, encoding='utf-8-sig') as f:
+            text = f.read()
+    else:
+        path = getattr(source, 'name', None)
+        text = source.read()
+
+    header = text.split('\nPART', 1)[0]
+    values = {}
+    for line in header.splitlines():
+        if '=' in line:
+            key, value = line.split('=', 1)
+            values[key.strip()] = value.strip()
+
+    parts = _indexParts(text)
+    if len(parts) != text.count('\nPART\n'):
+        parts = _nodeParts(readConfigNode(io.StringIO(text)))
+    return Craft(path, values.get('ship'), values, parts)
+
+
+def findCraftFiles(directory=CRAFT_DIR):
+    """Return the paths of the .craft files of a directory (recursive)."""
+    paths = []
+    for folder, _, files in os.walk(directory):
+        paths.extend(os.path.join(folder, name) for name in files
+                     if name.endswith('.craft'))
+    return sorted(paths)
+
+
+def getCraft(shipName, directory=CRAFT_DIR):
+    """Return the Craft of the file named shipName.craft (None if none)."""
+    for path in findCraftFiles(directory):
+        if os.path.basename(path) == shipName + '.craft':
+            return loadCraft(path)
+    return None
+
+
+###############################################################################
+# Compiled cache
+#
+# loadCraft keeps a compiled form of each craft next to it (<file>.cache) :
+# the ConfigNode tree and the part index as flat little-endian arrays,
+# mapped in memory instead of parsed, so processes loading the same craft
+# share its pages. The cache is keyed by the SHA-1 of the craft file and
+# rebuilt whenever the craft changes, or when it is truncated or corrupt.
+#
+# Layout : magic, SHA-1 (20 bytes), 4 bytes of padding, then the (offset,
+# count) of each section as int64, then the sections, aligned on 8 bytes.
+# Strings are stored once, NUL separated, and referenced by index.
+
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'KCRAFT02'
+
+NODE_DTYPE = np.dtype([('name', '<i4'), ('parent', '<i4'),
+                       ('valueStart', '<i4'), ('valueCount', '<i4')])
+VALUE_DTYPE = np.dtype([('key', '<i4'), ('value', '<i4')])
+PART_DTYPE = np.dtype([('id', '<i4'), ('tag', '<i4'),
+                       ('persistentId', '<i8'), ('istg', '<i4'),
+                       ('dstg', '<i4'), ('sidx', '<i4'), ('parent', '<i4'),
+                       ('position', '<f8', (3,)), ('modMass', '<f8')])
+RESOURCE_DTYPE = np.dtype([('name', '<i4'), ('amount', '<f8'),
+                           ('maxAmount', '<f8')])
+
+# Sections of a compiled craft. The '...Ends' arrays hold, for each part,
+# the end of its slice in the following array.
+SECTIONS = (('strings', np.dtype('u1')),
+            ('nodes', NODE_DTYPE),
+            ('values', VALUE_DTYPE),
+            ('parts', PART_DTYPE),
+            ('linkEnds', np.dtype('<i4')),
+            ('links', np.dtype('<i4')),
+            ('moduleEnds', np.dtype('<i4')),
+            ('modules', np.dtype('<i4')),
+            ('resourceEnds', np.dtype('<i4')),
+            ('resources', RESOURCE_DTYPE))
+
+HEADER_SIZE = len(CACHE_MAGIC) + 24 + 16 * len(SECTIONS)
+
+
+def _compileCraft(text, digest):
+    """Return the compiled form of a craft file, as bytes."""
+    strings = {}
+
+    def intern(value):
+        """Return the index of a string in the string table."""
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    root = readConfigNode(io.StringIO(text))
+    nodes = []
+    values = []
+    stack = [(root, -1)]
+    while stack:  # Preorder
+        node, parent = stack.pop()
+        index = len(nodes)
+        nodes.append((intern(node.name), parent, len(values),
+                      len(node.values)))
+        values.extend((intern(k), intern(v)) for k, v in node.values)
+        stack.extend((child, index) for child in reversed(node.nodes))
+
+    parts = _nodeParts(root)
+    Craft('', None, {}, parts)  # Set the parents
+    index = {P.id: P.index for P in parts}
+    sections = {
+        'nodes': nodes,
+        'values': values,
+        'parts': [(intern(P.id), intern(P.tag),
+                   -1 if P.persistentId is None else P.persistentId,
+                   P.istg, P.dstg, P.sidx,
+                   -1 if P.parent is None else index[P.parent.id],
+                   P.position, P.modMass) for P in parts],
+        'linkEnds': np.cumsum([len(P.links) for P in parts]),
+        'links': [intern(link) for P in parts for link in P.links],
+        'moduleEnds': np.cumsum([len(P.modules) for P in parts]),
+        'modules': [intern(module) for P in parts for module in P.modules],
+        'resourceEnds': np.cumsum([len(P.resources) for P in parts]),
+        'resources': [(intern(name), amount, maxAmount) for P in parts
+                      for name, (amount, maxAmount) in P.resources.items()]}
+    sections['strings'] = np.frombuffer(
+        '\0'.join(strings).encode('utf-8'), dtype='u1')
+
+    table = []
+    blobs = []
+    offset = HEADER_SIZE
+    for name, dtype in SECTIONS:
+        array = np.array(sections[name], dtype=dtype)
+        offset += -offset % 8
+        table.extend((offset, len(array)))
+        blobs.append((offset, array.tobytes()))
+        offset += array.nbytes
+
+    data = bytearray(offset)
+    data[:HEADER_SIZE] = CACHE_MAGIC + digest + bytes(4) + \
+        np.array(table, dtype='<i8').tobytes()
+    for start, blob in blobs:
+        data[start:start + len(blob)] = blob
+    return bytes(data)
+
+
+def _compiledSections(buffer):
+    """Return the {name: array} of a compiled craft (views of buffer)."""
+    table = np.frombuffer(buffer, dtype='<i8', count=2 * len(SECTIONS),
+                          offset=HEADER_SIZE - 16 * len(SECTIONS))
+    return {name: np.frombuffer(buffer, dtype=dtype, count=int(count),
+                                offset=int(offset))
+            for (name, dtype), offset, count in zip(SECTIONS, table[0::2],
+                                                    table[1::2])}
+
+
+def _compiledTree(sections, strings):
+    """Return the ConfigNode tree of a compiled craft."""
+    nodes = []
+    values = sections['values'].tolist()
+    for name, parent, start, count in sections['nodes'].tolist():
+        node = ConfigNode(strings[name])
+        node.values = [(strings[k], strings[v])
+                       for k, v in values[start:start + count]]
+        if parent >= 0:
+            nodes[parent].nodes.append(node)
+        nodes.append(node)
+    return nodes[0]
+
+
+def _loadCompiled(buffer, path):
+    """Return the Craft of a compiled craft."""
+    sections = _compiledSections(buffer)
+    strings = sections['strings'].tobytes().decode('utf-8').split('\0')
+
+    def slices(name):
+        """Return the items of each part in the section 'name'."""
+        items = sections[name].tolist()
+        ends = sections[name[:-1] + 'Ends'].tolist()
+        return [items[start:end] for start, end in zip([0] + ends, ends)]
+
+    parts = []
+    rows = zip(sections['parts'].tolist(), slices('links'),
+               slices('modules'), slices('resources'))
+    for (partId, tag, persistentId, istg, dstg, sidx, _, position, modMass), \
+            links, modules, resources in rows:
+        part = CraftPart(len(parts), strings[partId])
+        part.tag = strings[tag]
+        part.persistentId = None if persistentId < 0 else persistentId
+        part.istg, part.dstg, part.sidx = istg, dstg, sidx
+        part.position = tuple(position)
+        part.modMass = modMass
+        part.links = [strings[link] for link in links]
+        part.modules = [strings[module] for module in modules]
+        part.resources = {strings[name]: (amount, maxAmount)
+                          for name, amount, maxAmount in resources}
+        parts.append(part)
+
+    start, count = sections['nodes'][0][['valueStart', 'valueCount']]
+    values = {strings[k]: strings[v]
+              for k, v in sections['values'][start:start + count].tolist()}
+    craft = Craft(path, values.get('ship'), values, parts)
+    craft.table = sections['parts']
+    craft._tree = lambda: _compiledTree(sections, strings)
+    return craft
+
+
+def _sectionsFit(buffer):
+    """Return True if the sections of the table lie inside the buffer."""
+    table = np.frombuffer(buffer[HEADER_SIZE - 16 * len(SECTIONS):
+                                 HEADER_SIZE], dtype='<i8')
+    for (_, dtype), offset, count in zip(SECTIONS, table[0::2],
+                                         table[1::2]):
+        if offset < HEADER_SIZE or count < 0 or \
+                offset + count * dtype.itemsize > len(buffer):
+            return False
+    return True
+
+
+def _readCache(cachePath, digest):
+    """Return the mapped cache file, None if missing, stale or
+    truncated."""
+    try:
+        with open(cachePath, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # Missing or empty file
+        return None
+    if len(buffer) < HEADER_SIZE or \
+            buffer[:len(CACHE_MAGIC)] != CACHE_MAGIC or \
+            buffer[len(CACHE_MAGIC):len(CACHE_MAGIC) + 20] != digest or \
+            not _sectionsFit(buffer):
+        buffer.close()
+        return None
+    return buffer
+
+
+def loadCraft(path):
+    """Return the Craft of a .craft file, through its compiled cache.
+
+    The cache (path + '.cache') is mapped in memory if it matches the
+    SHA-1 of the craft file and can be decoded, else the craft is parsed
+    and the cache written again. If the cache can't be written, the craft
+    is loaded from its compiled form in memory.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).digest()
+    cachePath = path + CACHE_SUFFIX
+
+    buffer = _readCache(cachePath, digest)
+    if buffer is not None:
+        try:
+            return _loadCompiled(buffer, path)
+        except (IndexError, ValueError, UnicodeDecodeError):
+            pass  # Corrupt cache, compiled again
+
+    buffer = _compileCraft(data.decode('utf-8-sig'), digest)
+    try:
+        # Write then rename, so that other processes never map a partial
+        # file
+        temporary = "%s.%d" % (cachePath, os.getpid())
+        with open(temporary, 'wb') as f:
+            f.write(buffer)
+        os.replace(temporary, cachePath)
+    except OSError as e:
+        print("Craft cache not written : " + str(e))
+    return _loadCompiled(buffer, path)
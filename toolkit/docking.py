@@ -2,96 +2,79 @@
 
 from numpy import sign
 from toolkit.calculations import length
+from toolkit.control import ControlLoop, ControlState
+from toolkit.fleet import invalidateFleet
+from toolkit.streams import addStream
+from toolkit.wait import waitUntil
 
 
-def xPosControl(vessel, xTarg, xPos, xVlc, vcu):
+def xPosControl(control, xTarg, xPos, xVlc):
     """Manage the x position of the vessel.
 
     Args:
-    -vessel : active vessel
+    -control : ControlState of the active vessel
     -xTarg : target for the x position
     -xPos : x position
     -xVlc : x velocity
-    -vcu : vessel.control.up value
 
     """
     if xPos < (xTarg - 0.1):
-        if xVlc < 1.0:
-            vessel.control.up = 0.5
-        elif vcu != 0.0:
-            vessel.control.up = 0.0
+        control.up = 0.5 if xVlc < 1.0 else 0.0
     elif xPos > (xTarg + 0.1):
-        if xVlc > -1.0:
-            vessel.control.up = -0.5
-        elif vcu != 0.0:
-            vessel.control.up = 0.0
+        control.up = -0.5 if xVlc > -1.0 else 0.0
     else:
         if xVlc > 0.06:
-            vessel.control.up = -1.0
+            control.up = -1.0
         elif xVlc < -0.06:
-            vessel.control.up = 1.0
-        elif vcu != 0.0:
-            vessel.control.up = 0.0
+            control.up = 1.0
+        else:
+            control.up = 0.0
 
 
-def yPosControl(vessel, yTarg, yPos, yVlc, vcf):
+def yPosControl(control, yTarg, yPos, yVlc):
     """Manage the y position of the vessel.
 
     Args:
-    -vessel : active vessel
+    -control : ControlState of the active vessel
     -yTarg : target for the y position
     -yPos : y position
     -yVlc : y velocity
-    -vcf : vessel.control.forward value
 
     """
     if yPos < (yTarg - 0.1):
-        if yVlc < 1.0:
-            vessel.control.forward = -0.5
-        elif vcf != 0.0:
-            vessel.control.forward = 0.0
+        control.forward = -0.5 if yVlc < 1.0 else 0.0
     elif yPos > (yTarg + 0.1):
-        if yVlc > -1.0:
-            vessel.control.forward = 0.5
-        elif vcf != 0.0:
-            vessel.control.forward = 0.0
+        control.forward = 0.5 if yVlc > -1.0 else 0.0
     else:
         if yVlc > 0.06:
-            vessel.control.forward = 1.0
+            control.forward = 1.0
         elif yVlc < -0.06:
-            vessel.control.forward = -1.0
-        elif vcf != 0.0:
-            vessel.control.forward = 0.0
+            control.forward = -1.0
+        else:
+            control.forward = 0.0
 
 
-def zPosControl(vessel, zTarg, zPos, zVlc, vcr):
+def zPosControl(control, zTarg, zPos, zVlc):
     """Manage the z position of the vessel.
 
     Args:
-    -vessel : active vessel
+    -control : ControlState of the active vessel
     -zTarg : target for the z position
     -zPos : z position
     -zVlc : z velocity
-    -vcr : vessel.control.right value
 
     """
     if zPos < (zTarg - 0.1):
-        if zVlc < 1.0:
-            vessel.control.right = -0.5
-        elif vcr != 0.0:
-            vessel.control.right = 0.0
+        control.right = -0.5 if zVlc < 1.0 else 0.0
     elif zPos > (zTarg + 0.1):
-        if zVlc > -1.0:
-            vessel.control.right = 0.5
-        elif vcr != 0.0:
-            vessel.control.right = 0.0
+        control.right = 0.5 if zVlc > -1.0 else 0.0
     else:
         if zVlc > 0.06:
-            vessel.control.right = 1.0
+            control.right = 1.0
         elif zVlc < -0.06:
-            vessel.control.right = -1.0
-        elif vcr != 0.0:
-            vessel.control.right = 0.0
+            control.right = -1.0
+        else:
+            control.right = 0.0
 
 
 def lockedPos(lockingPosition, vPos):
@@ -120,7 +103,41 @@ def lockedPos(lockingPosition, vPos):
     return (xLocked, yLocked, zLocked)
 
 
-def dockVesselWithTarget(conn, vessel, target, vesselDP, targetDP):
+def holdPosition(control, targ, vPos, vVlc, ut, holdTime, rate):
+    """Move the vessel to a position and hold it there for some time.
+
+    Args:
+    -control : ControlState of the active vessel
+    -targ : (x, y, z) target position
+    -vPos : stream of the position of the vessel
+    -vVlc : stream of the velocity of the vessel
+    -ut : stream of the UT
+    -holdTime : time the vessel must stay locked in position (s)
+    -rate : frequency of the control loop, on game time (Hz)
+
+    """
+    timer = ut()
+
+    def hold():
+        """Control the three axes, return True once held long enough."""
+        nonlocal timer
+        pos = vPos()
+        vlc = vVlc()
+        xPosControl(control, targ[0], pos[0], vlc[0])
+        yPosControl(control, targ[1], pos[1], vlc[1])
+        zPosControl(control, targ[2], pos[2], vlc[2])
+        control.flush()
+        (xLocked, yLocked, zLocked) = lockedPos(targ, pos)
+
+        if (xLocked is False) or (yLocked is False) or (zLocked is False):
+            timer = ut()
+        return ut() - timer >= holdTime
+
+    ControlLoop(rate, hold, ut=ut).run()
+
+
+def dockVesselWithTarget(conn, vessel, target, vesselDP, targetDP,
+                         rate=20.0):
     """Dock the given vessel to a target vessel.
 
     Args:
@@ -129,6 +146,8 @@ def dockVesselWithTarget(conn, vessel, target, vesselDP, targetDP):
     -target : vessel objet you want to dock to
     -vesselDP : docking port of the active vessel
     -targetDP : docking port of the target vessel
+    -rate : frequency of the control loops, in Hz of game time
+    (default : 20.0)
 
     """
     sc = conn.space_center
@@ -143,13 +162,11 @@ def dockVesselWithTarget(conn, vessel, target, vesselDP, targetDP):
         targetDP.reference_frame, targetDP.reference_frame,
         targetObtRefFrame, targetDP.reference_frame)
 
-    ut = conn.add_stream(getattr, sc, 'ut')
-    vcu = conn.add_stream(getattr, vessel.control, 'up')
-    vcr = conn.add_stream(getattr, vessel.control, 'right')
-    vcf = conn.add_stream(getattr, vessel.control, 'forward')
-    vPos = conn.add_stream(vessel.position, refFrame)
-    vVlc = conn.add_stream(getattr, vessel.flight(refFrame), 'velocity')
-    DPState = conn.add_stream(getattr, vesselDP, "state")
+    ut = addStream(conn, getattr, sc, 'ut')
+    control = ControlState(conn, vessel)
+    vPos = addStream(conn, vessel.position, refFrame)
+    vVlc = addStream(conn, getattr, vessel.flight(refFrame), 'velocity')
+    DPState = addStream(conn, getattr, vesselDP, "state")
 
     vesselAP = vessel.auto_pilot
     vesselAP.reference_frame = refFrame
@@ -159,8 +176,7 @@ def dockVesselWithTarget(conn, vessel, target, vesselDP, targetDP):
 
     ut0 = ut()
     vessel.control.rcs = True
-    while ut() < (ut0 + 20.0):
-        pass
+    waitUntil(ut, lambda now: now >= ut0 + 20.0)
 
     # Station avoidace system
     if vPos()[1] < 0:
@@ -174,50 +190,35 @@ def dockVesselWithTarget(conn, vessel, target, vesselDP, targetDP):
             zTarg = 50.0 * sign(vPos()[2])
         yTarg = 0.0
 
-        timer = ut()
-        while timer > (ut() - 1):
-            xPosControl(vessel, xTarg, vPos()[0], vVlc()[0], vcu())
-            yPosControl(vessel, yTarg, vPos()[1], vVlc()[1], vcf())
-            zPosControl(vessel, zTarg, vPos()[2], vVlc()[2], vcr())
-            (xLocked, yLocked, zLocked) = lockedPos((xTarg, yTarg, zTarg),
-                                                    vPos())
-
-            if (xLocked is False) or (yLocked is False) or (zLocked is False):
-                timer = ut()
+        holdPosition(control, (xTarg, yTarg, zTarg), vPos, vVlc, ut,
+                     holdTime=1.0, rate=rate)
 
     # Positionning in front of target DP
-    timer = ut()
     xTarg = 0.0
     yTarg = 50.0
     zTarg = 0.0
-    while timer > (ut() - 5):
-        xPosControl(vessel, xTarg, vPos()[0], vVlc()[0], vcu())
-        yPosControl(vessel, yTarg, vPos()[1], vVlc()[1], vcf())
-        zPosControl(vessel, zTarg, vPos()[2], vVlc()[2], vcr())
-        (xLocked, yLocked, zLocked) = lockedPos((xTarg, yTarg, zTarg), vPos())
-
-        if (xLocked is False) or (yLocked is False) or (zLocked is False):
-            timer = ut()
-
-    while DPState() != sc.DockingPortState.docking:
-        xPosControl(vessel, xTarg, vPos()[0], vVlc()[0], vcu())
-        zPosControl(vessel, zTarg, vPos()[2], vVlc()[2], vcr())
-
-        if vVlc()[1] > -0.8:
-            vessel.control.forward = 0.2
-        elif vcf() != 0.0:
-            vessel.control.forward = 0.0
+    holdPosition(control, (xTarg, yTarg, zTarg), vPos, vVlc, ut,
+                 holdTime=5.0, rate=rate)
+
+    def approach():
+        """Move forward to the target DP, keeping x and z centered."""
+        if DPState() == sc.DockingPortState.docking:
+            return True
+        pos = vPos()
+        vlc = vVlc()
+        xPosControl(control, xTarg, pos[0], vlc[0])
+        zPosControl(control, zTarg, pos[2], vlc[2])
+        control.forward = 0.2 if vlc[1] > -0.8 else 0.0
+        control.flush()
+
+    ControlLoop(rate, approach, ut=ut).run()
 
     vessel.control.rcs = False
-    while DPState() != sc.DockingPortState.docked:
-        pass
-    
+    waitUntil(DPState, lambda state: state == sc.DockingPortState.docked)
+    invalidateFleet()  # The two vessels are now merged
 
     # Removing streams
     ut.remove()
-    vcu.remove()
-    vcr.remove()
-    vcf.remove()
     vPos.remove()
     vVlc.remove()
     DPState.remove()
@@ -228,9 +229,9 @@ def moveXFromTarget(conn, vessel, target, tgtDistance):
     sc = conn.space_center
     trf = target.orbital_reference_frame
 
-    ut = conn.add_stream(getattr, sc, 'ut')
-    vesselPos = conn.add_stream(vessel.position, trf)
-    speed = conn.add_stream(getattr, vessel.flight(trf), 'speed')
+    ut = addStream(conn, getattr, sc, 'ut')
+    vesselPos = addStream(conn, vessel.position, trf)
+    speed = addStream(conn, getattr, vessel.flight(trf), 'speed')
 
     sc.target_vessel = target
     vessel.control.sas = True
@@ -238,27 +239,22 @@ def moveXFromTarget(conn, vessel, target, tgtDistance):
     vessel.control.speed_mode = sc.SpeedMode.target
 
     ut0 = ut()
-    while ut() < (ut0 + 1.0):
-        pass
+    waitUntil(ut, lambda now: now >= ut0 + 1.0)
     vessel.control.sas_mode = sc.SASMode.target
 
-    while ut() < (ut0 + 16.0):
-        pass
+    waitUntil(ut, lambda now: now >= ut0 + 16.0)
 
     tgtDistance = max(300.0, tgtDistance)
     if length(vesselPos()) > (2 * tgtDistance):
         vessel.control.throttle = 0.2
-        while speed() < 20.0:
-            pass
+        waitUntil(speed, lambda s: s >= 20.0)
         vessel.control.throttle = 0.0
         vessel.control.sas_mode = sc.SASMode.retrograde
 
-        while length(vesselPos()) > tgtDistance:
-            pass
+        waitUntil(vesselPos, lambda pos: length(pos) <= tgtDistance)
         vessel.control.throttle = 0.1
 
-        while speed() > 0.3:
-            pass
+        waitUntil(speed, lambda s: s <= 0.3)
         vessel.control.throttle = 0.0
 
     ut.remove()
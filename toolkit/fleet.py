@@ -0,0 +1,298 @@
+"""Regroup the in-process indexes of the vessels of the save."""
+
+import math
+import numpy as np
+from toolkit.batch import batchCall
+
+
+# Fleet indexes and directories shared by the toolkit, keyed by connection
+_fleetIndexes = {}
+_fleetDirectories = {}
+
+
+class FleetIndex:
+    """Spatial index of all the vessels of the save.
+
+    The positions of every vessel are fetched in a single request and
+    stored in a uniform grid, so nearest neighbour and radius queries are
+    answered in-process. The positions are refreshed when the UT moved
+    more than 'staleness' seconds past the last fetch, or when the vessel
+    list changed (undocking, staging, ...). Unless a frame is given, the
+    index is kept in the non rotating frame of the body orbited by the
+    reference vessel, and rebuilt when that body changes (SOI change,
+    vessel switch).
+    """
+
+    def __init__(self, conn, refFrame=None, staleness=1.0, cellSize=10000.0):
+        """Initialize the index (nothing is fetched yet).
+
+        Args:
+        -conn : return value of the initial krpc.connect()
+        -refFrame : reference frame of the positions (default : non rotating
+        reference frame of the body orbited by the reference vessel)
+        -staleness : max UT (s) between two position fetches (default : 1.0)
+        -cellSize : size of the cells of the grid, in meters (default : 1e4)
+
+        """
+        self.conn = conn
+        self.fixedFrame = refFrame is not None
+        self.refFrame = refFrame
+        self.staleness = staleness
+        self.cellSize = cellSize
+
+        self.body = None
+        self.orbits = {}
+        self.ut = None
+        self.vessels = []
+        self.indexed = []
+        self.positions = np.zeros((0, 3))
+        self.rows = {}
+        self.cells = {}
+
+    def update(self, vessel=None, force=False):
+        """Refresh the positions if they are stale or the fleet changed.
+
+        Costs one request, plus one more when the positions are fetched
+        (and one when the body of the reference vessel changed).
+        Args:
+        -vessel : reference vessel, whose body sets the frame (default :
+        active vessel)
+        -force : refresh the positions anyway (default : False)
+
+        """
+        sc = self.conn.space_center
+        calls = [(getattr, sc, 'ut'), (getattr, sc, 'vessels')]
+        if not self.fixedFrame:
+            if vessel is None:
+                vessel = sc.active_vessel
+            if vessel not in self.orbits:
+                self.orbits[vessel] = vessel.orbit
+            calls.append((getattr, self.orbits[vessel], 'body'))
+
+        results = batchCall(self.conn, calls)
+        ut, vessels = results[:2]
+        if (not self.fixedFrame) and (results[2] != self.body):
+            self.body = results[2]
+            self.refFrame = self.body.non_rotating_reference_frame
+            force = True
+
+        if force or (self.ut is None) or (vessels != self.vessels) or \
+                (ut - self.ut > self.staleness):
+            self.refresh(ut, vessels)
+
+    def refresh(self, ut, vessels):
+        """Fetch the positions of the vessels and rebuild the grid."""
+        calls = [(V.position, self.refFrame) for V in vessels]
+        results = batchCall(self.conn, calls, raiseErrors=False)
+
+        # Vessels destroyed in the meantime are dropped
+        fleet = [(V, pos) for V, pos in zip(vessels, results)
+                 if not isinstance(pos, Exception)]
+        self.ut = ut
+        self.vessels = vessels
+        self.indexed = [V for V, pos in fleet]
+        self.positions = np.array([pos for V, pos in fleet],
+                                  dtype=float).reshape(-1, 3)
+        self.rows = {V: i for i, V in enumerate(self.indexed)}
+
+        self.cells = {}
+        keys = np.floor(self.positions / self.cellSize).astype(int)
+        for i, key in enumerate(map(tuple, keys)):
+            self.cells.setdefault(key, []).append(i)
+
+    def positionOf(self, vessel):
+        """Return the indexed position of the vessel (None if unknown)."""
+        i = self.rows.get(vessel)
+        return None if i is None else self.positions[i]
+
+    def _candidates(self, point, radius):
+        """Return the rows that may be within radius of the point."""
+        n = int(math.ceil(radius / self.cellSize))
+        if (2*n + 1)**3 >= len(self.indexed):
+            return np.arange(len(self.indexed))
+
+        ci, cj, ck = np.floor(np.asarray(point) / self.cellSize).astype(int)
+        rows = []
+        for i in range(ci - n, ci + n + 1):
+            for j in range(cj - n, cj + n + 1):
+                for k in range(ck - n, ck + n + 1):
+                    rows.extend(self.cells.get((i, j, k), ()))
+        return np.array(rows, dtype=int)
+
+    def inRadius(self, point, radius):
+        """Return the list of (vessel, distance) within radius of the point.
+
+        The list is sorted by increasing distance.
+        """
+        rows = self._candidates(point, radius)
+        if len(rows) == 0:
+            return []
+        dist = np.sqrt(((self.positions[rows] - point)**2).sum(axis=1))
+        order = np.argsort(dist)
+        return [(self.indexed[rows[i]], dist[i]) for i in order
+                if dist[i] < radius]
+
+    def nearest(self, point, maxDistance=None, exclude=()):
+        """Return the (vessel, distance) closest to the point.
+
+        Return (None, None) if no vessel is closer than maxDistance.
+        """
+        if maxDistance is None:
+            rows = np.arange(len(self.indexed))
+        else:
+            rows = self._candidates(point, maxDistance)
+
+        rows = [i for i in rows if self.indexed[i] not in exclude]
+        if len(rows) == 0:
+            return None, None
+        dist = np.sqrt(((self.positions[rows] - point)**2).sum(axis=1))
+        i = int(np.argmin(dist))
+        if (maxDistance is not None) and (dist[i] >= maxDistance):
+            return None, None
+        return self.indexed[rows[i]], dist[i]
+
+    def closest(self, vessel, sphere=None):
+        """Return the vessel closest to the given one (None if none)."""
+        point = self.positionOf(vessel)
+        if point is None:
+            return None
+        return self.nearest(point, sphere, exclude=(vessel,))[0]
+
+
+def getFleetIndex(conn):
+    """Return the fleet index shared by the toolkit for this connection."""
+    if conn not in _fleetIndexes:
+        _fleetIndexes[conn] = FleetIndex(conn)
+    return _fleetIndexes[conn]
+
+
+class FleetDirectory:
+    """Name, type and id index of the vessels (and bodies) of the save.
+
+    The names and types of every vessel are fetched in a single request,
+    then lookups are answered from memory. A lookup that misses triggers
+    one refresh, so vessels created since the last fetch (undocking,
+    staging) are found. Each lookup checks the vessel list (one RPC), so
+    vessels destroyed or merged by docking are never returned. Renames
+    made through the toolkit are applied in place (see vesselRenamed).
+    """
+
+    def __init__(self, conn):
+        """Initialize the directory (nothing is fetched yet)."""
+        self.conn = conn
+        self.fleet = None
+        self.vessels = None
+        self.names = {}
+        self.types = {}
+        self.ids = {}
+        self.bodies = None
+
+    def refresh(self, vessels=None):
+        """Fetch the vessel list, then all the names and types at once."""
+        if vessels is None:
+            vessels = self.conn.space_center.vessels
+        calls = []
+        for V in vessels:
+            calls.append((getattr, V, 'name'))
+            calls.append((getattr, V, 'type'))
+        results = batchCall(self.conn, calls, raiseErrors=False)
+
+        self.fleet = vessels
+        self.vessels = []
+        self.names = {}
+        self.types = {}
+        self.ids = {}
+        for i, V in enumerate(vessels):
+            name, vesselType = results[2*i], results[2*i + 1]
+            if isinstance(name, Exception) or \
+                    isinstance(vesselType, Exception):
+                continue  # Vessel destroyed in the meantime
+            self.vessels.append(V)
+            self.names.setdefault(name, []).append(V)
+            self.types.setdefault(vesselType, []).append(V)
+            self.ids[getattr(V, '_object_id', id(V))] = V
+
+    def invalidate(self):
+        """Forget the vessels, they will be fetched again on next lookup."""
+        self.vessels = None
+
+    def validate(self):
+        """Refresh the directory if the vessel list changed.
+
+        Return True if it was refreshed.
+        """
+        vessels = self.conn.space_center.vessels
+        if (self.vessels is None) or (vessels != self.fleet):
+            self.refresh(vessels)
+            return True
+        return False
+
+    def byName(self, vesselName):
+        """Return the first vessel that has the given name (None if none)."""
+        if (not self.validate()) and (vesselName not in self.names):
+            self.refresh(self.fleet)  # The vessel may have been renamed
+        found = self.names.get(vesselName)
+        return found[0] if found else None
+
+    def byType(self, vesselType):
+        """Return the list of the vessels of the given type."""
+        self.validate()
+        return list(self.types.get(vesselType, []))
+
+    def byId(self, objectId):
+        """Return the vessel with the given kRPC object id (None if none)."""
+        self.validate()
+        return self.ids.get(objectId)
+
+    def body(self, bodyName):
+        """Return the celestial body with the given name (None if none)."""
+        if self.bodies is None:
+            self.bodies = self.conn.space_center.bodies
+        return self.bodies.get(bodyName)
+
+    def renamed(self, vessel, vesselName):
+        """Update the directory after vessel was renamed."""
+        if self.vessels is None:
+            return
+        for name, vessels in list(self.names.items()):
+            if vessel in vessels:
+                vessels.remove(vessel)
+                if len(vessels) == 0:
+                    del self.names[name]
+        self.names.setdefault(vesselName, []).append(vessel)
+
+    def retyped(self, vessel, vesselType):
+        """Update the directory after the type of vessel was changed."""
+        if self.vessels is None:
+            return
+        for vessels in self.types.values():
+            if vessel in vessels:
+                vessels.remove(vessel)
+        self.types.setdefault(vesselType, []).append(vessel)
+
+
+def getFleetDirectory(conn):
+    """Return the fleet directory shared by the toolkit for this connection."""
+    if conn not in _fleetDirectories:
+        _fleetDirectories[conn] = FleetDirectory(conn)
+    return _fleetDirectories[conn]
+
+
+def vesselRenamed(vessel, vesselName):
+    """Apply a rename to every fleet directory."""
+    for directory in _fleetDirectories.values():
+        directory.renamed(vessel, vesselName)
+
+
+def vesselRetyped(vessel, vesselType):
+    """Apply a type change to every fleet directory."""
+    for directory in _fleetDirectories.values():
+        directory.retyped(vessel, vesselType)
+
+
+def invalidateFleet():
+    """Invalidate every fleet index and directory (docking, undocking)."""
+    for directory in _fleetDirectories.values():
+        directory.invalidate()
+    for index in _fleetIndexes.values():
+        index.ut = None
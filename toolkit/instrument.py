@@ -0,0 +1,193 @@
+"""Measure the RPC traffic of the toolkit, per calling function.
+
+instrumentConnection(conn) wraps the RPC transport of a connection. Every
+request sent to the server is then attributed to the toolkit (or mission
+script) function that made it and to the current mission phase, and its
+round trip time is recorded in a histogram. Stream creations are RPCs
+(KRPC.AddStream) and are counted the same way. The report of the top
+call sites is printed when the connection is closed.
+
+Nothing is wrapped unless instrumentConnection is called, so the
+toolkit runs at full speed by default.
+
+Example :
+    conn = krpc.connect(name="GPS")
+    instrumentConnection(conn, top=10)
+    setRpcPhase(conn, 'ascent')
+    ...
+    conn.close()  # Prints the report
+
+"""
+
+import os
+import sys
+from collections import Counter
+from time import perf_counter
+from toolkit.control import Histogram
+
+
+# Profilers of the instrumented connections, keyed by connection
+_profilers = {}
+
+TOOLKIT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Helpers that only forward the calls of their caller
+FORWARDING_FILES = tuple(os.path.join(TOOLKIT_DIR, name) for name in
+                         ('batch.py', 'streams.py', 'instrument.py',
+                          'telemetry.py', 'runtime.py'))
+
+
+def _callSite(frame):
+    """Return 'module.function' of the first frame outside krpc and the
+    forwarding helpers."""
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        # Skip krpc, its generated procedures ('<string>') and the helpers
+        if (os.sep + 'krpc' + os.sep not in filename) and \
+                (not filename.startswith('<')) and \
+                (not filename.startswith(FORWARDING_FILES)):
+            module = os.path.splitext(os.path.basename(filename))[0]
+            return module + '.' + frame.f_code.co_name
+        frame = frame.f_back
+    return '?'
+
+
+class _Transport:
+    """Wrapper of the RPC connection, times each request/response."""
+
+    def __init__(self, profiler, connection):
+        self._profiler = profiler
+        self._connection = connection
+        self._pending = None
+
+    def send_message(self, message):
+        calls = getattr(message, 'calls', None)
+        procedures = [call.service + '.' + call.procedure
+                      for call in calls] if calls else []
+        site = _callSite(sys._getframe(1))
+        self._pending = (site, procedures, perf_counter())
+        self._connection.send_message(message)
+
+    def receive_message(self, typ):
+        message = self._connection.receive_message(typ)
+        if self._pending is not None:
+            site, procedures, start = self._pending
+            self._pending = None
+            self._profiler.record(site, procedures, perf_counter() - start)
+        return message
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class RpcProfiler:
+    """Requests, procedures and latencies per call site and phase."""
+
+    def __init__(self, conn, top=15):
+        """Initialize the profiler (use instrumentConnection).
+
+        Args:
+        -conn : return value of the initial krpc.connect()
+        -top : number of call sites in the report (default : 15)
+
+        """
+        self.conn = conn
+        self.top = top
+        self.phase = None
+        self.sites = {}
+        self.procedures = Counter()
+        self.requests = 0
+        self.transport = None
+
+    def setPhase(self, phase):
+        """Attribute the following requests to a mission phase."""
+        self.phase = phase
+
+    def record(self, site, procedures, latency):
+        """Record a request of the given procedures (called under the RPC
+        lock of the connection)."""
+        key = (site, self.phase)
+        if key not in self.sites:
+            self.sites[key] = {'requests': 0, 'calls': 0, 'streams': 0,
+                               'latency': Histogram()}
+        stats = self.sites[key]
+        stats['requests'] += 1
+        stats['calls'] += len(procedures)
+        stats['streams'] += procedures.count('KRPC.AddStream')
+        stats['latency'].add(latency)
+        self.procedures.update(procedures)
+        self.requests += 1
+
+    def attach(self):
+        """Wrap the RPC transport of the connection."""
+        if self.transport is None:
+            self.transport = _Transport(self, self.conn._rpc_connection)
+            self.conn._rpc_connection = self.transport
+
+    def detach(self):
+        """Restore the RPC transport of the connection."""
+        if self.transport is not None:
+            self.conn._rpc_connection = self.transport._connection
+            self.transport = None
+
+    def topSites(self, top=None):
+        """Return the [((site, phase), stats)] with the most RPC time."""
+        top = self.top if top is None else top
+        ranked = sorted(self.sites.items(),
+                        key=lambda item: item[1]['latency'].total,
+                        reverse=True)
+        return ranked[:top]
+
+    def report(self, top=None):
+        """Return the report of the top call sites, as a string."""
+        total = sum(s['latency'].total for s in self.sites.values())
+        lines = ["RPC report : %d requests, %.3fs" % (self.requests, total),
+                 "  %-36s %-12s %8s %8s %7s %9s %9s %6s"
+                 % ("call site", "phase", "requests", "calls", "streams",
+                    "mean(ms)", "max(ms)", "share")]
+        for (site, phase), stats in self.topSites(top):
+            latency = stats['latency']
+            share = latency.total / total if total > 0 else 0.0
+            lines.append("  %-36s %-12s %8d %8d %7d %9.2f %9.2f %5.1f%%"
+                         % (site[:36], str(phase)[:12], stats['requests'],
+                            stats['calls'], stats['streams'],
+                            latency.mean() * 1000, latency.maximum * 1000,
+                            share * 100))
+        lines.append("  Top procedures : " + ", ".join(
+            "%s x%d" % item for item in self.procedures.most_common(5)))
+        return "\n".join(lines)
+
+
+def instrumentConnection(conn, top=15):
+    """Attribute the RPCs of conn to their call sites, report on close.
+
+    Return the RpcProfiler of the connection.
+    """
+    if conn in _profilers:
+        return _profilers[conn]
+    profiler = RpcProfiler(conn, top)
+    profiler.attach()
+    _profilers[conn] = profiler
+
+    close = conn.close
+
+    def closeAndReport():
+        """Close the connection, then print the RPC report."""
+        profiler.detach()
+        _profilers.pop(conn, None)
+        close()
+        print(profiler.report())
+    conn.close = closeAndReport
+    return profiler
+
+
+def getRpcProfiler(conn):
+    """Return the RpcProfiler of conn, None if it is not instrumented."""
+    return _profilers.get(conn)
+
+
+def setRpcPhase(conn, phase):
+    """Set the mission phase of an instrumented connection (no-op else)."""
+    profiler = _profilers.get(conn)
+    if profiler is not None:
+        profiler.setPhase(phase)
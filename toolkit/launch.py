@@ -0,0 +1,126 @@
+"""Regroup all the functions related to the launch window.
+
+The launch site passes under the orbital plane of a target twice a day.
+The times are computed from the inclination and the longitude of the
+ascending node of the target, the rotation of the body and the latitude
+and longitude of the site, so that a single warp_to replaces the polling
+of the plane. The angles are measured eastwards, in the axes of the body
+(z : north), with the inertial longitude of a site being its longitude
+plus the rotation angle of the body.
+
+"""
+
+import math
+import numpy as np
+from toolkit.batch import batchCall
+
+
+def _siteAxes(latitude, longitude):
+    """Return the (up, east, north) unit vectors of a site (radians)."""
+    cosLat, sinLat = math.cos(latitude), math.sin(latitude)
+    cosLon, sinLon = math.cos(longitude), math.sin(longitude)
+    return (np.array([cosLat*cosLon, cosLat*sinLon, sinLat]),
+            np.array([-sinLon, cosLon, 0.0]),
+            np.array([-sinLat*cosLon, -sinLat*sinLon, cosLat]))
+
+
+def launchWindows(latitude, inclination, lan, siteLongitude, rotationSpeed,
+                  orbitSpeed=0.0, radius=0.0):
+    """Return the two daily passages of a site under an orbital plane.
+
+    Return [(delay, direction, azimuth)] sorted by delay : the time until
+    the passage (s, within a rotation of the body), "north" or "south" and
+    the launch azimuth (degrees from north, eastwards). The azimuth is
+    corrected for the rotation of the body if orbitSpeed and radius are
+    given. When the latitude is higher than the inclination, the plane
+    never passes over the site and both windows are its closest approach.
+    Args:
+    -latitude : latitude of the site, in radians
+    -inclination : inclination of the orbit, in radians
+    -lan : longitude of the ascending node of the orbit, in radians
+    -siteLongitude : current inertial longitude of the site, in radians
+    -rotationSpeed : rotational speed of the body, in rad/s
+    -orbitSpeed : speed of the orbit at insertion, in m/s (default : 0.0)
+    -radius : radius of the body, in m (default : 0.0)
+
+    """
+    normal = np.array([math.sin(inclination) * math.sin(lan),
+                       -math.sin(inclination) * math.cos(lan),
+                       math.cos(inclination)])
+
+    # normal.up = 0 <=> sin(longitude - lan) = tan(latitude)/tan(inclination)
+    ratio = math.tan(latitude) * math.cos(inclination) / \
+        max(math.sin(inclination), 1e-12)
+    beta = math.asin(max(-1.0, min(1.0, ratio)))
+
+    windows = []
+    for offset in (beta, math.pi - beta):
+        longitude = lan + offset
+        delay = ((longitude - siteLongitude) % (2 * math.pi)) / rotationSpeed
+        up, east, north = _siteAxes(latitude, longitude)
+
+        # Direction of the orbit over the site, then the velocity to gain
+        # relative to the surface
+        motion = np.cross(normal, up)
+        motion /= np.linalg.norm(motion)
+        velocity = orbitSpeed * motion - \
+            rotationSpeed * radius * math.cos(latitude) * east
+        if orbitSpeed <= 0.0:
+            velocity = motion
+        azimuth = math.degrees(math.atan2(np.dot(velocity, east),
+                                          np.dot(velocity, north))) % 360.0
+        direction = "north" if np.dot(motion, north) >= 0.0 else "south"
+        windows.append((delay, direction, azimuth))
+    return sorted(windows)
+
+
+def getLaunchWindow(conn, vessel, target, direction=None):
+    """Return the next launch window of a landed vessel to the plane of
+    the target, as a dict.
+
+    Keys : 'ut' (passage of the site under the plane), 'direction'
+    ("north"/"south") and 'azimuth' (launch heading, in degrees, corrected
+    for the rotation of the body at the speed of the target orbit).
+    Args:
+    -conn : return value of the initial krpc.connect()
+    -vessel : vessel on the launch site
+    -target : vessel (or body) whose plane is reached
+    -direction : "north" or "south" to only keep these windows (default :
+    None, the next one)
+
+    """
+    body = vessel.orbit.body
+    flight = vessel.flight(body.reference_frame)
+    targetOrbit = target.orbit
+    (ut, rotationAngle, rotationSpeed, radius, mu, latitude, longitude,
+     inclination, lan, sma) = batchCall(
+        conn, [(getattr, conn.space_center, 'ut'),
+               (getattr, body, 'rotation_angle'),
+               (getattr, body, 'rotational_speed'),
+               (getattr, body, 'equatorial_radius'),
+               (getattr, body, 'gravitational_parameter'),
+               (getattr, flight, 'latitude'),
+               (getattr, flight, 'longitude'),
+               (getattr, targetOrbit, 'inclination'),
+               (getattr, targetOrbit, 'longitude_of_ascending_node'),
+               (getattr, targetOrbit, 'semi_major_axis')])
+
+    windows = launchWindows(math.radians(latitude), inclination, lan,
+                            math.radians(longitude) + rotationAngle,
+                            rotationSpeed, math.sqrt(mu / sma), radius)
+    delay, side, azimuth = next(
+        W for W in windows if direction is None or W[1] == direction)
+    return {'ut': ut + delay, 'direction': side, 'azimuth': azimuth}
+
+
+def waitLaunchWindow(conn, vessel, target, direction=None, leadTime=0.0):
+    """Warp to the next launch window (see getLaunchWindow), return it.
+
+    Args:
+    -leadTime : time between the end of the warp and the window, in
+    seconds (default : 0.0)
+
+    """
+    window = getLaunchWindow(conn, vessel, target, direction)
+    conn.space_center.warp_to(window['ut'] - leadTime)
+    return window
@@ -1,22 +1,524 @@
-"""Regroup all the function related to maneuvers."""
+"""Regroup all the function related to maneuvers.
+
+The maneuvers are planned locally : the orbital elements of the vessel are
+read in a single request (getOrbitElements), the node is computed with the
+vis-viva equation and plane change geometry (plan* functions, no RPC) and
+placed with vessel.control.add_node, then executed by NodeExecutor. Only
+manKillRelVel still uses the MechJeb maneuver planner.
+
+The plan* functions return the node as (ut, prograde, normal, radial), in
+seconds and m/s, as expected by add_node. The burns are impulsive.
+
+"""
+
+import math
+import threading
+import numpy as np
+from toolkit.batch import batchCall
+from toolkit.calculations import meanAnomalyAt
+from toolkit.control import ControlState
+from toolkit.streams import addStream
+from toolkit.wait import waitUntil
+
+
+# Orbital elements read by getOrbitElements (kRPC Orbit properties)
+ORBIT_ELEMENTS = (('sma', 'semi_major_axis'),
+                  ('ecc', 'eccentricity'),
+                  ('inc', 'inclination'),
+                  ('lan', 'longitude_of_ascending_node'),
+                  ('argPe', 'argument_of_periapsis'),
+                  ('meanAnomaly', 'mean_anomaly'))
+
+G0 = 9.80665  # Standard gravity, for the specific impulse
+MIN_THROTTLE = 0.05  # Throttle at the end of a burn
+THROTTLE_STEP = 0.5  # Ratio between two throttle commands of a burn
+
+# Orbit shaping : sequences within DV_MARGIN (m/s) of the cheapest one are
+# compared by duration, the bi-elliptic intermediate apoapsis is searched
+# up to BIELLIPTIC_MAX_RATIO times the target semi major axis
+DV_MARGIN = 1.0
+BIELLIPTIC_MAX_RATIO = 100.0
+BIELLIPTIC_SAMPLES = 64
+
+# Gravitational parameter and radius of the bodies, they never change
+_bodyConstants = {}
+
+
+def getBurnTime(deltaV, mass, thrust, isp):
+    """Return the duration of a burn (s), from the rocket equation.
+
+    Args:
+    -deltaV : delta-v of the burn, in m/s
+    -mass : mass of the vessel at the start of the burn, in kg
+    -thrust : thrust of the engines, in N
+    -isp : specific impulse of the engines, in s
+
+    """
+    if thrust <= 0.0 or isp <= 0.0:
+        return float('inf')
+    exhaustVelocity = isp * G0
+    finalMass = mass / math.exp(deltaV / exhaustVelocity)
+    return (mass - finalMass) * exhaustVelocity / thrust
+
+
+class NodeExecutor:
+    """Execute a maneuver node with the engines of the vessel.
+
+    The burn duration comes from the rocket equation, the burn is centered
+    on the node. The vessel points to the node, warps to the start of the
+    burn minus the lead time, then burns while a single stream of the
+    remaining burn vector is watched. The throttle is reduced when less
+    than 'convergence' seconds of full thrust remain. The burn ends when the
+    remaining delta-v along the burn is below the tolerance (or overshot).
+    Whatever happens, the engines are cut, the autopilot disengaged and the
+    'completed' event set; an exception is kept in 'error' (see wait).
+    cancel() stops the executor at the next stream update, the node is
+    then kept.
+    """
+
+    def __init__(self, conn, tolerance=0.01, leadTime=5, vessel=None,
+                 convergence=1.0):
+        """Initialize the executor for the next node of the vessel.
+
+        Args:
+        -conn : return value of the initial krpc.connect()
+        -tolerance : remaining delta-v at which the burn ends, in m/s
+        (default : 0.01)
+        -leadTime : margin between the end of the warp and the start of the
+        burn, in seconds (default : 5)
+        -vessel : vessel with the node (default : active vessel)
+        -convergence : duration of the throttle down, in seconds of full
+        thrust (default : 1.0)
+
+        """
+        self.conn = conn
+        self.tolerance = tolerance
+        self.leadTime = leadTime
+        self.convergence = convergence
+        self.vessel = vessel or conn.space_center.active_vessel
+        self.node = self.vessel.control.nodes[0]
+
+        self.nodeUt, self.deltaV, self.frame, mass, thrust, isp = batchCall(
+            conn, [(getattr, self.node, 'ut'),
+                   (getattr, self.node, 'remaining_delta_v'),
+                   (getattr, self.node, 'reference_frame'),
+                   (getattr, self.vessel, 'mass'),
+                   (getattr, self.vessel, 'available_thrust'),
+                   (getattr, self.vessel, 'specific_impulse')])
+        if thrust <= 0.0 or isp <= 0.0:
+            raise ValueError("No thrust available to execute the node")
+        self.acceleration = thrust / mass
+        self.burnTime = getBurnTime(self.deltaV, mass, thrust, isp)
+        self.burnStart = self.nodeUt - self.burnTime / 2
+
+        self.throttle = 0.0
+        self.remaining = self.deltaV
+        self.converged = False
+        self.cancelled = threading.Event()
+        self.completed = threading.Event()
+        self.error = None
+
+    def targetThrottle(self, remaining):
+        """Return the throttle for the remaining delta-v along the burn."""
+        if self.acceleration <= 0.0:
+            return 1.0
+        throttle = remaining / (self.acceleration * self.convergence)
+        return min(1.0, max(MIN_THROTTLE, throttle))
+
+    def _check(self, vector):
+        """Predicate on the remaining burn vector (node frame, y : burn).
+
+        Return True when the burn is complete, when the throttle must be
+        changed or when the executor is cancelled.
+        """
+        if self.cancelled.is_set():
+            return True
+        self.remaining = vector[1]
+        if self.remaining <= self.tolerance:
+            self.converged = True
+            return True
+        throttle = self.targetThrottle(self.remaining)
+        return throttle < THROTTLE_STEP * self.throttle
+
+    def run(self):
+        """Point to the node, warp, burn and remove the node."""
+        sc = self.conn.space_center
+        control = ControlState(self.conn, self.vessel)
+        ap = self.vessel.auto_pilot
+        streams = []
+        try:
+            control.throttle = 0.0
+            control.flush()
+            batchCall(self.conn, [(setattr, ap, 'reference_frame',
+                                   self.frame),
+                                  (setattr, ap, 'target_direction',
+                                   (0.0, 1.0, 0.0))])
+            ap.engage()
+            ap.wait()
+
+            ut = addStream(self.conn, getattr, sc, 'ut')
+            streams.append(ut)
+            if self.burnStart - self.leadTime > ut():
+                sc.warp_to(self.burnStart - self.leadTime)
+            waitUntil(ut, lambda now: now >= self.burnStart or
+                      self.cancelled.is_set())
+            if self.cancelled.is_set():
+                return self.remaining
+
+            remaining = addStream(self.conn, self.node.remaining_burn_vector,
+                                  self.frame)
+            streams.append(remaining)
+            self.throttle = self.targetThrottle(self.remaining)
+            control.throttle = self.throttle
+            control.flush()
+            while not (self.converged or self.cancelled.is_set()):
+                waitUntil(remaining, self._check)
+                if not (self.converged or self.cancelled.is_set()):
+                    self.throttle = self.targetThrottle(self.remaining)
+                    control.throttle = self.throttle
+                    control.flush()
+            control.throttle = 0.0
+            control.flush()
+
+            if self.converged:
+                self.node.remove()
+            return self.remaining
+        except Exception as error:
+            self.error = error
+            raise
+        finally:
+            try:
+                control.throttle = 0.0
+                control.flush()
+                ap.disengage()
+                for stream in streams:
+                    stream.remove()
+            finally:
+                self.completed.set()
+
+    def cancel(self):
+        """Stop the executor at the next stream update (thread safe)."""
+        self.cancelled.set()
+
+    def _runInThread(self):
+        """Run the executor, the error is kept for wait()."""
+        try:
+            self.run()
+        except Exception:
+            pass
+
+    def start(self):
+        """Run the executor in a background thread.
+
+        Return the 'completed' event, set once the executor stopped (see
+        wait to get the result).
+        """
+        thread = threading.Thread(target=self._runInThread,
+                                  name='NodeExecutor', daemon=True)
+        thread.start()
+        return self.completed
+
+    def wait(self, timeout=None):
+        """Wait for the executor started by start(), return run()'s result.
+
+        Return None if the timeout expired first. Re-raise the exception
+        that stopped the executor, if any.
+
+        Args:
+        -timeout : maximum waiting time, in seconds (default : None)
+
+        """
+        if not self.completed.wait(timeout):
+            return None
+        if self.error is not None:
+            raise self.error
+        return self.remaining
 
 
 def executeNextNode(conn, tolerance, leadTime):
-    """Execute the next node."""
-    executor = conn.mech_jeb.node_executor
-    vsl = conn.space_center.active_vessel
-    executorStatus = conn.add_stream(getattr, executor, 'enabled')
-    nodeList = conn.add_stream(getattr, vsl.control, 'nodes')
+    """Execute the next node of the active vessel (see NodeExecutor).
+
+    Return the delta-v left along the burn (negative if overshot).
+    """
+    return NodeExecutor(conn, tolerance, leadTime).run()
+
+
+def getOrbitElements(conn, orbit):
+    """Return the elements of an orbit and the current ut, as a dict.
+
+    The elements are read in a single request. Keys : 'ut', 'mu',
+    'radius' and 'soi' (sphere of influence of the body), 'sma', 'ecc',
+    'inc', 'lan', 'argPe' and 'meanAnomaly' (angles in radians).
+    """
+    calls = [(getattr, conn.space_center, 'ut'), (getattr, orbit, 'body')]
+    calls += [(getattr, orbit, name) for _, name in ORBIT_ELEMENTS]
+    results = batchCall(conn, calls)
+
+    body = results[1]
+    if body not in _bodyConstants:
+        _bodyConstants[body] = batchCall(
+            conn, [(getattr, body, 'gravitational_parameter'),
+                   (getattr, body, 'equatorial_radius'),
+                   (getattr, body, 'sphere_of_influence')])
+    elements = {'ut': results[0]}
+    elements['mu'], elements['radius'], elements['soi'] = \
+        _bodyConstants[body]
+    for (key, _), value in zip(ORBIT_ELEMENTS, results[2:]):
+        elements[key] = value
+    return elements
+
+
+def timeToTrueAnomaly(elements, trueAnomaly):
+    """Return the time until the vessel reaches a true anomaly (radians).
+
+    On a hyperbolic orbit, the result is negative if the true anomaly has
+    already been passed.
+    """
+    sma, ecc = elements['sma'], elements['ecc']
+    meanMotion = math.sqrt(elements['mu'] / abs(sma)**3)
+    deltaM = float(meanAnomalyAt(trueAnomaly, ecc)) - elements['meanAnomaly']
+    if ecc < 1.0:
+        deltaM %= 2 * math.pi
+    return deltaM / meanMotion
+
+
+def _stateAt(elements, trueAnomaly):
+    """Return (radius, radial speed, horizontal speed) at a true anomaly."""
+    p = elements['sma'] * (1 - elements['ecc']**2)
+    h = math.sqrt(elements['mu'] / p)
+    radius = p / (1 + elements['ecc'] * math.cos(trueAnomaly))
+    return (radius, h * elements['ecc'] * math.sin(trueAnomaly),
+            h * (1 + elements['ecc'] * math.cos(trueAnomaly)))
+
+
+def _apsisAnomaly(atApsis):
+    """Return the true anomaly of an apsis ('apoapsis','periapsis')."""
+    if atApsis == 'apoapsis':
+        return math.pi
+    elif atApsis == 'periapsis':
+        return 0.0
+    raise ValueError("atApsis must be 'apoapsis' or 'periapsis'")
+
+
+def planSemiMajorAxis(elements, atApsis, newSMA):
+    """Return the node of a prograde burn at an apsis to reach newSMA."""
+    trueAnomaly = _apsisAnomaly(atApsis)
+    radius, _, speed = _stateAt(elements, trueAnomaly)
+    newSpeed = math.sqrt(elements['mu'] * (2 / radius - 1 / newSMA))
+    return (elements['ut'] + timeToTrueAnomaly(elements, trueAnomaly),
+            newSpeed - speed, 0.0, 0.0)
+
+
+def planOppositeApsis(elements, atApsis, radius):
+    """Return the node of a burn at an apsis that puts the opposite apsis
+    at the given radius (from the center of the body)."""
+    burnRadius = _stateAt(elements, _apsisAnomaly(atApsis))[0]
+    return planSemiMajorAxis(elements, atApsis, (burnRadius + radius) / 2)
+
+
+def planPeriapsis(elements, newPeriapsis, atApsis):
+    """Return the node that sets the periapsis altitude.
+
+    The burn is horizontal : the periapsis can't be raised above the
+    altitude of the burn, the orbit is circularized instead.
+    """
+    burnRadius = _stateAt(elements, _apsisAnomaly(atApsis))[0]
+    radius = min(elements['radius'] + newPeriapsis, burnRadius)
+    return planOppositeApsis(elements, atApsis, radius)
+
+
+def planApoapsis(elements, newApoapsis, atApsis):
+    """Return the node that sets the apoapsis altitude.
+
+    The burn is horizontal : the apoapsis can't be lowered below the
+    altitude of the burn, the orbit is circularized instead.
+    """
+    burnRadius = _stateAt(elements, _apsisAnomaly(atApsis))[0]
+    radius = max(elements['radius'] + newApoapsis, burnRadius)
+    return planOppositeApsis(elements, atApsis, radius)
 
-    executor.tolerance = tolerance
-    executor.lead_time = leadTime
-    executor.execute_one_node()
 
-    while (executorStatus() is True) or (nodeList() != []):
-        pass
+def planCircularize(elements, atApsis):
+    """Return the node that circularizes the orbit at an apsis."""
+    burnRadius = _stateAt(elements, _apsisAnomaly(atApsis))[0]
+    return planSemiMajorAxis(elements, atApsis, burnRadius)
 
-    executorStatus.remove()
-    nodeList.remove()
+
+def _planeChange(elements, trueAnomaly, rotation):
+    """Return the node that rotates the velocity by 'rotation' (radians)
+    around the radial direction, at a true anomaly.
+
+    A positive rotation tilts the orbit normal backwards, i.e. increases
+    the inclination at the ascending node.
+    """
+    _, radialSpeed, horizontalSpeed = _stateAt(elements, trueAnomaly)
+    speed = math.hypot(radialSpeed, horizontalSpeed)
+    cosine = math.cos(rotation) - 1.0
+    return (elements['ut'] + timeToTrueAnomaly(elements, trueAnomaly),
+            horizontalSpeed**2 * cosine / speed,
+            horizontalSpeed * math.sin(rotation),
+            -horizontalSpeed * radialSpeed * cosine / speed)
+
+
+def planInclination(elements, newInclination):
+    """Return the node that sets the inclination (radians), at the next
+    equatorial node."""
+    ascending = -elements['argPe']
+    descending = math.pi - elements['argPe']
+    rotation = newInclination - elements['inc']
+    if timeToTrueAnomaly(elements, ascending) <= \
+            timeToTrueAnomaly(elements, descending):
+        return _planeChange(elements, ascending, rotation)
+    return _planeChange(elements, descending, -rotation)
+
+
+def getOrbitAxes(elements):
+    """Return the (periapsis, 90° ahead, normal) unit vectors of an orbit,
+    in the axes of the body (z : north)."""
+    cosO, sinO = math.cos(elements['lan']), math.sin(elements['lan'])
+    cosI, sinI = math.cos(elements['inc']), math.sin(elements['inc'])
+    cosW, sinW = math.cos(elements['argPe']), math.sin(elements['argPe'])
+    P = np.array([cosO*cosW - sinO*sinW*cosI, sinO*cosW + cosO*sinW*cosI,
+                  sinW*sinI])
+    Q = np.array([-cosO*sinW - sinO*cosW*cosI, -sinO*sinW + cosO*cosW*cosI,
+                  cosW*sinI])
+    return P, Q, np.cross(P, Q)
+
+
+def planPlane(elements, targetElements):
+    """Return the node that matches the plane of the target orbit, at the
+    next relative node."""
+    P, Q, normal = getOrbitAxes(elements)
+    targetNormal = getOrbitAxes(targetElements)[2]
+    line = np.cross(normal, targetNormal)  # Towards the relative AN
+    if np.dot(line, line) < 1e-24:
+        return (elements['ut'], 0.0, 0.0, 0.0)  # Already in the plane
+
+    best = None
+    for direction in (line, -line):
+        trueAnomaly = math.atan2(np.dot(direction, Q), np.dot(direction, P))
+        time = timeToTrueAnomaly(elements, trueAnomaly)
+        if best is None or time < best[0]:
+            best = (time, trueAnomaly, direction)
+    _, trueAnomaly, direction = best
+
+    # Horizontal direction of motion at the node
+    horizontal = np.cross(normal, direction / np.linalg.norm(direction))
+    rotation = math.atan2(-np.dot(targetNormal, horizontal),
+                          np.dot(targetNormal, normal))
+    return _planeChange(elements, trueAnomaly, rotation)
+
+
+def _apsisSpeed(mu, radius, opposite):
+    """Return the speed at an apsis of the orbit with the given apsides
+    (radii, numpy arrays accepted)."""
+    return np.sqrt(2 * mu * opposite / (radius * (radius + opposite)))
+
+
+def _halfPeriod(mu, radius, opposite):
+    """Return the time from an apsis to the other one (numpy accepted)."""
+    return math.pi * np.sqrt(((radius + opposite) / 2)**3 / mu)
+
+
+def planOrbit(elements, sma, ecc=0.0, inc=None, minDeltaV=0.01):
+    """Return the burns that shape the orbit into (sma, ecc, inc).
+
+    Every burn is prograde/retrograde at an apsis and puts the opposite
+    apsis at a new radius. The candidates start at each apsis of the
+    current orbit (above the surface) and reach each apsis of the target
+    orbit either directly (Hohmann, two burns) or through an intermediate
+    apoapsis (bi-elliptic, three burns, intermediate radius searched up to
+    the sphere of influence). The cheapest one is kept, the earliest one
+    among those within DV_MARGIN of it. The burns below minDeltaV are
+    dropped, so a sequence can be a single burn. If inc is given
+    (radians), the plane change is planned on the final orbit, at its first
+    equatorial node after the last burn.
+
+    Return the list of the nodes (ut, prograde, normal, radial), in order.
+    Args:
+    -elements : orbital elements of the vessel (see getOrbitElements)
+    -sma : target semi major axis, in m
+    -ecc : target eccentricity (default : 0.0)
+    -inc : target inclination, in radians (default : None, unchanged)
+    -minDeltaV : smallest burn kept, in m/s (default : 0.01)
+
+    """
+    mu = elements['mu']
+    periapsis = elements['sma'] * (1 - elements['ecc'])
+    apoapsis = elements['sma'] * (1 + elements['ecc'])
+    targets = ((sma * (1 - ecc), sma * (1 + ecc)),
+               (sma * (1 + ecc), sma * (1 - ecc)))
+
+    limit = min(elements['soi'], BIELLIPTIC_MAX_RATIO * sma)
+    candidates = []
+    for atApsis, burnRadius, opposite in (('periapsis', periapsis, apoapsis),
+                                          ('apoapsis', apoapsis, periapsis)):
+        if burnRadius <= elements['radius']:
+            continue
+        anomaly = _apsisAnomaly(atApsis)
+        ut = elements['ut'] + timeToTrueAnomaly(elements, anomaly)
+        speed = _apsisSpeed(mu, burnRadius, opposite)
+        for reach, other in targets:
+            # Hohmann : burnRadius -> reach, then reach -> other
+            dv = (_apsisSpeed(mu, burnRadius, reach) - speed,
+                  _apsisSpeed(mu, reach, other) -
+                  _apsisSpeed(mu, reach, burnRadius))
+            times = (ut, ut + _halfPeriod(mu, burnRadius, reach))
+            candidates.append((abs(dv[0]) + abs(dv[1]), times, dv,
+                               anomaly, reach))
+
+            # Bi-elliptic : burnRadius -> high, high -> reach, reach -> other
+            low = max(burnRadius, reach, other)
+            if limit <= low:
+                continue
+            high = np.geomspace(low, limit, BIELLIPTIC_SAMPLES)
+            dvs = (_apsisSpeed(mu, burnRadius, high) - speed,
+                   _apsisSpeed(mu, high, reach) -
+                   _apsisSpeed(mu, high, burnRadius),
+                   _apsisSpeed(mu, reach, other) -
+                   _apsisSpeed(mu, reach, high))
+            costs = np.abs(dvs[0]) + np.abs(dvs[1]) + np.abs(dvs[2])
+            i = int(np.argmin(costs))
+            t2 = ut + _halfPeriod(mu, burnRadius, high[i])
+            times = (ut, t2, t2 + _halfPeriod(mu, high[i], reach))
+            candidates.append((float(costs[i]), times,
+                               tuple(float(dv[i]) for dv in dvs),
+                               anomaly, reach))
+    if not candidates:
+        raise ValueError("planOrbit : no apsis above the surface")
+
+    cheapest = min(c[0] for c in candidates)
+    _, times, dv, anomaly, reach = min(
+        (c for c in candidates if c[0] <= cheapest + DV_MARGIN),
+        key=lambda c: c[1][-1])
+    nodes = [(float(t), float(v), 0.0, 0.0) for t, v in zip(times, dv)
+             if abs(v) >= minDeltaV]
+
+    if inc is not None:
+        # Plane change on the final orbit, after the last burn (at 'reach',
+        # half a turn per burn from the first apsis)
+        final = elements
+        if nodes:
+            latitude = elements['argPe'] + anomaly + math.pi * (len(dv) - 1)
+            atPeriapsis = reach <= sma
+            final = dict(elements, ut=float(times[-1]), sma=sma, ecc=ecc,
+                         argPe=latitude - (0.0 if atPeriapsis else math.pi),
+                         meanAnomaly=0.0 if atPeriapsis else math.pi)
+        node = planInclination(final, inc)
+        if math.hypot(*node[1:]) >= minDeltaV:
+            nodes.append(node)
+    return nodes
+
+
+def _addNode(conn, node):
+    """Add the planned node to the active vessel."""
+    vessel = conn.space_center.active_vessel
+    return vessel.control.add_node(*node)
+
+
+def _activeElements(conn):
+    """Return the orbital elements of the active vessel."""
+    return getOrbitElements(conn, conn.space_center.active_vessel.orbit)
 
 
 def manPeriapsis(conn, newPeriapsis, atApsis, tolerance=0.01, leadTime=5):
@@ -25,20 +527,12 @@ def manPeriapsis(conn, newPeriapsis, atApsis, tolerance=0.01, leadTime=5):
     Args:
     -newPeriapsis : the new desired periapsis of the orbit
     -atApsis : location of the burn ('apoapsis','periapsis')
-    -tolerance : tolerance of the mechjeb node executor
+    -tolerance : remaining delta-v at the end of the burn, in m/s
     -leadTime : lead time of warp before burn time
 
     """
-    mj = conn.mech_jeb
-    planner = mj.maneuver_planner
-    mjPeri = planner.operation_periapsis
-
-    if atApsis == 'apoapsis':
-        mjPeri.time_selector.time_reference = mj.TimeReference.apoapsis
-    elif atApsis == 'periapsis':
-        mjPeri.time_selector.time_reference = mj.TimeReference.periapsis
-    mjPeri.new_periapsis = newPeriapsis
-    mjPeri.make_node()
+    _addNode(conn, planPeriapsis(_activeElements(conn), newPeriapsis,
+                                 atApsis))
     executeNextNode(conn, tolerance, leadTime)
 
 
@@ -48,20 +542,13 @@ def manApoapsis(conn, newApoapsis, atApsis, tolerance=0.01, leadTime=5):
     Args:
     -newApoapsis : the new desired apoapsis of the orbit
     -atApsis : location of the burn ('apoapsis','periapsis')
-    -tolerance : tolerance of the mechjeb node executor (default : 0.01)
+    -tolerance : remaining delta-v at the end of the burn, in m/s
+    (default : 0.01)
     -leadTime : lead time of warp before burn time (default : 5)
 
     """
-    mj = conn.mech_jeb
-    planner = mj.maneuver_planner
-    mjApo = planner.operation_apoapsis
-
-    if atApsis == 'apoapsis':
-        mjApo.time_selector.time_reference = mj.TimeReference.apoapsis
-    elif atApsis == 'periapsis':
-        mjApo.time_selector.time_reference = mj.TimeReference.periapsis
-    mjApo.new_apoapsis = newApoapsis
-    mjApo.make_node()
+    _addNode(conn, planApoapsis(_activeElements(conn), newApoapsis,
+                                atApsis))
     executeNextNode(conn, tolerance, leadTime)
 
 
@@ -71,20 +558,12 @@ def manSemiMajorAxis(conn, newSMA, atApsis, tolerance=0.01, leadTime=5):
     Args:
     -newSMA : the new desired semi major axis of the orbit
     -atApsis : location of the burn ('apoapsis','periapsis')
-    -tolerance : tolerance of the mechjeb node executor (default : 0.01)
+    -tolerance : remaining delta-v at the end of the burn, in m/s
+    (default : 0.01)
     -leadTime : lead time of warp before burn time (default : 5)
 
     """
-    mj = conn.mech_jeb
-    planner = mj.maneuver_planner
-    mjSMA = planner.operation_semi_major
-
-    if atApsis == 'apoapsis':
-        mjSMA.time_selector.time_reference = mj.TimeReference.apoapsis
-    elif atApsis == 'periapsis':
-        mjSMA.time_selector.time_reference = mj.TimeReference.periapsis
-    mjSMA.new_semi_major_axis = newSMA
-    mjSMA.make_node()
+    _addNode(conn, planSemiMajorAxis(_activeElements(conn), atApsis, newSMA))
     executeNextNode(conn, tolerance, leadTime)
 
 
@@ -93,19 +572,12 @@ def manCircularize(conn, atApsis, tolerance=0.01, leadTime=5):
 
     Args:
     -atApsis : location of the burn ('apoapsis','periapsis')
-    -tolerance : tolerance of the mechjeb node executor (default : 0.01)
+    -tolerance : remaining delta-v at the end of the burn, in m/s
+    (default : 0.01)
     -leadTime : lead time of warp before burn time (default : 5)
 
     """
-    mj = conn.mech_jeb
-    planner = mj.maneuver_planner
-    mjCirc = planner.operation_circularize
-
-    if atApsis == 'apoapsis':
-        mjCirc.time_selector.time_reference = mj.TimeReference.apoapsis
-    elif atApsis == 'periapsis':
-        mjCirc.time_selector.time_reference = mj.TimeReference.periapsis
-    mjCirc.make_node()
+    _addNode(conn, planCircularize(_activeElements(conn), atApsis))
     executeNextNode(conn, tolerance, leadTime)
 
 
@@ -113,18 +585,15 @@ def manInclination(conn, newInclination=0.0, tolerance=0.01, leadTime=5):
     """Change the inclination of the orbit.
 
     Args:
-    -newInclination : the new desiredinclination of the orbit (default : 0.0)
-    -tolerance : tolerance of the mechjeb node executor (default : 0.01)
+    -newInclination : the new desired inclination of the orbit, in degrees
+    (default : 0.0)
+    -tolerance : remaining delta-v at the end of the burn, in m/s
+    (default : 0.01)
     -leadTime : lead time of warp before burn time (default : 5)
 
     """
-    mj = conn.mech_jeb
-    planner = mj.maneuver_planner
-    mjInc = planner.operation_inclination
-
-    mjInc.time_selector.time_reference = mj.TimeReference.eq_nearest_ad
-    mjInc.new_inclination = newInclination
-    mjInc.make_node()
+    _addNode(conn, planInclination(_activeElements(conn),
+                                   math.radians(newInclination)))
     executeNextNode(conn, tolerance, leadTime)
 
 
@@ -132,19 +601,64 @@ def manPlane(conn, tolerance=0.01, leadTime=5):
     """Match plane with current target (error if no target selected).
 
     Args:
-    -tolerance : tolerance of the mechjeb node executor (default : 0.01)
+    -tolerance : remaining delta-v at the end of the burn, in m/s
+    (default : 0.01)
     -leadTime : lead time of warp before burn time (default : 5)
 
     """
-    mj = conn.mech_jeb
-    planner = mj.maneuver_planner
-    mjPlan = planner.operation_plane
-
-    mjPlan.time_selector.time_reference = mj.TimeReference.rel_nearest_ad
-    mjPlan.make_node()
+    sc = conn.space_center
+    target = sc.target_vessel or sc.target_body
+    if target is None:
+        raise ValueError("manPlane : no target selected")
+    targetElements = getOrbitElements(conn, target.orbit)
+    _addNode(conn, planPlane(_activeElements(conn), targetElements))
     executeNextNode(conn, tolerance, leadTime)
 
 
+def _orbitError(elements, sma, ecc, inc):
+    """Return the largest relative error of the apsides (and the
+    inclination error, in radians, if inc is given) to a target orbit."""
+    errors = [abs(elements['sma'] * (1 - elements['ecc']) / (sma * (1 - ecc))
+                  - 1),
+              abs(elements['sma'] * (1 + elements['ecc']) / (sma * (1 + ecc))
+                  - 1)]
+    if inc is not None:
+        errors.append(abs(elements['inc'] - inc))
+    return max(errors)
+
+
+def manOrbit(conn, newSMA, newEccentricity=0.0, newInclination=None,
+             precision=1e-4, tolerance=0.01, leadTime=5):
+    """Shape the orbit with the cheapest burn sequence (see planOrbit).
+
+    All the nodes are planned at once and executed in order, then a single
+    correction pass is made if the orbit is still off by more than
+    'precision'.
+    Args:
+    -newSMA : the new desired semi major axis of the orbit
+    -newEccentricity : the new desired eccentricity (default : 0.0)
+    -newInclination : the new desired inclination, in degrees (default :
+    None, unchanged)
+    -precision : relative error of the apsides (and inclination error, in
+    radians) accepted without correction (default : 1e-4)
+    -tolerance : remaining delta-v at the end of the burn, in m/s (default :
+    0.01)
+    -leadTime : lead time of warp before burn time (default : 5)
+
+    """
+    inc = None if newInclination is None else math.radians(newInclination)
+    control = conn.space_center.active_vessel.control
+    for attempt in range(2):
+        elements = _activeElements(conn)
+        error = _orbitError(elements, newSMA, newEccentricity, inc)
+        if attempt > 0 and error <= precision:
+            return
+        nodes = planOrbit(elements, newSMA, newEccentricity, inc)
+        batchCall(conn, [(control.add_node,) + node for node in nodes])
+        for _ in nodes:
+            executeNextNode(conn, tolerance, leadTime)
+
+
 def manKillRelVel(conn, tolerance=0.01, leadTime=5):
     """Kill relative velocity to the target (error if none selected)."""
     mj = conn.mech_jeb
@@ -1,16 +1,17 @@
 """Regroup all miscellanous functions."""
-from time import sleep
+from toolkit.fleet import getFleetDirectory
+from toolkit.streams import addStream
+from toolkit.wait import waitUntil, waitUt
 
 
 def countdown(conn, t):
     """Create a t-seconds countdown."""
-    ut = conn.add_stream(getattr, conn.space_center, 'ut')
+    ut = addStream(conn, getattr, conn.space_center, 'ut')
     T = ut() + 1
 
     for i in range(t, 0, -1):
         conn.ui.message("%d" % i)
-        while ut() < T:
-            pass
+        waitUntil(ut, lambda now: now >= T)
         T += 1
     ut.remove()
 
@@ -39,25 +40,23 @@ def convertTime(ut):
 
 def targetBody(conn, body):
     """Target the desired body."""
-    for n in conn.space_center.bodies:
-        if n == body:
-            conn.space_center.target_body = conn.space_center.bodies.get(n)
-    return conn.space_center.target_body
+    targetedBody = getFleetDirectory(conn).body(body)
+    if targetedBody is None:
+        return conn.space_center.target_body
+    conn.space_center.target_body = targetedBody
+    return targetedBody
 
 
 def findVessel(conn, vesselName):
-    """Return the first vessel that has the given name."""
-    for V in conn.space_center.vessels:
-        if V.name == vesselName:
-            return V
-    return None
+    """Return the first vessel that has the given name.
+
+    The names come from the fleet directory shared by the toolkit, so
+    repeated lookups do not scan the vessels over RPC.
+    """
+    return getFleetDirectory(conn).byName(vesselName)
 
 
 def wait(conn, waitTime):
     """Wait for a certain in game time (in seconds)."""
-    ut = conn.add_stream(getattr, conn.space_center, 'ut')
-    T0 = ut()
-    
-    while ut() < T0 + waitTime:
-        sleep(0.01)
+    waitUt(conn, waitTime)
     
\ No newline at end of file
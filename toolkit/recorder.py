@@ -0,0 +1,305 @@
+"""Record the flight telemetry at a fixed rate.
+
+The configured streams are sampled by a background thread into a ring of
+preallocated NumPy blocks. Sampling only reads the cached stream values,
+it never makes an RPC, so it does not slow the control loops down. Full
+blocks are handed to a writer thread that spills them to disk, one
+memory-mapped file of float64 per column, so the memory used is fixed
+(blocks x capacity rows) whatever the length of the mission. Each sample
+is tagged with the current mission phase.
+
+A recording is a directory :
+    recording.json : rate, columns, phases, constants, number of rows
+    <column>.f8 : values of a column (float64, native byte order)
+    phase.i2 : phase code of each row (int16)
+
+Example :
+    recorder = Recorder(conn, 'recordings/GPS-1')
+    recorder.addVessel(vessel)
+    recorder.start('launch')
+    ...
+    recorder.setPhase('ascent')
+    ...
+    recorder.stop()
+
+"""
+
+import json
+import os
+import queue
+import threading
+import numpy as np
+from toolkit.control import ControlLoop
+from toolkit.instrument import setRpcPhase
+from toolkit.streams import addStream
+
+
+HEADER_FILE = 'recording.json'
+PHASE_FILE = 'phase.i2'
+
+# Names of the components of a vector channel
+VECTOR_AXES = ('x', 'y', 'z')
+
+
+def _columnFile(directory, column):
+    """Return the path of the file of a column."""
+    return os.path.join(directory, column + '.f8')
+
+
+def _appendColumn(path, rows, values):
+    """Copy values at the given row of a column file, through a memmap."""
+    mode = 'r+' if os.path.exists(path) else 'w+'
+    mm = np.memmap(path, dtype=values.dtype, mode=mode,
+                   offset=rows * values.itemsize, shape=values.shape)
+    mm[:] = values
+    mm.flush()
+    del mm
+
+
+class Recorder:
+    """Sample streams at a fixed rate and spill them to a recording."""
+
+    def __init__(self, conn, directory, rate=50.0, capacity=4096, blocks=4):
+        """Initialize the recorder (the UT is always recorded).
+
+        Args:
+        -conn : return value of the initial krpc.connect()
+        -directory : directory of the recording (created if needed)
+        -rate : sampling frequency, in Hz (default : 50.0)
+        -capacity : number of rows of a block (default : 4096)
+        -blocks : number of blocks of the ring (default : 4)
+
+        """
+        self.conn = conn
+        self.directory = directory
+        self.rate = rate
+        self.capacity = capacity
+        self.nBlocks = blocks
+
+        self.channels = []
+        self.columns = []
+        self.phases = {}
+        self.phaseCode = 0
+        self.constants = {}
+        self.rows = 0
+        self.dropped = 0
+
+        self.loop = None
+        self.thread = None
+        self.writer = None
+        self.add('ut', getattr, conn.space_center, 'ut')
+
+    def add(self, name, func, *args):
+        """Record func(*args) under the given name (before start).
+
+        Vectors are recorded as one column per component (name_x, ...).
+        """
+        if self.thread is not None:
+            raise RuntimeError("Channels must be added before start()")
+        stream = addStream(self.conn, func, *args)
+        value = stream()
+        if isinstance(value, tuple):
+            axes = VECTOR_AXES if len(value) == 3 else range(len(value))
+            columns = ["%s_%s" % (name, axis) for axis in axes]
+        else:
+            columns = [name]
+        self.channels.append((stream, len(self.columns), len(columns)))
+        self.columns.extend(columns)
+        return stream
+
+    def addVessel(self, vessel, refFrame=None):
+        """Record the usual flight telemetry of a vessel.
+
+        Args:
+        -vessel : the recorded vessel
+        -refFrame : reference frame of the speeds (default : reference
+        frame of the body orbited by the vessel)
+
+        """
+        if refFrame is None:
+            refFrame = vessel.orbit.body.reference_frame
+        flight = vessel.flight(refFrame)
+        self.add('meanAltitude', getattr, flight, 'mean_altitude')
+        self.add('surfaceAltitude', getattr, flight, 'surface_altitude')
+        self.add('speed', getattr, flight, 'speed')
+        self.add('verticalSpeed', getattr, flight, 'vertical_speed')
+        self.add('horizontalSpeed', getattr, flight, 'horizontal_speed')
+        self.add('mass', getattr, vessel, 'mass')
+        self.add('thrust', getattr, vessel, 'thrust')
+        self.add('throttle', getattr, vessel.control, 'throttle')
+        self.add('position', vessel.position, refFrame)
+        self.add('velocity', vessel.velocity, refFrame)
+        self.add('apoapsisAlt', getattr, vessel.orbit, 'apoapsis_altitude')
+        self.add('periapsisAlt', getattr, vessel.orbit, 'periapsis_altitude')
+
+        body = vessel.orbit.body
+        self.constants['body'] = {
+            'name': body.name,
+            'mu': body.gravitational_parameter,
+            'radius': body.equatorial_radius,
+            'rotationalSpeed': body.rotational_speed,
+            'rotationalPeriod': body.rotational_period}
+
+    def addRelative(self, name, vessel, target):
+        """Record the position and velocity of vessel relative to target
+        (vessel, part or docking port), in the reference frame of the
+        target, as <name>Position and <name>Velocity."""
+        frame = target.reference_frame
+        self.add(name + 'Position', vessel.position, frame)
+        self.add(name + 'Velocity', vessel.velocity, frame)
+
+    def setPhase(self, phase):
+        """Tag the following samples (and RPCs, if the connection is
+        instrumented) with a mission phase."""
+        if phase not in self.phases:
+            self.phases[phase] = len(self.phases)
+        self.phaseCode = self.phases[phase]
+        setRpcPhase(self.conn, phase)
+
+    def start(self, phase='start'):
+        """Start sampling in a background thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.setPhase(phase)
+        width = len(self.columns)
+        self.free = queue.Queue()
+        for _ in range(self.nBlocks):
+            self.free.put((np.empty((self.capacity, width)),
+                           np.empty(self.capacity, dtype=np.int16)))
+        self.full = queue.Queue()
+        self.block, self.blockPhases = self.free.get()
+        self.n = 0
+
+        self.writer = threading.Thread(target=self._write, daemon=True)
+        self.writer.start()
+        self.loop = ControlLoop(self.rate, self.sample)
+        self.thread = threading.Thread(target=self.loop.run, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        """Store the current values of the streams in the ring."""
+        row = self.block[self.n]
+        for stream, first, width in self.channels:
+            try:
+                value = stream()
+            except Exception:
+                value = np.nan  # Removed or failed stream
+            if width == 1:
+                row[first] = value
+            else:
+                row[first:first + width] = value
+        self.blockPhases[self.n] = self.phaseCode
+        self.n += 1
+        if self.n == self.capacity:
+            self._swap()
+
+    def _swap(self):
+        """Hand the full block to the writer and take a free one."""
+        try:
+            block = self.free.get_nowait()
+        except queue.Empty:
+            # The writer is late : overwrite the block instead of growing
+            self.dropped += self.n
+            self.n = 0
+            return
+        self.full.put((self.block, self.blockPhases, self.n))
+        self.block, self.blockPhases = block
+        self.n = 0
+
+    def _write(self):
+        """Spill the full blocks to disk, run by the writer thread."""
+        while True:
+            item = self.full.get()
+            if item is None:
+                return
+            block, phases, n = item
+            self.spill(block[:n], phases[:n])
+            self.free.put((block, phases))
+
+    def spill(self, block, phases):
+        """Append rows to the column files of the recording."""
+        for j, column in enumerate(self.columns):
+            _appendColumn(_columnFile(self.directory, column), self.rows,
+                          np.ascontiguousarray(block[:, j]))
+        _appendColumn(os.path.join(self.directory, PHASE_FILE), self.rows,
+                      phases)
+        self.rows += len(block)
+        self.writeHeader()
+
+    def writeHeader(self):
+        """Write the description of the recording."""
+        header = {'rate': self.rate,
+                  'columns': self.columns,
+                  'phases': self.phases,
+                  'constants': self.constants,
+                  'rows': self.rows,
+                  'dropped': self.dropped}
+        with open(os.path.join(self.directory, HEADER_FILE), 'w') as f:
+            json.dump(header, f, indent=1)
+
+    def stop(self, removeStreams=True):
+        """Stop sampling, spill the last rows and close the recording."""
+        if self.thread is None:
+            return
+        self.loop.stop()
+        self.thread.join()
+        if self.n > 0:
+            self.full.put((self.block, self.blockPhases, self.n))
+            self.n = 0
+        self.full.put(None)
+        self.writer.join()
+        self.writeHeader()
+        self.thread = None
+        if removeStreams:
+            for stream, first, width in self.channels:
+                stream.remove()
+            self.channels = []
+
+    def stats(self):
+        """Return a dictionary with the statistics of the recorder."""
+        stats = self.loop.stats() if self.loop is not None else {}
+        stats.update({'rows': self.rows + self.n, 'dropped': self.dropped})
+        return stats
+
+
+class Recording:
+    """Read only access to a recording, the columns are memory-mapped."""
+
+    def __init__(self, directory):
+        """Open the recording saved in the directory."""
+        self.directory = directory
+        with open(os.path.join(directory, HEADER_FILE)) as f:
+            header = json.load(f)
+        self.rate = header['rate']
+        self.columns = header['columns']
+        self.phases = header['phases']
+        self.constants = header.get('constants', {})
+        self.rows = header['rows']
+        self.dropped = header['dropped']
+        self.data = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, column):
+        """Return the values of a column (memory-mapped)."""
+        if column not in self.data:
+            if column == 'phase':
+                path, dtype = os.path.join(self.directory, PHASE_FILE), \
+                    np.int16
+            else:
+                path, dtype = _columnFile(self.directory, column), np.float64
+            if self.rows == 0:
+                self.data[column] = np.zeros(0, dtype=dtype)
+            else:
+                self.data[column] = np.memmap(path, dtype=dtype, mode='r',
+                                              shape=(self.rows,))
+        return self.data[column]
+
+    def vector(self, name):
+        """Return the values of a vector channel, as a (N, 3) array."""
+        return np.column_stack([self[name + '_' + axis]
+                                for axis in VECTOR_AXES])
+
+    def phase(self, phase):
+        """Return the indexes of the rows recorded during a phase."""
+        return np.flatnonzero(self['phase'] == self.phases[phase])
@@ -0,0 +1,296 @@
+"""Regroup all the functions related to the rendezvous with a target.
+
+The transfer window is computed from the orbital elements of both orbits
+(see maneuvers.getOrbitElements), without sampling the positions : the
+phase angle is signed, the windows of the next revolutions are solved
+together with NumPy and the cheapest one is kept. This Hohmann half
+ellipse assumes coplanar and nearly circular orbits (match the planes
+first, see maneuvers.manPlane). Otherwise the transfer is the cheapest
+solution of Lambert's problem on a departure x time of flight grid (a
+porkchop search, split across a process pool).
+
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from toolkit.calculations import lambert, trueAnomalyAt
+from toolkit.maneuvers import executeNextNode, getOrbitAxes, getOrbitElements
+
+
+# Windows within DV_MARGIN (m/s) of the cheapest one are compared by date
+DV_MARGIN = 0.5
+
+# Largest relative inclination (radians) and eccentricity for which the
+# Hohmann transfer is used by manTransfer, beyond the porkchop search is
+PLANE_TOLERANCE = 1e-3
+ECC_TOLERANCE = 0.01
+
+# Porkchop grid of manTransfer (departures over a synodic period, times of
+# flight up to a target period) and grids smaller than this are not split
+# across processes
+PORKCHOP_SIZE = 500
+POOL_MIN_ROWS = 64
+
+
+def _wrap(angle):
+    """Return the angle(s) in [-pi, pi[."""
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+def _meanMotion(elements):
+    return math.sqrt(elements['mu'] / elements['sma']**3)
+
+
+def _trueAnomalies(elements, ut):
+    """Return the true anomalies of an orbit at the given ut(s)."""
+    M = elements['meanAnomaly'] + _meanMotion(elements) * (ut - elements['ut'])
+    return trueAnomalyAt(M, elements['ecc'])
+
+
+def _radius(elements, trueAnomaly):
+    return elements['sma'] * (1 - elements['ecc']**2) / \
+        (1 + elements['ecc'] * np.cos(trueAnomaly))
+
+
+def _speeds(elements, trueAnomaly):
+    """Return the (radial, horizontal) speeds at the true anomalies."""
+    h = np.sqrt(elements['mu'] / (elements['sma'] * (1 - elements['ecc']**2)))
+    return (h * elements['ecc'] * np.sin(trueAnomaly),
+            h * (1 + elements['ecc'] * np.cos(trueAnomaly)))
+
+
+def _periapsisOffset(elements, targetElements):
+    """Return the longitude of the periapsis of the target, measured in the
+    orbit of the vessel from its periapsis (coplanar orbits)."""
+    P, Q, _ = getOrbitAxes(elements)
+    targetP = getOrbitAxes(targetElements)[0]
+    return math.atan2(np.dot(targetP, Q), np.dot(targetP, P))
+
+
+def phaseAngle(elements, targetElements, ut=None):
+    """Return the signed phase angle of the target (radians, in [-pi, pi[).
+
+    The angle is positive when the target is ahead of the vessel. It is
+    measured in the orbit of the vessel, at ut (default : elements['ut']).
+    """
+    ut = elements['ut'] if ut is None else ut
+    offset = _periapsisOffset(elements, targetElements)
+    return float(_wrap(_trueAnomalies(targetElements, ut) + offset -
+                       _trueAnomalies(elements, ut)))
+
+
+def getTransferWindows(elements, targetElements, revolutions=5, margin=120.0,
+                       iterations=8):
+    """Return the Hohmann windows of the next revolutions, as arrays.
+
+    The windows of the circular case, one per synodic period, are refined
+    together (Newton's method) so that the target is met half a transfer
+    orbit later, on the eccentric orbits.
+    Return (ut, prograde and radial delta-v of the burn, delta-v to match
+    the target velocity at arrival, time of flight).
+    Args:
+    -elements : orbital elements of the vessel (see getOrbitElements)
+    -targetElements : orbital elements of the target
+    -revolutions : number of windows (default : 5)
+    -margin : time before the first window, in seconds (default : 120.0)
+    -iterations : iterations of the refinement (default : 8)
+
+    """
+    mu = elements['mu']
+    n1, n2 = _meanMotion(elements), _meanMotion(targetElements)
+    if abs(n1 - n2) < 1e-12:
+        raise ValueError("getTransferWindows : same orbital period as the "
+                         "target, no phasing possible")
+    offset = _periapsisOffset(elements, targetElements)
+
+    # Circular orbits : the phase varies at n2 - n1, the target must lead by
+    # pi - n2*tof at the burn
+    ut0 = elements['ut']
+    tof = math.pi * math.sqrt(((elements['sma'] + targetElements['sma']) / 2)
+                              ** 3 / mu)
+    synodic = 2 * math.pi / abs(n2 - n1)
+    first = (_wrap(math.pi - n2 * tof) -
+             phaseAngle(elements, targetElements)) / (n2 - n1)
+    first = margin + (first - margin) % synodic
+    ut = ut0 + first + synodic * np.arange(revolutions)
+
+    for _ in range(iterations):
+        burnAnomaly = _trueAnomalies(elements, ut)
+        burnRadius = _radius(elements, burnAnomaly)
+        arrivalRadius = _radius(targetElements,
+                                burnAnomaly + math.pi - offset)
+        tof = math.pi * np.sqrt(((burnRadius + arrivalRadius) / 2)**3 / mu)
+        targetAnomaly = _trueAnomalies(targetElements, ut + tof)
+        miss = _wrap(targetAnomaly + offset - burnAnomaly - math.pi)
+        ut = ut - miss / (n2 - n1)
+
+    # The transfer orbit is horizontal at both ends : the burn also cancels
+    # the radial speed (node components along the velocity and outwards)
+    departure = np.sqrt(2 * mu * arrivalRadius /
+                        (burnRadius * (burnRadius + arrivalRadius)))
+    arrival = departure * burnRadius / arrivalRadius
+    radialSpeed, horizontalSpeed = _speeds(elements, burnAnomaly)
+    speed = np.hypot(radialSpeed, horizontalSpeed)
+    prograde = (horizontalSpeed * (departure - horizontalSpeed) -
+                radialSpeed**2) / speed
+    radial = -radialSpeed * departure / speed
+    targetRadial, targetHorizontal = _speeds(targetElements,
+                                             targetAnomaly)
+    matching = np.hypot(targetRadial, targetHorizontal - arrival)
+    return ut, prograde, radial, matching, tof
+
+
+def planTransfer(elements, targetElements, revolutions=5, margin=120.0):
+    """Return the node (ut, prograde, normal, radial) of the cheapest
+    Hohmann transfer to the target within the next revolutions.
+
+    The cheapest window is kept, the earliest one among those within
+    DV_MARGIN of it.
+    """
+    ut, prograde, radial, matching, _ = getTransferWindows(
+        elements, targetElements, revolutions, margin)
+    cost = np.hypot(prograde, radial) + matching
+    best = int(np.argmax(cost <= cost.min() + DV_MARGIN))
+    return (float(ut[best]), float(prograde[best]), 0.0, float(radial[best]))
+
+
+def stateAt(elements, ut):
+    """Return the (position, velocity) of an orbit at the given ut(s).
+
+    Vectorized : the arrays have the shape of ut plus a last axis of 3, in
+    the axes of getOrbitAxes.
+    """
+    ut = np.asarray(ut, dtype=float)
+    P, Q, _ = getOrbitAxes(elements)
+    nu = _trueAnomalies(elements, ut)[..., None]
+    p = elements['sma'] * (1 - elements['ecc']**2)
+    radius = p / (1 + elements['ecc'] * np.cos(nu))
+    position = radius * (np.cos(nu) * P + np.sin(nu) * Q)
+    velocity = math.sqrt(elements['mu'] / p) * \
+        (-np.sin(nu) * P + (elements['ecc'] + np.cos(nu)) * Q)
+    return position, velocity
+
+
+def _porkchopRows(args):
+    """Return the delta-v of the transfers of some departures (rows)."""
+    elements, targetElements, departures, flightTimes = args
+    r1, v1 = stateAt(elements, departures)
+    arrivals = departures[:, None] + flightTimes[None, :]
+    r2, v2 = stateAt(targetElements, arrivals)
+    normal = getOrbitAxes(elements)[2]
+    t1, t2 = lambert(r1[:, None, :], r2, arrivals - departures[:, None],
+                     elements['mu'], normal)
+    return np.linalg.norm(t1 - v1[:, None, :], axis=-1) + \
+        np.linalg.norm(v2 - t2, axis=-1)
+
+
+def porkchop(elements, targetElements, departures, flightTimes,
+             processes=None):
+    """Return the delta-v grid of the transfers to the target.
+
+    The grid is departures x flightTimes : departure burn (from the orbit of
+    the vessel to the Lambert orbit) plus arrival burn (to the velocity of
+    the target), NaN where Lambert's problem has no solution. The rows are
+    split across a process pool.
+
+    Args:
+    -elements : orbital elements of the vessel (see getOrbitElements)
+    -targetElements : orbital elements of the target
+    -departures : ut of the departures, in seconds
+    -flightTimes : times of flight, in seconds
+    -processes : size of the pool (default : number of CPUs, 1 : no pool)
+
+    """
+    departures = np.asarray(departures, dtype=float)
+    flightTimes = np.asarray(flightTimes, dtype=float)
+    processes = processes or os.cpu_count() or 1
+    count = min(processes, len(departures) // POOL_MIN_ROWS)
+    if count < 2:
+        return _porkchopRows((elements, targetElements, departures,
+                              flightTimes))
+    chunks = [(elements, targetElements, rows, flightTimes)
+              for rows in np.array_split(departures, count)]
+    with ProcessPoolExecutor(count) as pool:
+        return np.concatenate(list(pool.map(_porkchopRows, chunks)))
+
+
+def planLambertTransfer(elements, targetElements, departures, flightTimes,
+                        processes=None):
+    """Return the node of the cheapest transfer of a porkchop grid.
+
+    Return (node, time of flight, total delta-v), the node is
+    (ut, prograde, normal, radial).
+    """
+    grid = porkchop(elements, targetElements, departures, flightTimes,
+                    processes)
+    if np.all(np.isnan(grid)):
+        raise ValueError("planLambertTransfer : no transfer found")
+    row, column = np.unravel_index(np.nanargmin(grid), grid.shape)
+    ut, tof = float(departures[row]), float(flightTimes[column])
+
+    # Burn of the best transfer, in the frame of the node
+    position, velocity = stateAt(elements, ut)
+    arrival = stateAt(targetElements, ut + tof)[0]
+    transfer = lambert(position, arrival, tof, elements['mu'],
+                       getOrbitAxes(elements)[2])[0]
+    burn = transfer - velocity
+    prograde = velocity / np.linalg.norm(velocity)
+    normal = np.cross(position, velocity)
+    normal /= np.linalg.norm(normal)
+    radial = np.cross(prograde, normal)
+    node = (ut, float(np.dot(burn, prograde)), float(np.dot(burn, normal)),
+            float(np.dot(burn, radial)))
+    return node, tof, float(grid[row, column])
+
+
+def _isCoplanarCircular(elements, targetElements):
+    """Return True if the Hohmann transfer of planTransfer applies."""
+    normal = getOrbitAxes(elements)[2]
+    targetNormal = getOrbitAxes(targetElements)[2]
+    angle = math.acos(min(1.0, float(np.dot(normal, targetNormal))))
+    return angle <= PLANE_TOLERANCE and \
+        max(elements['ecc'], targetElements['ecc']) <= ECC_TOLERANCE
+
+
+def manTransfer(conn, target, revolutions=5, tolerance=0.01, leadTime=5,
+                processes=None):
+    """Transfer to the target, meeting it at the end of the transfer.
+
+    The node is planned from the orbital elements (a single request per
+    orbit), the executor warps once to the burn. Coplanar and nearly
+    circular orbits use the Hohmann windows of planTransfer, the others
+    the cheapest Lambert transfer of a porkchop search over a synodic
+    period.
+
+    Args:
+    -conn : return value of the initial krpc.connect()
+    -target : vessel (or body) to meet
+    -revolutions : number of windows compared (default : 5)
+    -tolerance : remaining delta-v at the end of the burn, in m/s
+    (default : 0.01)
+    -leadTime : lead time of warp before burn time (default : 5)
+    -processes : size of the pool of the porkchop search (default : number
+    of CPUs)
+
+    """
+    vessel = conn.space_center.active_vessel
+    elements = getOrbitElements(conn, vessel.orbit)
+    targetElements = getOrbitElements(conn, target.orbit)
+    if _isCoplanarCircular(elements, targetElements):
+        node = planTransfer(elements, targetElements, revolutions)
+    else:
+        targetPeriod = 2 * math.pi / _meanMotion(targetElements)
+        synodic = 2 * math.pi / abs(_meanMotion(elements)
+                                    - _meanMotion(targetElements))
+        start = elements['ut'] + 120.0
+        departures = np.linspace(start, start + min(synodic, revolutions *
+                                                    targetPeriod),
+                                 PORKCHOP_SIZE)
+        flightTimes = np.linspace(0.1, 1.0, PORKCHOP_SIZE) * targetPeriod
+        node = planLambertTransfer(elements, targetElements, departures,
+                                   flightTimes, processes)[0]
+    vessel.control.add_node(*node)
+    executeNextNode(conn, tolerance, leadTime)
@@ -0,0 +1,638 @@
+"""Replay recorded telemetry through a stand-in of the kRPC connection.
+
+ReplayConnection exposes the part of the conn / space_center / vessel /
+flight / orbit API used by the toolkit. Values are served from a
+recording (see toolkit.recorder) at the current replay UT, and every
+control write or command is logged instead of being sent. The UT only
+moves when something waits for a stream update (stream.wait, so
+waitUntil and the ControlLoops ticking on a UT stream), by one recorded
+row at a time. A replay is therefore deterministic and runs as fast as
+the code under test. The server side events of the toolkit waits
+(waitEvent, waitUt, ...) are evaluated at each recorded row : comparisons
+and logical operators of constants and calls are supported.
+
+The replay is open loop : the recorded values do not react to the
+controls, compare the logged writes between two versions of the code.
+
+Example :
+    conn = ReplayConnection('recordings/docking')
+    vessel = conn.space_center.active_vessel
+    target = conn.space_center.target_vessel
+    conn.run(dockVesselWithTarget, conn, vessel, target,
+             vessel.parts.docking_ports[0], target.parts.docking_ports[0])
+    print(conn.writes('forward'))
+    closeConnection(conn)
+
+conn.run returns ENDED instead of the result of the function when the
+recording ended first.
+
+Recorded columns used (names of Recorder.addVessel) :
+-meanAltitude, surfaceAltitude, speed, verticalSpeed, horizontalSpeed
+-mass, thrust, throttle, apoapsisAlt, periapsisAlt
+-position, velocity (vectors, body reference frame)
+The last second of a recording can't be used by the impact predictions,
+orbit.position_at is also read 1 s ahead.
+-portPosition, portVelocity (vectors, docking port reference frame, see
+Recorder.addRelative('port', vessel, targetDP))
+
+"""
+
+import math
+import threading
+import numpy as np
+from toolkit.recorder import Recording
+
+
+# Kerbin, used when the recording has no body constants
+DEFAULT_BODY = {'name': 'Kerbin',
+                'mu': 3.5316e12,
+                'radius': 600000.0,
+                'rotationalSpeed': 2 * math.pi / 21549.425,
+                'rotationalPeriod': 21549.425}
+
+# Recorded columns of the flight, vessel and orbit attributes
+FLIGHT_COLUMNS = {'mean_altitude': 'meanAltitude',
+                  'surface_altitude': 'surfaceAltitude',
+                  'speed': 'speed',
+                  'vertical_speed': 'verticalSpeed',
+                  'horizontal_speed': 'horizontalSpeed'}
+VESSEL_COLUMNS = {'mass': 'mass',
+                  'thrust': 'thrust'}
+ORBIT_COLUMNS = {'apoapsis_altitude': 'apoapsisAlt',
+                 'periapsis_altitude': 'periapsisAlt'}
+
+# Default commanded values of the controls
+CONTROL_DEFAULTS = {'throttle': 0.0, 'up': 0.0, 'forward': 0.0,
+                    'right': 0.0, 'pitch': 0.0, 'yaw': 0.0, 'roll': 0.0,
+                    'wheel_throttle': 0.0, 'wheel_steering': 0.0,
+                    'sas': False, 'rcs': False, 'gear': False,
+                    'lights': False, 'brakes': False}
+
+
+class ReplayError(AttributeError):
+    """Raised when the replayed code needs something that was not
+    recorded (an AttributeError, so hasattr() works as usual)."""
+
+
+class ReplayEnd(Exception):
+    """Raised when the replay runs past the end of the recording."""
+
+
+class _Ended:
+    """Type of ENDED."""
+
+    def __repr__(self):
+        return 'ENDED'
+
+
+# Returned by ReplayConnection.run when the recording ended first
+ENDED = _Ended()
+
+
+class ReplayEnum:
+    """Stand-in of a kRPC enumeration, its values are plain strings."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, value):
+        if value.startswith('_'):
+            raise AttributeError(value)
+        return self._name + '.' + value
+
+
+class ReplayFrame:
+    """Reference frame, identified by the prefix of its recorded columns."""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+
+    def column(self, quantity):
+        """Return the column of a quantity measured in this frame."""
+        if self.prefix == '':
+            return quantity
+        return self.prefix + quantity[0].upper() + quantity[1:]
+
+    def __repr__(self):
+        return "<ReplayFrame : " + (self.prefix or 'body') + ">"
+
+
+class _ReplayFrames:
+    """Stand-in of space_center.ReferenceFrame."""
+
+    @staticmethod
+    def create_hybrid(position, rotation=None, velocity=None,
+                      angular_velocity=None):
+        """Return the frame of position (the rotation is not modelled)."""
+        return ReplayFrame(position.prefix)
+
+    @staticmethod
+    def create_relative(reference_frame, position=(0.0, 0.0, 0.0),
+                        rotation=(0.0, 0.0, 0.0, 1.0),
+                        velocity=(0.0, 0.0, 0.0),
+                        angular_velocity=(0.0, 0.0, 0.0)):
+        """Return the reference frame (offsets are not modelled)."""
+        return ReplayFrame(reference_frame.prefix)
+
+
+class _Logged:
+    """Object whose attribute writes and commands are logged.
+
+    Attributes that are not defined by the class are stored in
+    'values' and read back from there, defaults come from 'defaults'.
+    """
+
+    defaults = {}
+    commands = ()
+
+    def __init__(self, conn, path):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, 'values', dict(self.defaults))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self.commands:
+            def command(*args):
+                self._conn.record(self._path, name, args)
+            return command
+        if name in self.values:
+            return self.values[name]
+        raise ReplayError("Not available in a replay : %s.%s"
+                          % (self._path, name))
+
+    def __setattr__(self, name, value):
+        if isinstance(getattr(type(self), name, None), property):
+            object.__setattr__(self, name, value)
+            return
+        self.values[name] = value
+        self._conn.record(self._path, name, value)
+
+
+class ReplayControl(_Logged):
+    """Stand-in of vessel.control, the throttle defaults to the record."""
+
+    defaults = CONTROL_DEFAULTS
+    commands = ('activate_next_stage', 'toggle_action_group',
+                'set_action_group', 'add_node', 'remove_nodes')
+
+    def __init__(self, conn, path):
+        _Logged.__init__(self, conn, path)
+        del self.values['throttle']
+
+    def __getattr__(self, name):
+        if name == 'throttle' and 'throttle' not in self.values:
+            return self._conn.value('throttle')
+        return _Logged.__getattr__(self, name)
+
+
+class ReplayAutoPilot(_Logged):
+    """Stand-in of vessel.auto_pilot."""
+
+    defaults = {'target_pitch': 0.0, 'target_heading': 0.0,
+                'target_roll': float('nan'), 'reference_frame': None,
+                'target_direction': (0.0, 1.0, 0.0)}
+    commands = ('engage', 'disengage', 'target_pitch_and_heading',
+                'wait')
+
+
+class ReplayBody:
+    """Stand-in of a celestial body, with the recorded constants."""
+
+    def __init__(self, conn, constants):
+        self._conn = conn
+        self.name = constants['name']
+        self.gravitational_parameter = constants['mu']
+        self.equatorial_radius = constants['radius']
+        self.rotational_speed = constants['rotationalSpeed']
+        self.rotational_period = constants['rotationalPeriod']
+        self.reference_frame = ReplayFrame('')
+        self.non_rotating_reference_frame = ReplayFrame('nonRotating')
+        self.orbital_reference_frame = ReplayFrame('nonRotating')
+
+    def surface_height(self, latitude, longitude):
+        """Return the height of the terrain under the vessel (the terrain
+        elsewhere is not recorded)."""
+        try:
+            return (self._conn.value('meanAltitude')
+                    - self._conn.value('surfaceAltitude'))
+        except ReplayError:
+            return 0.0
+
+
+class ReplayOrbit:
+    """Stand-in of vessel.orbit."""
+
+    def __init__(self, conn, body):
+        self._conn = conn
+        self.body = body
+
+    def __getattr__(self, name):
+        if name in ORBIT_COLUMNS:
+            return self._conn.value(ORBIT_COLUMNS[name])
+        raise ReplayError("Not available in a replay : orbit." + name)
+
+    def position_at(self, ut, reference_frame):
+        """Return the recorded position at ut, interpolated.
+
+        As with kRPC, the position is expressed in the axes of the frame as
+        they are now : a position recorded in the rotating body frame is
+        rotated back by the rotation of the body between now and ut.
+        NB : ut must be recorded, so the impact predictions (that also read
+        the position 1 s ahead) stop 1 s before the end of the recording.
+        """
+        x, y, z = self._conn.valueAt(reference_frame.column('position'), ut)
+        if reference_frame.prefix != '':
+            return (x, y, z)
+        theta = self.body.rotational_speed * (ut - self._conn.ut)
+        cosT, sinT = math.cos(theta), math.sin(theta)
+        return (x*cosT - z*sinT, y, x*sinT + z*cosT)
+
+
+class ReplayFlight:
+    """Stand-in of vessel.flight(reference_frame)."""
+
+    def __init__(self, conn, frame):
+        self._conn = conn
+        self._frame = frame
+
+    def __getattr__(self, name):
+        if name in FLIGHT_COLUMNS:
+            return self._conn.value(FLIGHT_COLUMNS[name])
+        if name == 'velocity':
+            return self._conn.value(self._frame.column('velocity'))
+        raise ReplayError("Not available in a replay : flight." + name)
+
+
+class ReplayPart:
+    """Stand-in of a part."""
+
+    def __init__(self, title, tag='', docking_port=None):
+        self.title = title
+        self.name = title
+        self.tag = tag
+        self.docking_port = docking_port
+
+
+class ReplayDockingPort:
+    """Stand-in of a docking port.
+
+    The port of the replayed vessel is 'docking' once the recorded
+    distance to the target port is below captureDistance, then 'docked'
+    on the next update.
+    """
+
+    def __init__(self, conn, prefix, captureDistance=1.0, tag=''):
+        self._conn = conn
+        self.reference_frame = ReplayFrame(prefix)
+        self.part = ReplayPart('Docking Port', tag, self)
+        self.captureDistance = captureDistance
+        self.captured = None
+
+    @property
+    def state(self):
+        states = self._conn.space_center.DockingPortState
+        if self.captured is not None:
+            if self._conn.ut > self.captured:
+                return states.docked
+            return states.docking
+        try:
+            pos = self._conn.value('portPosition')
+        except ReplayError:
+            return states.ready
+        if math.sqrt(sum(x * x for x in pos)) < self.captureDistance:
+            self.captured = self._conn.ut
+            return states.docking
+        return states.ready
+
+    def undock(self):
+        """Log the undocking."""
+        self._conn.record('docking_port', 'undock', ())
+
+
+class ReplayParts(_Logged):
+    """Stand-in of vessel.parts."""
+
+    defaults = {'controlling': None}
+
+    def __init__(self, conn, path, docking_ports):
+        _Logged.__init__(self, conn, path)
+        self.values['docking_ports'] = docking_ports
+        self.values['all'] = [D.part for D in docking_ports]
+
+
+class ReplayVessel:
+    """Stand-in of a vessel, the recorded one or a fixed target."""
+
+    def __init__(self, conn, name, body, recorded=True, dockingPort=None):
+        self._conn = conn
+        self.name = name
+        self.recorded = recorded
+        self.orbit = ReplayOrbit(conn, body)
+        self.control = ReplayControl(conn, name + '.control')
+        self.auto_pilot = ReplayAutoPilot(conn, name + '.auto_pilot')
+        ports = [] if dockingPort is None else [dockingPort]
+        self.parts = ReplayParts(conn, name + '.parts', ports)
+        self.reference_frame = ReplayFrame('vessel')
+        self.orbital_reference_frame = ReplayFrame(
+            'orbital' if recorded else 'target')
+        self.surface_reference_frame = ReplayFrame('surface')
+
+    def __getattr__(self, name):
+        if name in VESSEL_COLUMNS and self.recorded:
+            return self._conn.value(VESSEL_COLUMNS[name])
+        raise ReplayError("Not available in a replay : %s.%s"
+                          % (self.name, name))
+
+    def position(self, reference_frame):
+        """Return the recorded position in the frame."""
+        if not self.recorded:
+            return (0.0, 0.0, 0.0)
+        return self._conn.value(reference_frame.column('position'))
+
+    def velocity(self, reference_frame):
+        """Return the recorded velocity in the frame."""
+        if not self.recorded:
+            return (0.0, 0.0, 0.0)
+        return self._conn.value(reference_frame.column('velocity'))
+
+    def flight(self, reference_frame=None):
+        """Return the flight telemetry in the frame."""
+        if reference_frame is None:
+            reference_frame = ReplayFrame('surface')
+        return ReplayFlight(self._conn, reference_frame)
+
+    def __repr__(self):
+        return "<ReplayVessel : " + self.name + ">"
+
+
+class ReplaySpaceCenter(_Logged):
+    """Stand-in of conn.space_center."""
+
+    commands = ('launch_vessel', 'quicksave', 'quickload')
+
+    def __init__(self, conn, vessel, target):
+        _Logged.__init__(self, conn, 'space_center')
+        self.values.update({'active_vessel': vessel,
+                            'target_vessel': target,
+                            'target_docking_port': None,
+                            'vessels': [vessel, target],
+                            'bodies': {vessel.orbit.body.name:
+                                       vessel.orbit.body}})
+        object.__setattr__(self, 'ReferenceFrame', _ReplayFrames)
+        for enum in ('DockingPortState', 'SASMode', 'SpeedMode',
+                     'VesselType', 'VesselSituation'):
+            object.__setattr__(self, enum, ReplayEnum(enum))
+
+    @property
+    def ut(self):
+        return self._conn.ut
+
+    def warp_to(self, ut, max_rails_rate=100000.0, max_physics_rate=2.0):
+        """Log the warp and move the replay to ut."""
+        self._conn.record('space_center', 'warp_to', (ut,))
+        self._conn.seek(ut)
+
+
+class ReplayStream:
+    """Stand-in of a kRPC stream, evaluated at the replay UT."""
+
+    def __init__(self, conn, func, args):
+        self._conn = conn
+        self._func = func
+        self._args = args
+        self._callbacks = []
+        self.rate = 0.0
+        self.started = True
+
+    def __call__(self):
+        return self._func(*self._args)
+
+    @property
+    def condition(self):
+        return self._conn.condition
+
+    def start(self, wait=True):
+        pass
+
+    def wait(self, timeout=None):
+        """Move the replay to the next recorded update."""
+        self._conn.step()
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def remove(self):
+        self._conn.streams.discard(self)
+
+
+class ReplayExpression:
+    """Stand-in of conn.krpc.Expression : builds the expressions as
+    functions evaluated at the replay UT."""
+
+    @staticmethod
+    def call(call):
+        func, args = call
+        return lambda: func(*args)
+
+    @staticmethod
+    def _constant(value):
+        return lambda: value
+
+    constant_double = constant_float = constant_int = constant_bool = \
+        constant_string = _constant
+
+    @staticmethod
+    def equal(a, b):
+        return lambda: a() == b()
+
+    @staticmethod
+    def not_equal(a, b):
+        return lambda: a() != b()
+
+    @staticmethod
+    def greater_than(a, b):
+        return lambda: a() > b()
+
+    @staticmethod
+    def greater_than_or_equal(a, b):
+        return lambda: a() >= b()
+
+    @staticmethod
+    def less_than(a, b):
+        return lambda: a() < b()
+
+    @staticmethod
+    def less_than_or_equal(a, b):
+        return lambda: a() <= b()
+
+    @staticmethod
+    def and_(a, b):
+        return lambda: a() and b()
+
+    @staticmethod
+    def or_(a, b):
+        return lambda: a() or b()
+
+    @staticmethod
+    def not_(a):
+        return lambda: not a()
+
+
+class ReplayEvent:
+    """Stand-in of a kRPC event, whose expression is checked at each
+    recorded row."""
+
+    def __init__(self, conn, expression):
+        self.stream = ReplayStream(conn, lambda: bool(expression()), ())
+        conn.streams.add(self.stream)
+        self.condition = conn.condition
+
+    def start(self):
+        pass
+
+    def wait(self, timeout=None):
+        """Move the replay until the expression is True."""
+        while not self.stream():
+            self.stream.wait()
+
+    def add_callback(self, callback):
+        self.stream.add_callback(lambda value: value and callback())
+
+    def remove(self):
+        self.stream.remove()
+
+
+class ReplayKRPC:
+    """Stand-in of conn.krpc."""
+
+    Expression = ReplayExpression
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def add_event(self, expression):
+        """Return an event that is triggered when expression is True."""
+        return ReplayEvent(self._conn, expression)
+
+
+class ReplayConnection:
+    """Stand-in of the kRPC connection, driven by a recording."""
+
+    def __init__(self, recording, startUt=None, captureDistance=1.0):
+        """Open the replay.
+
+        Args:
+        -recording : Recording, or directory of a recording
+        -startUt : UT where the replay starts (default : first row)
+        -captureDistance : distance under which the docking ports catch
+        each other, in meters (default : 1.0)
+
+        """
+        if not isinstance(recording, Recording):
+            recording = Recording(recording)
+        self.recording = recording
+        self.uts = np.asarray(recording['ut'])
+        if len(self.uts) == 0:
+            raise ReplayError("Empty recording")
+        self.row = 0
+        self.log = []
+        self.streams = set()
+        self.condition = threading.Condition()
+        self.cache = {}
+
+        body = ReplayBody(self, recording.constants.get('body',
+                                                        DEFAULT_BODY))
+        port = ReplayDockingPort(self, 'port', captureDistance)
+        targetPort = ReplayDockingPort(self, 'port', captureDistance)
+        targetPort.captureDistance = -1.0  # Its state is not recorded
+        self.vessel = ReplayVessel(self, 'vessel', body, dockingPort=port)
+        self.target = ReplayVessel(self, 'target', body, recorded=False,
+                                   dockingPort=targetPort)
+        self.space_center = ReplaySpaceCenter(self, self.vessel, self.target)
+        self.krpc = ReplayKRPC(self)
+        if startUt is not None:
+            self.seek(startUt)
+
+    @property
+    def ut(self):
+        """Current UT of the replay."""
+        return float(self.uts[self.row])
+
+    def step(self):
+        """Move to the next recorded row."""
+        if self.row + 1 >= len(self.uts):
+            raise ReplayEnd("End of the recording at UT %.3f" % self.ut)
+        self.row += 1
+        for stream in list(self.streams):
+            for callback in stream._callbacks:
+                callback(stream())
+
+    def seek(self, ut):
+        """Move to the last recorded row at or before ut."""
+        if ut > self.uts[-1]:
+            raise ReplayEnd("UT %.3f is past the end of the recording" % ut)
+        self.row = max(self.row,
+                       int(np.searchsorted(self.uts, ut, side='right')) - 1)
+
+    def _column(self, column):
+        """Return the values of a column (or (N, 3) vector), cached."""
+        if column not in self.cache:
+            columns = self.recording.columns
+            if column in columns:
+                self.cache[column] = np.asarray(self.recording[column])
+            elif column + '_x' in columns:
+                self.cache[column] = self.recording.vector(column)
+            else:
+                raise ReplayError("Not recorded : " + column)
+        return self.cache[column]
+
+    def value(self, column):
+        """Return the value of a column at the replay UT."""
+        value = self._column(column)[self.row]
+        return tuple(value.tolist()) if value.ndim > 0 else float(value)
+
+    def valueAt(self, column, ut):
+        """Return the value of a column at any recorded UT, interpolated."""
+        if (ut < self.uts[0]) or (ut > self.uts[-1]):
+            raise ReplayEnd("UT %.3f is outside the recording" % ut)
+        values = self._column(column)
+        if values.ndim == 1:
+            return float(np.interp(ut, self.uts, values))
+        return tuple(float(np.interp(ut, self.uts, values[:, i]))
+                     for i in range(values.shape[1]))
+
+    def record(self, path, name, value):
+        """Log a control write or command."""
+        self.log.append((self.ut, path, name, value))
+
+    def writes(self, name=None):
+        """Return the logged (ut, path, name, value), filtered by name."""
+        if name is None:
+            return list(self.log)
+        return [entry for entry in self.log if entry[2] == name]
+
+    def add_stream(self, func, *args):
+        """Return a stream of func(*args), evaluated at the replay UT."""
+        stream = ReplayStream(self, func, args)
+        self.streams.add(stream)
+        return stream
+
+    def get_call(self, func, *args):
+        """Return the call of func(*args), for ReplayExpression.call."""
+        return (func, args)
+
+    def run(self, func, *args, **kwargs):
+        """Call func, return its result (ENDED if the recording ended)."""
+        try:
+            return func(*args, **kwargs)
+        except ReplayEnd:
+            return ENDED
+
+    def close(self):
+        """Remove the streams."""
+        self.streams = set()
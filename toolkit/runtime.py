@@ -0,0 +1,209 @@
+"""asyncio counterparts of the toolkit helpers and a small mission runtime.
+
+All the coroutines share the same kRPC connection (the client is thread
+safe). Waits are driven by stream callbacks and server side events, so
+they do not hold a thread; the few RPCs they make (to build an expression,
+start an event, ...) are sent from a worker thread. The other helpers
+(maneuvers, docking, deployment) run in a worker thread of the runtime and
+can be awaited while other coroutines keep flying, e.g. monitoring the
+carrier while a freshly undocked satellite circularizes.
+
+NB : cancelling one of these helpers does not stop its worker thread, which
+keeps flying the vessel until the helper returns. Only
+executeNextNodeAsync is stopped : the burn ends and the controls are
+released at the next stream update. The node executor and the kRPC auto
+pilot act on the active vessel only, so two maneuvers can not be executed
+at the same time.
+
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from toolkit.docking import dockVesselWithTarget, moveXFromTarget
+from toolkit.maneuvers import NodeExecutor, manApoapsis, manCircularize,\
+    manInclination, manKillRelVel, manOrbit, manPeriapsis, manPlane,\
+    manSemiMajorAxis
+from toolkit.misc import countdown
+from toolkit.rendezvous import manTransfer
+from toolkit.vessel import deployAntennas, deployFairing, deployRadiators,\
+    deploySolarPanels, vesselDeorbit
+from toolkit.wait import utReached
+
+
+def _setResult(future, value=True):
+    """Set the result of a future, unless it is already done."""
+    if not future.done():
+        future.set_result(value)
+
+
+async def toThread(func, *args, **kwargs):
+    """Run a blocking function in a worker thread and return its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+def asyncVersion(func):
+    """Return a coroutine function running func in a worker thread.
+
+    NB : cancelling the coroutine does not stop func.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await toThread(func, *args, **kwargs)
+    wrapper.__name__ = func.__name__ + 'Async'
+    wrapper.__qualname__ = wrapper.__name__
+    return wrapper
+
+
+async def waitUntilAsync(stream, predicate, timeout=None):
+    """Wait for predicate(stream()) to be True without holding a thread.
+
+    Return True once it is, or False if the timeout expired first.
+    """
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def check(value):
+        # Called by the stream update thread
+        if predicate(value):
+            loop.call_soon_threadsafe(_setResult, done)
+
+    await toThread(stream)  # Make sure the stream is started
+    stream.add_callback(check)
+    try:
+        if predicate(stream()):
+            return True
+        await asyncio.wait_for(done, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        stream.remove_callback(check)
+
+
+async def waitEventAsync(conn, expression, timeout=None):
+    """Wait for a kRPC expression to be True on the server side."""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    event = await toThread(conn.krpc.add_event, expression)
+    event.add_callback(lambda: loop.call_soon_threadsafe(_setResult, done))
+    await toThread(event.start)
+    try:
+        await asyncio.wait_for(done, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        await toThread(event.remove)
+
+
+async def waitUtAsync(conn, seconds, timeout=None):
+    """Wait for a certain in game time (in seconds)."""
+    expression = await toThread(
+        lambda: utReached(conn, conn.space_center.ut + seconds))
+    return await waitEventAsync(conn, expression, timeout)
+
+
+async def every(period, func, *args):
+    """Call func(*args) every 'period' seconds (wall clock), until cancelled.
+
+    func can be a plain function or a coroutine function.
+    """
+    loop = asyncio.get_running_loop()
+    nextTick = loop.time()
+    while True:
+        result = func(*args)
+        if asyncio.iscoroutine(result):
+            await result
+        nextTick += period
+        await asyncio.sleep(max(0.0, nextTick - loop.time()))
+
+
+async def executeNextNodeAsync(conn, tolerance, leadTime):
+    """Execute the next node of the active vessel (see NodeExecutor).
+
+    Return the delta-v left along the burn. If the coroutine is cancelled,
+    the burn is stopped and the controls are released (the node is kept).
+    """
+    executor = await toThread(NodeExecutor, conn, tolerance, leadTime)
+    try:
+        return await toThread(executor.run)
+    except asyncio.CancelledError:
+        executor.cancel()
+        raise
+
+
+# Maneuvers
+manPeriapsisAsync = asyncVersion(manPeriapsis)
+manApoapsisAsync = asyncVersion(manApoapsis)
+manSemiMajorAxisAsync = asyncVersion(manSemiMajorAxis)
+manCircularizeAsync = asyncVersion(manCircularize)
+manInclinationAsync = asyncVersion(manInclination)
+manPlaneAsync = asyncVersion(manPlane)
+manOrbitAsync = asyncVersion(manOrbit)
+manKillRelVelAsync = asyncVersion(manKillRelVel)
+manTransferAsync = asyncVersion(manTransfer)
+
+# Docking
+dockVesselWithTargetAsync = asyncVersion(dockVesselWithTarget)
+moveXFromTargetAsync = asyncVersion(moveXFromTarget)
+
+# Deployment
+deployAntennasAsync = asyncVersion(deployAntennas)
+deployFairingAsync = asyncVersion(deployFairing)
+deployRadiatorsAsync = asyncVersion(deployRadiators)
+deploySolarPanelsAsync = asyncVersion(deploySolarPanels)
+vesselDeorbitAsync = asyncVersion(vesselDeorbit)
+
+# Misc
+countdownAsync = asyncVersion(countdown)
+
+
+class MissionRuntime:
+    """Schedule mission coroutines on a single connection.
+
+    Example :
+        runtime = MissionRuntime(conn)
+        runtime.run(circularizeSat(), monitorCarrier())
+
+    """
+
+    def __init__(self, conn, maxThreads=8):
+        """Initialize the runtime.
+
+        Args:
+        -conn : return value of the initial krpc.connect()
+        -maxThreads : max number of blocking helpers running at the same
+        time (default : 8)
+
+        """
+        self.conn = conn
+        self.maxThreads = maxThreads
+        self.tasks = []
+
+    def spawn(self, coro, name=None):
+        """Schedule a coroutine from inside the runtime, return its task."""
+        task = asyncio.get_running_loop().create_task(coro)
+        if name is not None:
+            task.set_name(name)
+        self.tasks.append(task)
+        return task
+
+    async def _main(self, coros):
+        """Run the coroutines, then cancel the tasks that were spawned."""
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.maxThreads)
+        loop.set_default_executor(executor)
+        try:
+            return await asyncio.gather(*coros)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.tasks = []
+
+    def run(self, *coros):
+        """Run the coroutines concurrently and return their results."""
+        return asyncio.run(self._main(coros))
@@ -0,0 +1,330 @@
+"""Stage and delta-v analysis of the craft files, offline.
+
+The stages are simulated from the part tree of the craft file :
+-at the activation of a stage, its decouplers drop their subtree, its
+fairings drop their panels (modMass) and its engines ignite
+-the engines burn the propellant of their fuel group (parts connected
+without crossing a decoupler or a docking port), up to the tanks dropped
+at the next decoupling, or to the last drop if nothing is dropped
+
+Craft files don't store the mass of the parts, only what their modules
+add to it (modMass), nor the engine performances : they come from the
+PART_MASSES and ENGINES tables below. Parts missing from PART_MASSES are
+counted as massless and listed in the 'unknown' field of the results.
+
+Example :
+    python -m toolkit.stages
+    python -m toolkit.stages craft-files/ESS/ESS-02.craft
+
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from toolkit.craft import findCraftFiles, loadCraft
+
+
+G0 = 9.80665  # Standard gravity (specific impulse), m/s²
+KERBIN_G = 9.81  # Surface gravity of Kerbin, m/s²
+
+# Density of the resources, t/unit
+RESOURCE_DENSITIES = {'LiquidFuel': 0.005,
+                      'Oxidizer': 0.005,
+                      'MonoPropellant': 0.004,
+                      'XenonGas': 0.0001,
+                      'SolidFuel': 0.0075,
+                      'Ore': 0.01}
+
+# Dry mass of the part configs, in t. The mass of the procedural parts is
+# 1 t in their configs, the rest is their modMass.
+PART_MASSES = {
+    # Stock (KSP 1.5.1)
+    'advSasModule': 0.1,
+    'asasmodule1-2': 0.2,
+    'batteryBank': 0.05,
+    'batteryBankLarge': 0.2,
+    'cupola': 1.8,
+    'Decoupler.3': 0.45,
+    'dockingPort3': 0.02,
+    'dockingPortLarge': 0.25,
+    'fairingSize3': 0.475,
+    'foldingRadLarge': 0.2,
+    'foldingRadMed': 0.1,
+    'GrapplingDevice': 0.5,
+    'HighGainAntenna5': 0.07,
+    'ionEngine': 0.25,
+    'largeAdapter': 0.1,
+    'Large.Crewed.Lab': 3.5,
+    'largeSolarPanel': 0.3,
+    'launchClamp1': 0.0,
+    'LgRadialSolarPanel': 0.04,
+    'liquidEngineMini.v2': 0.13,
+    'mediumDishAntenna': 0.05,
+    'probeCoreCube': 0.07,
+    'probeCoreOcto2.v2': 0.04,
+    'probeStackLarge': 0.5,
+    'RCSBlock': 0.05,
+    'rcsTankRadialLong': 0.03,
+    'RCSTank1-2': 0.4,
+    'RelayAntenna100': 0.65,
+    'RelayAntenna50': 0.3,
+    'sasModule': 0.05,
+    'Size3AdvancedEngine': 9.0,
+    'Size3EngineCluster': 15.0,
+    'Size3LargeTank': 9.0,
+    'Size3MediumTank': 4.5,
+    'Size3SmallTank': 2.25,
+    'solarPanels1': 0.025,
+    'solarPanels3': 0.0175,
+    'solarPanels5': 0.005,
+    'spotLight2': 0.015,
+    'strutConnector': 0.05,
+    'SurfAntenna': 0.015,
+    'trussAdapter': 0.2,
+    'trussPiece3x': 0.375,
+    # Procedural Parts
+    'proceduralBattery': 1.0,
+    'proceduralStructural': 1.0,
+    'proceduralTankLiquid': 1.0,
+    'proceduralTankXenon': 1.0,
+    # Other mods (approximate)
+    'Engineer7500': 0.01,
+    'EngineerChip': 0.005,
+    'FigaroTransmitter': 0.05,
+    'nfs-panel-deploying-advanced-2x6x6-lab-1': 0.5,
+    'nfs-panel-deploying-concentrator-1x3x1-juice-1': 0.3,
+    'nfs-panel-deploying-concentrator-1x4-juno-1': 0.15,
+    'sspx-adapter-125-25-1': 0.25,
+    'sspx-airlock-25-1': 0.9,
+    'sspx-cargo-container-25-1': 0.6,
+    'sspx-core-25-1': 4.0,
+    'sspx-greenhouse-25-1': 2.0,
+    'sspx-habitation-25-1': 3.0,
+    'sspx-hub-25-1': 1.0,
+    'sspx-tube-25-1': 0.4}
+
+# Engines : (vacuum thrust (kN), vacuum Isp (s), sea level Isp (s),
+# {propellant: ratio in units})
+ENGINES = {
+    'ionEngine': (2.0, 4200.0, 100.0, {'XenonGas': 1.0}),
+    'liquidEngineMini.v2': (20.0, 320.0, 265.0,
+                            {'LiquidFuel': 0.9, 'Oxidizer': 1.1}),
+    'Size3AdvancedEngine': (2000.0, 340.0, 205.0,
+                            {'LiquidFuel': 0.9, 'Oxidizer': 1.1}),
+    'Size3EngineCluster': (4000.0, 315.0, 295.0,
+                           {'LiquidFuel': 0.9, 'Oxidizer': 1.1})}
+
+DECOUPLER_MODULES = ('ModuleDecouple', 'ModuleAnchoredDecoupler')
+# Parts that don't let the propellant flow through them
+CROSSFEED_BLOCKERS = DECOUPLER_MODULES + ('ModuleDockingNode',)
+
+STAGE_DTYPE = np.dtype([('stage', 'i4'), ('wetMass', 'f8'),
+                        ('dryMass', 'f8'), ('thrust', 'f8'),
+                        ('ispVac', 'f8'), ('ispAsl', 'f8'),
+                        ('twrVac', 'f8'), ('twrAsl', 'f8'),
+                        ('deltaVVac', 'f8'), ('deltaVAsl', 'f8'),
+                        ('burnTime', 'f8')])
+
+
+def _hasModule(part, modules):
+    """Return True if the part has one of the modules."""
+    return any(module in modules for module in part.modules)
+
+
+def _subtree(craft, part):
+    """Return the indexes of the part and of the parts attached below it."""
+    indexes = []
+    stack = [part]
+    while stack:
+        P = stack.pop()
+        indexes.append(P.index)
+        stack.extend(craft.children(P))
+    return indexes
+
+
+def _fuelGroups(craft):
+    """Return the fuel group of each part (list of group numbers)."""
+    groups = [None] * len(craft.parts)
+    count = 0
+    for part in craft.parts:
+        if groups[part.index] is not None:
+            continue
+        groups[part.index] = count
+        if not _hasModule(part, CROSSFEED_BLOCKERS):
+            stack = [part]
+            while stack:
+                P = stack.pop()
+                neighbours = craft.children(P)
+                if P.parent is not None:
+                    neighbours.append(P.parent)
+                for N in neighbours:
+                    if groups[N.index] is None and \
+                            not _hasModule(N, CROSSFEED_BLOCKERS):
+                        groups[N.index] = count
+                        stack.append(N)
+        count += 1
+    return groups
+
+
+def _burn(engines, tanks, resources):
+    """Burn the propellant of the tanks with the engines.
+
+    Return the burnt mass (t), or 0 if the engines have nothing to burn.
+    The amounts of resources are decreased in place.
+
+    Args:
+    -engines : ENGINES entries of the burning engines (same propellants)
+    -tanks : indexes of the parts the propellant is taken from
+    -resources : list of {resource: amount} of the parts
+
+    """
+    ratios = engines[0][3]
+    available = {r: sum(resources[i].get(r, 0.0) for i in tanks)
+                 for r in ratios}
+    units = min(available[r] / ratios[r] for r in ratios)
+    if units <= 1e-6:  # Rounding leftovers of a previous burn
+        return 0.0
+    burnt = 0.0
+    for r, ratio in ratios.items():
+        fraction = units * ratio / available[r]
+        for i in tanks:
+            if r in resources[i]:
+                resources[i][r] *= 1.0 - fraction
+        burnt += units * ratio * RESOURCE_DENSITIES.get(r, 0.0)
+    return burnt
+
+
+def analyzeCraft(craft):
+    """Return the stages of a craft, from the first one fired.
+
+    Return a dict : 'path', 'ship', 'unknown' (names of the parts without
+    mass data) and 'stages', array of STAGE_DTYPE (masses in t, thrust in
+    kN, delta-v in m/s, burn time in s, TWR at the surface of Kerbin).
+    """
+    parts = craft.parts
+    clamps = [_hasModule(P, ('LaunchClamp',)) for P in parts]
+    dry = np.array([0.0 if clamp else PART_MASSES.get(P.name, 0.0)
+                    + P.modMass for P, clamp in zip(parts, clamps)])
+    resources = [{r: amount for r, (amount, _) in P.resources.items()}
+                 for P in parts]
+    present = np.array([not clamp for clamp in clamps])
+    groups = _fuelGroups(craft)
+
+    dropped = {}  # Parts dropped at the activation of each stage
+    for P in parts:
+        if P.istg >= 0 and _hasModule(P, DECOUPLER_MODULES):
+            dropped.setdefault(P.istg, []).extend(_subtree(craft, P))
+
+    def mass():
+        """Return the mass of the parts still attached, in t."""
+        return sum(dry[i] + sum(amount * RESOURCE_DENSITIES.get(r, 0.0)
+                                for r, amount in resources[i].items())
+                   for i in np.flatnonzero(present))
+
+    rows = []
+    for stage in craft.stages():
+        # Activation
+        present[dropped.get(stage, [])] = False
+        for P in parts:
+            if P.istg == stage and 'ModuleProceduralFairing' in P.modules:
+                dry[P.index] -= P.modMass
+
+        later = [s for s in dropped if s < stage]
+        nextDrop = set(dropped[max(later)]) if later else set()
+        engines = {}
+        for P in parts:
+            if present[P.index] and P.name in ENGINES and P.istg >= stage:
+                engines.setdefault(groups[P.index], []).append(P)
+
+        wetMass = mass()
+        thrust, flow, thrustAsl = 0.0, 0.0, 0.0
+        for group, groupEngines in engines.items():
+            tanks = [i for i in np.flatnonzero(present)
+                     if groups[i] == group and resources[i]]
+            if any(i in nextDrop for i in tanks):
+                tanks = [i for i in tanks if i in nextDrop]
+            data = [ENGINES[P.name] for P in groupEngines]
+            if _burn(data, tanks, resources) > 0.0:
+                for F, ispVac, ispAsl, _ in data:
+                    thrust += F
+                    flow += F / ispVac
+                    thrustAsl += F * ispAsl / ispVac
+        rows.append((stage, wetMass, mass(), thrust,
+                     thrust / flow if flow else 0.0,
+                     thrustAsl / flow if flow else 0.0))
+
+    stages = np.zeros(len(rows), dtype=STAGE_DTYPE)
+    for name, column in zip(('stage', 'wetMass', 'dryMass', 'thrust',
+                             'ispVac', 'ispAsl'), zip(*rows)):
+        stages[name] = column
+
+    # Rocket equation, on all the stages at once
+    wet, end, thrust = stages['wetMass'], stages['dryMass'], stages['thrust']
+    thrustAsl = thrust * np.divide(stages['ispAsl'], stages['ispVac'],
+                                   out=np.zeros(len(stages)),
+                                   where=stages['ispVac'] > 0)
+    ratio = np.log(np.divide(wet, end, out=np.ones(len(stages)),
+                             where=end > 0))
+    stages['deltaVVac'] = stages['ispVac'] * G0 * ratio
+    stages['deltaVAsl'] = stages['ispAsl'] * G0 * ratio
+    stages['twrVac'] = thrust / (wet * KERBIN_G)
+    stages['twrAsl'] = thrustAsl / (wet * KERBIN_G)
+    stages['burnTime'] = np.divide(stages['ispVac'] * G0 * (wet - end),
+                                   thrust, out=np.zeros(len(stages)),
+                                   where=thrust > 0)
+
+    unknown = sorted({P.name for P in parts if P.name not in PART_MASSES})
+    return {'path': craft.path, 'ship': craft.ship, 'unknown': unknown,
+            'stages': stages}
+
+
+def analyzeCraftFile(path):
+    """Return the stages of a craft file (see analyzeCraft)."""
+    return analyzeCraft(loadCraft(path))
+
+
+def analyzeFleet(paths=None, processes=None):
+    """Return the analyses of craft files, computed in a process pool.
+
+    Args:
+    -paths : craft files (default : all the files of craft-files/)
+    -processes : size of the pool (default : number of CPUs, 1 : no pool)
+
+    """
+    paths = findCraftFiles() if paths is None else paths
+    if processes == 1 or len(paths) < 2:
+        return [analyzeCraftFile(path) for path in paths]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(analyzeCraftFile, paths))
+
+
+def stageReport(analysis):
+    """Return the table of the stages of an analysis, as a string."""
+    stages = analysis['stages']
+    lines = ["%s : %.0f m/s (vacuum)" % (analysis['ship'],
+                                        stages['deltaVVac'].sum()),
+             "  %5s %9s %9s %9s %7s %7s %9s %9s %8s"
+             % ("stage", "wet (t)", "dry (t)", "thrust", "TWR asl",
+                "TWR vac", "dv asl", "dv vac", "burn (s)")]
+    for row in stages:
+        lines.append("  %5d %9.2f %9.2f %9.0f %7.2f %7.2f %9.0f %9.0f %8.0f"
+                     % (row['stage'], row['wetMass'], row['dryMass'],
+                        row['thrust'], row['twrAsl'], row['twrVac'],
+                        row['deltaVAsl'], row['deltaVVac'],
+                        row['burnTime']))
+    if analysis['unknown']:
+        lines.append("  No mass data (counted as massless) : "
+                     + ", ".join(analysis['unknown']))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='*',
+                        help="craft files (default : craft-files/)")
+    parser.add_argument('--processes', type=int,
+                        help="size of the process pool")
+    args = parser.parse_args()
+    for analysis in analyzeFleet(args.paths or None, args.processes):
+        print(stageReport(analysis))
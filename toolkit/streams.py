@@ -0,0 +1,181 @@
+"""Share the kRPC streams between the toolkit functions.
+
+Most helpers need the same streams (UT, thrust, ...). addStream hands out
+a handle on a shared server stream instead of creating a new one: the
+streams are keyed by the call they make, reference counted, and removed
+from the server when the last handle is removed. The handles behave like
+kRPC streams, so the usual stream.remove() releases them.
+
+Call closeConnection(conn) instead of conn.close() to get a report of
+the streams that were never removed.
+
+"""
+
+import threading
+
+
+# Stream pools shared by the toolkit, keyed by connection
+_streamPools = {}
+
+
+class PooledStream:
+    """Handle on a shared stream, used like a kRPC stream."""
+
+    def __init__(self, pool, key):
+        """Initialize the handle (use StreamPool.acquire)."""
+        self._pool = pool
+        self._key = key
+        self._callbacks = []
+        self.removed = False
+
+    @property
+    def stream(self):
+        """The shared kRPC stream."""
+        return self._pool.streams[self._key]
+
+    def __call__(self):
+        return self.stream()
+
+    @property
+    def condition(self):
+        """Condition variable that is notified when the stream updates."""
+        return self.stream.condition
+
+    @property
+    def rate(self):
+        """Update rate of the shared stream (Hz, 0 if unlimited)."""
+        return self.stream.rate
+
+    @rate.setter
+    def rate(self, value):
+        self.stream.rate = value
+
+    def start(self, wait=True):
+        """Start the shared stream."""
+        self.stream.start(wait)
+
+    def wait(self, timeout=None):
+        """Wait for the next update (the condition must be locked)."""
+        self.stream.wait(timeout)
+
+    def add_callback(self, callback):
+        """Add a callback, removed with the handle."""
+        self._callbacks.append(callback)
+        self.stream.add_callback(callback)
+
+    def remove_callback(self, callback):
+        """Remove a callback."""
+        self._callbacks.remove(callback)
+        self.stream.remove_callback(callback)
+
+    def remove(self):
+        """Release the handle (the stream is removed with the last one)."""
+        if self.removed:
+            return
+        for callback in self._callbacks:
+            self.stream.remove_callback(callback)
+        self._callbacks = []
+        self.removed = True
+        self._pool.release(self)
+
+    def __repr__(self):
+        return "<PooledStream : " + self._pool.labels[self._key] + ">"
+
+
+class StreamPool:
+    """Reference counted, deduplicated kRPC streams of a connection."""
+
+    def __init__(self, conn):
+        """Initialize an empty pool."""
+        self.conn = conn
+        self.streams = {}
+        self.labels = {}
+        self.holders = {}
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def key(self, func, *args):
+        """Return the key of a call : the serialized kRPC call if possible."""
+        try:
+            return self.conn.get_call(func, *args).SerializeToString()
+        except AttributeError:
+            return (func, args)
+
+    @staticmethod
+    def label(func, *args):
+        """Return a readable description of a call."""
+        if func is getattr:
+            return "%r.%s" % (args[0], args[1])
+        name = getattr(func, '__qualname__', repr(func))
+        return "%s(%s)" % (name, ", ".join(repr(arg) for arg in args))
+
+    def acquire(self, func, *args):
+        """Return a handle on the stream of func(*args)."""
+        key = self.key(func, *args)
+        with self.lock:
+            if key not in self.streams:
+                self.streams[key] = self.conn.add_stream(func, *args)
+                self.labels[key] = self.label(func, *args)
+                self.holders[key] = []
+                self.created += 1
+            handle = PooledStream(self, key)
+            self.holders[key].append(handle)
+        return handle
+
+    def release(self, handle):
+        """Release a handle, remove the stream if it was the last one."""
+        with self.lock:
+            holders = self.holders[handle._key]
+            holders.remove(handle)
+            if len(holders) == 0:
+                self.streams.pop(handle._key).remove()
+                del self.holders[handle._key]
+                del self.labels[handle._key]
+
+    def count(self):
+        """Return the number of live server streams."""
+        return len(self.streams)
+
+    def leaks(self):
+        """Return the description of the streams still held, with holders."""
+        with self.lock:
+            return [(self.labels[key], len(self.holders[key]))
+                    for key in self.streams]
+
+    def close(self):
+        """Report the streams still held and remove them from the server."""
+        leaks = self.leaks()
+        if len(leaks) > 0:
+            print("StreamPool : %d stream(s) never removed :" % len(leaks))
+            for label, holders in leaks:
+                print("  %s (%d holder(s))" % (label, holders))
+        with self.lock:
+            for stream in self.streams.values():
+                stream.remove()
+            self.streams = {}
+            self.labels = {}
+            self.holders = {}
+        return leaks
+
+
+def getStreamPool(conn):
+    """Return the stream pool shared by the toolkit for this connection."""
+    if conn not in _streamPools:
+        _streamPools[conn] = StreamPool(conn)
+    return _streamPools[conn]
+
+
+def addStream(conn, func, *args):
+    """Return a shared stream of func(*args), like conn.add_stream."""
+    return getStreamPool(conn).acquire(func, *args)
+
+
+def closeConnection(conn):
+    """Report the leaked streams of the connection, then close it."""
+    pool = _streamPools.pop(conn, None)
+    if pool is not None:
+        try:
+            pool.close()
+        except Exception as e:
+            print("StreamPool : could not remove the streams : " + str(e))
+    conn.close()
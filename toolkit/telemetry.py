@@ -0,0 +1,194 @@
+"""Read a set of kRPC streams as consistent snapshots.
+
+The server sends the new values of all the streams in one message per
+update. Reading several streams one after the other can mix values from
+two different updates (e.g. an apoapsis from the last update and an
+altitude from the previous one). A Telemetry captures every stream it
+holds from the stream update thread, once all the values of a message are
+stored, so each TelemetryFrame comes from a single server update.
+
+Example :
+    telemetry = Telemetry(conn)
+    telemetry.add('apoapsisAlt', getattr, vessel.orbit, 'apoapsis_altitude')
+    telemetry.add('meanAltitude', getattr, vessel.flight(), 'mean_altitude')
+    frame = telemetry.next()
+    while frame.apoapsisAlt < 80000.0:
+        ...
+        frame = telemetry.next()
+    telemetry.remove()
+
+"""
+
+import threading
+from time import monotonic
+import numpy as np
+from toolkit.streams import addStream
+
+
+# Names used by the frames themselves
+RESERVED_NAMES = ('number', 'received', 'fields', 'get', 'asDict', 'record')
+
+
+def _fieldType(value):
+    """Return the NumPy type of a telemetry value."""
+    if isinstance(value, bool):
+        return '?'
+    if isinstance(value, int):
+        return 'i8'
+    if isinstance(value, float):
+        return 'f8'
+    if isinstance(value, tuple) and \
+            all(isinstance(x, (int, float)) for x in value):
+        return ('f8', (len(value),))
+    return 'O'
+
+
+class TelemetryFrame:
+    """Read only snapshot of the telemetry streams, from one update.
+
+    The values are read as attributes (frame.meanAltitude). A value that
+    the server returned as an error raises it when read.
+    """
+
+    __slots__ = ('fields', 'number', 'received', '_values')
+
+    def __init__(self, fields, values, number, received):
+        """Initialize the frame (use Telemetry.next).
+
+        Args:
+        -fields : names of the values
+        -values : values of the streams, in the same order
+        -number : number of the update the frame was captured on
+        -received : monotonic time of the capture, in seconds
+
+        """
+        object.__setattr__(self, 'fields', fields)
+        object.__setattr__(self, 'number', number)
+        object.__setattr__(self, 'received', received)
+        object.__setattr__(self, '_values', dict(zip(fields, values)))
+
+    def __getattr__(self, name):
+        try:
+            value = self._values[name]
+        except KeyError:
+            raise AttributeError("No telemetry named " + repr(name)) from None
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def __setattr__(self, name, value):
+        raise AttributeError("A TelemetryFrame is read only")
+
+    def get(self, name, default=None):
+        """Return the value of a field, or default if there is none."""
+        if name not in self._values:
+            return default
+        return getattr(self, name)
+
+    def asDict(self):
+        """Return the values as a dictionary."""
+        return {name: getattr(self, name) for name in self.fields}
+
+    def record(self):
+        """Return the values as a NumPy record (vectors become arrays)."""
+        values = self.asDict()
+        dtype = [(name, _fieldType(values[name])) for name in self.fields]
+        return np.rec.array([tuple(values[name] for name in self.fields)],
+                            dtype=dtype)[0]
+
+    def __repr__(self):
+        values = ", ".join("%s=%r" % (name, self._values[name])
+                           for name in self.fields)
+        return "<TelemetryFrame %d : %s>" % (self.number, values)
+
+
+class Telemetry:
+    """Named streams captured together, one frame per server update."""
+
+    def __init__(self, conn):
+        """Initialize an empty telemetry.
+
+        Args:
+        -conn : return value of the initial krpc.connect()
+
+        """
+        self.conn = conn
+        self.streams = {}
+        self.frame = None
+        self.frames = 0
+        self.updated = threading.Condition()
+        self.callback = hasattr(conn, 'add_stream_update_callback')
+        if self.callback:
+            conn.add_stream_update_callback(self._capture)
+
+    def add(self, name, func, *args):
+        """Capture func(*args) in the frames, under the given name."""
+        if name.startswith('_') or name in RESERVED_NAMES:
+            raise ValueError("Invalid telemetry name : " + name)
+        stream = addStream(self.conn, func, *args)
+        stream()  # Make sure the stream is started
+        # Copied, the update thread reads the dictionary without locking
+        streams = dict(self.streams)
+        streams[name] = stream
+        self.streams = streams
+        return stream
+
+    def remove(self, *names):
+        """Stop capturing the given names (default : all, and detach)."""
+        if len(names) == 0:
+            names = tuple(self.streams)
+            if self.callback:
+                self.conn.remove_stream_update_callback(self._capture)
+                self.callback = False
+        streams = dict(self.streams)
+        for name in names:
+            streams.pop(name).remove()
+        self.streams = streams
+
+    def _read(self, number):
+        """Return a frame with the current values of the streams."""
+        streams = self.streams
+        values = []
+        for stream in streams.values():
+            try:
+                values.append(stream())
+            except Exception as e:
+                values.append(e)
+        return TelemetryFrame(tuple(streams), values, number, monotonic())
+
+    def _capture(self):
+        """Capture a frame, called by the stream update thread."""
+        frame = self._read(self.frames + 1)
+        with self.updated:
+            self.frames += 1
+            self.frame = frame
+            self.updated.notify_all()
+
+    def next(self, timeout=None):
+        """Wait for the next server update and return its frame.
+
+        Return the last frame if the timeout expired first.
+        """
+        if not self.callback:
+            # No update callbacks : read right after the update, the stream
+            # values are only replaced when the next message arrives
+            condition = self.conn.stream_update_condition
+            with condition:
+                self.conn.wait_for_stream_update(timeout)
+                self.frames += 1
+                self.frame = self._read(self.frames)
+            return self.frame
+
+        with self.updated:
+            last = self.frames
+            self.updated.wait_for(lambda: self.frames > last, timeout)
+            if self.frame is None:
+                self.frame = self._read(self.frames)
+            return self.frame
+
+    def latest(self):
+        """Return the last captured frame without waiting."""
+        with self.updated:
+            if self.frame is None:
+                self.frame = self._read(self.frames)
+            return self.frame
@@ -1,9 +1,112 @@
 """Regroup all the functions related to a vessel and its parts."""
 
 try:
+    from toolkit.batch import batchCall
     from toolkit.calculations import angle, getKerbinLocalGravity
+    from toolkit.fleet import vesselRenamed, vesselRetyped
+    from toolkit.streams import addStream
+    from toolkit.wait import waitAny, waitUntil
 except ModuleNotFoundError:
+    from batch import batchCall
     from calculations import angle, getKerbinLocalGravity
+    from fleet import vesselRenamed, vesselRetyped
+    from streams import addStream
+    from wait import waitAny, waitUntil
+
+
+# Part indexes shared by the toolkit, keyed by vessel
+_partIndexes = {}
+
+
+class PartIndex:
+    """Tag, title and module index of the parts of a vessel.
+
+    The tags and titles of every part are fetched in a single request.
+    Each lookup fetches the part list (one RPC) and rebuilds the index only
+    if it changed, so staging, decoupling and docking are picked up.
+    Module names are fetched (in one more request) on first use.
+    """
+
+    def __init__(self, vessel, conn=None):
+        """Initialize the index (nothing is fetched yet).
+
+        Args:
+        -vessel : the indexed vessel
+        -conn : return value of the initial krpc.connect() (default : the
+        client of the vessel)
+
+        """
+        self.vessel = vessel
+        self.conn = vessel._client if conn is None else conn
+        self.vesselParts = None
+        self.parts = None
+        self.tags = {}
+        self.titles = {}
+        self.modules = None
+
+    def update(self):
+        """Rebuild the index if the parts of the vessel changed."""
+        if self.vesselParts is None:
+            self.vesselParts = self.vessel.parts
+        parts = self.vesselParts.all
+        if parts == self.parts:
+            return
+
+        calls = []
+        for part in parts:
+            calls.append((getattr, part, 'tag'))
+            calls.append((getattr, part, 'title'))
+        results = batchCall(self.conn, calls)
+
+        self.parts = parts
+        self.tags = {}
+        self.titles = {}
+        self.modules = None
+        for i, part in enumerate(parts):
+            self.tags.setdefault(results[2*i], []).append(part)
+            self.titles.setdefault(results[2*i + 1], []).append(part)
+
+    def invalidate(self):
+        """Forget the parts, they will be fetched again on next lookup."""
+        self.parts = None
+
+    def byTag(self, partTag):
+        """Return the list of the parts tagged 'partTag'."""
+        self.update()
+        return list(self.tags.get(partTag, []))
+
+    def byTitle(self, partName):
+        """Return the list of the parts named 'partName'."""
+        self.update()
+        return list(self.titles.get(partName, []))
+
+    def byModule(self, moduleName):
+        """Return the list of the parts that have a module 'moduleName'."""
+        self.update()
+        if self.modules is None:
+            partModules = batchCall(self.conn, [(getattr, part, 'modules')
+                                                for part in self.parts])
+            owners = []
+            calls = []
+            for part, modules in zip(self.parts, partModules):
+                for mod in modules:
+                    owners.append(part)
+                    calls.append((getattr, mod, 'name'))
+            names = batchCall(self.conn, calls)
+
+            self.modules = {}
+            for part, name in zip(owners, names):
+                partList = self.modules.setdefault(name, [])
+                if part not in partList:
+                    partList.append(part)
+        return list(self.modules.get(moduleName, []))
+
+
+def getPartIndex(vessel, conn=None):
+    """Return the part index shared by the toolkit for this vessel."""
+    if vessel not in _partIndexes:
+        _partIndexes[vessel] = PartIndex(vessel, conn)
+    return _partIndexes[vessel]
 
 
 def toggleLights(vessel):
@@ -40,75 +143,90 @@ def deployFairing(vessel):
         f.jettison()
 
 
-def activateGPS(vessel, GPSPartTag='GNSS'):
+def activateGPS(vessel, GPSPartTag='GNSS', conn=None):
     """Activate the GPS transmitter.
     
     Only to be used with 'Kerbal GPS' mod.
     """
-    transmitters = getPartsByTag(vessel, GPSPartTag)
+    transmitters = getPartsByTag(vessel, GPSPartTag, conn)
     for part in transmitters:
         for mod in part.modules:
             if mod.has_event("Turn on GPS"):
                 mod.trigger_event("Turn on GPS")
 
-def getPartsByName(vessel, partName):
+
+def getPartsByName(vessel, partName, conn=None):
     """Return a list of all the parts named 'partName' of the vessel."""
-    partList = []
-    for part in vessel.parts.all:
-        if part.title == partName:  # case sensitive
-            partList.append(part)
-    return partList
+    return getPartIndex(vessel, conn).byTitle(partName)  # case sensitive
 
 
-def getPartsByTag(vessel, partTag):
+def getPartsByTag(vessel, partTag, conn=None):
     """Return a list of all the parts tagged 'partTag' of the vessel."""
-    partList = []
-    for part in vessel.parts.all:
-        if part.tag == partTag:  # case sensitive
-            partList.append(part)
-    return partList
+    return getPartIndex(vessel, conn).byTag(partTag)  # case sensitive
+
+
+def getPartsByModule(vessel, moduleName, conn=None):
+    """Return a list of all the parts of the vessel with the given module."""
+    return getPartIndex(vessel, conn).byModule(moduleName)
 
 
 def vesselChangeType(vessel, vesselType):
     """Change the type of the vessel."""
     vessel.type = vesselType
+    vesselRetyped(vessel, vesselType)
 
 
 def vesselChangeName(vessel, vesselName):
     """Change the name of the vessel."""
     vessel.name = vesselName
+    vesselRenamed(vessel, vesselName)
 
 
-def twrRegulation(vessel, meanAltitude, thrust, vesselMass, throttle, twrMax):
+def twrRegulation(vessel, meanAltitude, thrust, vesselMass, throttle, twrMax,
+                  control=None):
     """Adjust the throttle of the vessel to match the desired max twr.
 
+    The telemetry can be given as streams or as the values of a
+    TelemetryFrame, so that they all come from the same update.
     Args:
     -vessel : the vessel that is beeing controlled
-    -meanAltitude : stream of the mean altitude of the vessel
-    -thrust : stream of the thrust of the vessel
-    -vesselMass : stream of the mass of the vessel
-    -throttle : stream of the throttle of the vessel
+    -meanAltitude : stream (or value) of the mean altitude of the vessel
+    -thrust : stream (or value) of the thrust of the vessel
+    -vesselMass : stream (or value) of the mass of the vessel
+    -throttle : stream (or value) of the throttle of the vessel
     -twrMax : desired maximum twr
+    -control : ControlState of the vessel, if any (default : None)
 
     """
-    localGravity = getKerbinLocalGravity(meanAltitude())
-    twr = thrust() / (vesselMass() * localGravity)
+    meanAltitude, thrust, vesselMass, throttle = \
+        [x() if callable(x) else x
+         for x in (meanAltitude, thrust, vesselMass, throttle)]
+    localGravity = getKerbinLocalGravity(meanAltitude)
+    twr = thrust / (vesselMass * localGravity)
 
     if twrMax == 0.0:
-        vessel.control.throttle = 0.0
+        newThrottle = 0.0
+    elif (twr - 0.01) > twrMax:
+        newThrottle = throttle - abs(twr - twrMax) / 10
+    elif ((twr + 0.01) < twrMax) and (throttle < 1.0):
+        newThrottle = throttle + abs(twr - twrMax) / 10
     else:
-        if (twr - 0.01) > twrMax:
-            vessel.control.throttle -= abs(twr - twrMax) / 10
+        return
+    newThrottle = min(max(newThrottle, 0.0), 1.0)
 
-        if ((twr + 0.01) < twrMax) and (throttle() < 1.0):
-            vessel.control.throttle += abs(twr - twrMax) / 10
+    # A single write, the current value comes from the throttle stream
+    if control is None:
+        vessel.control.throttle = newThrottle
+    else:
+        control.throttle = newThrottle
+        control.flush()
 
 
 def vesselDeorbit(conn, vessel, rcs=True):
     """Deorbit the vessel and change its type to debris."""
-    ut = conn.add_stream(getattr, conn.space_center, 'ut')
-    thrust = conn.add_stream(getattr, vessel, 'thrust')
-    periapsisAlt = conn.add_stream(getattr, vessel.orbit, 'periapsis_altitude')
+    ut = addStream(conn, getattr, conn.space_center, 'ut')
+    thrust = addStream(conn, getattr, vessel, 'thrust')
+    periapsisAlt = addStream(conn, getattr, vessel.orbit, 'periapsis_altitude')
     vessel.control.speed_mode = conn.space_center.SpeedMode.orbit
     vessel.control.rcs = True
     vessel.control.sas = True
@@ -116,20 +234,17 @@ def vesselDeorbit(conn, vessel, rcs=True):
     if rcs == True:
         ut0 = ut()
         vessel.control.forward = -1.0
-        while ut() < (ut0 + 10.0):
-            pass
+        waitUntil(ut, lambda now: now >= ut0 + 10.0)
         vessel.control.rcs = False
 
     ut0 = ut()
     vessel.control.sas_mode = conn.space_center.SASMode.retrograde
-    while ut() < (ut0 + 10.0):
-        pass
+    waitUntil(ut, lambda now: now >= ut0 + 10.0)
     vessel.control.throttle = 1.0
 
-    while thrust() == 0.0:
-        pass
-    while (periapsisAlt() > -25000.0) and (thrust() != 0.0):
-        pass
+    waitUntil(thrust, lambda t: t != 0.0)
+    waitAny([(periapsisAlt, lambda alt: alt <= -25000.0),
+             (thrust, lambda t: t == 0.0)])
     vessel.control.throttle = 0.0
 
     vesselChangeType(vessel, conn.space_center.VesselType.debris)
@@ -0,0 +1,106 @@
+"""Regroup the functions used to wait for something to happen in game.
+
+They block the thread on the condition variables of kRPC streams (or on
+server side events) instead of spinning, so waiting costs no CPU and the
+client reacts on the first stream update where the condition is met.
+
+"""
+
+import threading
+from time import monotonic
+
+
+def _remaining(deadline):
+    """Return the time left before the deadline (None if no deadline)."""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - monotonic())
+
+
+def waitUntil(stream, predicate, timeout=None):
+    """Wait for predicate(stream()) to be True.
+
+    Return True once it is, or False if the timeout expired first.
+    Args:
+    -stream : kRPC stream that is watched
+    -predicate : function of the stream value
+    -timeout : max wall clock time to wait, in seconds (default : None)
+
+    """
+    deadline = None if timeout is None else monotonic() + timeout
+    stream()  # Make sure the stream is started
+    with stream.condition:
+        while not predicate(stream()):
+            remaining = _remaining(deadline)
+            if remaining == 0.0:
+                return False
+            stream.wait(remaining)
+    return True
+
+
+def waitAny(conditions, timeout=None):
+    """Wait for one of the (stream, predicate) pairs to be True.
+
+    Return the index of the first pair that is True, or None if the
+    timeout expired first.
+    Args:
+    -conditions : list of (stream, predicate) pairs
+    -timeout : max wall clock time to wait, in seconds (default : None)
+
+    """
+    deadline = None if timeout is None else monotonic() + timeout
+    wakeUp = threading.Condition()
+
+    def notify(value):
+        with wakeUp:
+            wakeUp.notify_all()
+
+    for stream, predicate in conditions:
+        stream()  # Make sure the stream is started
+        stream.add_callback(notify)
+
+    try:
+        with wakeUp:
+            while True:
+                for i, (stream, predicate) in enumerate(conditions):
+                    if predicate(stream()):
+                        return i
+                remaining = _remaining(deadline)
+                if remaining == 0.0:
+                    return None
+                wakeUp.wait(remaining)
+    finally:
+        for stream, predicate in conditions:
+            stream.remove_callback(notify)
+
+
+def waitEvent(conn, expression, timeout=None):
+    """Wait for a kRPC expression to be True on the server side.
+
+    The expression is evaluated by the server, the client only wakes up
+    when it becomes True. Return False if the timeout expired first.
+    """
+    event = conn.krpc.add_event(expression)
+    with event.condition:
+        event.wait(timeout)
+        triggered = event.stream()
+    event.remove()
+    return triggered
+
+
+def utReached(conn, ut):
+    """Return the server side expression 'the in game time reached ut'."""
+    expr = conn.krpc.Expression
+    utCall = conn.get_call(getattr, conn.space_center, 'ut')
+    return expr.greater_than_or_equal(expr.call(utCall),
+                                      expr.constant_double(ut))
+
+
+def waitUtAbsolute(conn, ut, timeout=None):
+    """Wait for the in game time to reach ut (in seconds)."""
+    return waitEvent(conn, utReached(conn, ut), timeout)
+
+
+def waitUt(conn, seconds, timeout=None):
+    """Wait for a certain in game time (in seconds)."""
+    return waitUtAbsolute(conn, conn.space_center.ut + seconds, timeout)